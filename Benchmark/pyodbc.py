@@ -0,0 +1,334 @@
+# ----------------------------------------------------------------------
+# @(#)Migration                      2021              SAP
+# ----------------------------------------------------------------------
+# Migration utilities to migrate SAP IQ on SAP datalake IQ.
+# ----------------------------------------------------------------------
+#
+# ***************************************************************************
+# Copyright (c) 2021 SAP SE or an SAP affiliate company. All rights reserved.
+# ***************************************************************************
+# Stand-in pyodbc module used by the extraction benchmark (run_benchmark.py).
+# It simulates the IQ catalog queries and the Temp_Extract file writes of migration.py
+# so that orchestration of extraction can be measured without an IQ server.
+# It is put first on PYTHONPATH of migration.py by run_benchmark.py, it is never used by the utilities.
+# Scenario is read from JSON file given by environment variable IQ_BENCH_CONFIG:
+#   tables                  : number of tables
+#   seed                    : seed of random generator
+#   size_distribution       : distribution of row counts of tables, pareto/uniform/fixed
+#   mean_rows               : mean row count of tables
+#   empty_every             : every n-th table is empty, 0 for none
+#   lob_every               : every n-th table has a LOB column, 0 for none
+#   query_latency_ms        : latency of every catalog query, number or [min, max] for uniform latency
+#   connect_latency_ms      : latency of connect
+#   extract_bytes_per_sec   : simulated extraction speed of one connection, 0 to not wait
+#   file_scale              : size of written files relative to simulated size
+#   fail_every              : extraction of every n-th table fails, 0 for none
+#   transient_fail_every    : extraction of every n-th table fails with a connection error (SQLSTATE 08S01)
+#                             its first transient_failures times in an extraction process, 0 for none
+#   transient_failures      : number of transient failures of such a table, default 1
+#   hang_every              : extraction of every n-th table hangs for hang_sec seconds, 0 for none
+#   hang_sec                : seconds an extraction hangs, default 3600
+#   lob_binary_bytes        : size of the largest value of a long binary column added to tables with a LOB column, 0 for none
+#   range_partitions        : dictionary of table number (from 0) and [partition key column, its domain, [upper bounds]] of range
+#                             partitioned tables, bounds as stored in SYSPARTITION, for example ["name", "varchar", ["<= ('M')", "MAX"]]
+#   lob_files               : number of files of LOB values written by single scan extraction of a LOB table or part
+#   temp_usage_pct          : temp space usage in percent returned by sp_iqdbspace, number or [min, max] for uniform usage
+#   user_connections        : number of connections returned by sp_iqconnection
+#   mpx_nodes               : list of [role (reader/writer), <host>:<port>, cores] of secondary nodes of a simulated multiplex,
+#                             empty for a simplex server. Cores of coordinator are given by cores.
+#   migration_config        : keys of migration_config.json of migration.py overridden by run_benchmark.py
+import os
+import re
+import json
+import time
+import random
+import decimal
+import itertools
+import threading
+
+_config_file = os.environ.get('IQ_BENCH_CONFIG')
+config = json.load(open(_config_file)) if _config_file else {}
+
+# Number of transient failures of each extraction statement in this process
+transient_failure_counts = {}
+
+class Error(Exception):
+    pass
+
+class OperationalError(Error):
+    pass
+
+class ProgrammingError(Error):
+    pass
+
+# Function which returns latency in seconds of a configured latency in milliseconds
+def latency(key):
+    value = config.get(key, 0)
+    if type(value) == list:
+        return random.uniform(value[0], value[1]) / 1000.0
+    return value / 1000.0
+
+# Function which returns row count of a table from size distribution of the scenario
+def table_rows(generator, mean_rows):
+    distribution = config.get('size_distribution', 'pareto')
+    if distribution == 'fixed':
+        return mean_rows
+    if distribution == 'uniform':
+        return int(generator.uniform(0, 2 * mean_rows))
+    # Pareto with shape 1.5 has mean 3 times its scale
+    return int(generator.paretovariate(1.5) * mean_rows / 3.0)
+
+# Function which creates the simulated tables of the scenario
+def generate_tables():
+    generator = random.Random(config.get('seed', 1))
+    mean_rows = config.get('mean_rows', 100000)
+    empty_every = config.get('empty_every', 7)
+    lob_every = config.get('lob_every', 0)
+    tables = []
+    for i in range(config.get('tables', 10)):
+        rows = table_rows(generator, mean_rows)
+        if empty_every and i % empty_every == empty_every - 1:
+            rows = 0
+        columns = [('id', 'integer', 1, 'N', 'autoincrement' if i % 4 == 0 else None, 4),
+                   ('name', 'varchar', 2, 'Y', None, 40),
+                   ('amount', 'numeric', 3, 'Y', None, 16)]
+        if lob_every and i % lob_every == lob_every - 1:
+            columns.append(('doc', 'long varchar', 4, 'Y', None, 1000))
+            if config.get('lob_binary_bytes', 0):
+                columns.append(('img', 'long binary', 5, 'Y', None, 1000))
+        tables.append({'id': 1000 + i, 'owner': 'DBA' if i % 2 else 'bench', 'name': 'T%d'%(i),
+                       'rows': rows, 'columns': columns})
+    return tables
+
+tables = generate_tables()
+tables_by_name = dict([((table['owner'].lower(), table['name'].lower()), table) for table in tables])
+tables_by_id = dict([(table['id'], table) for table in tables])
+connection_number = [0]
+connection_lock = threading.Lock()
+
+# Function which returns width in bytes of a row of a table
+def row_width(table):
+    return sum([column[5] for column in table['columns']])
+
+# Function which returns (table name, owner, table id, rows, size in KB) of all tables as sp_iqtablesize
+def table_sizes():
+    return [(table['name'], table['owner'], table['id'], table['rows'], max(1, table['rows'] * row_width(table) // 1024)) for table in tables]
+
+# Function which generates rows of a table fetched by migration.py, LOB values contain quotes and newlines
+# Every third long binary value is of lob_binary_bytes
+def fetched_rows(table):
+    for rowid in range(1, table['rows'] + 1):
+        row = [rowid, 'name "%d"'%(rowid), decimal.Decimal(rowid) / 100]
+        if len(table['columns']) > 3:
+            row.append(None if rowid % 10 == 0 else ('line %d,\n'%(rowid)) * (rowid % 50 + 1))
+        if len(table['columns']) > 4:
+            row.append(None if rowid % 10 == 0 else bytes([rowid % 256]) * (config['lob_binary_bytes'] if rowid % 3 == 1 else 10))
+        yield tuple(row)
+
+class Cursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = iter([])
+
+    def result(self, rows):
+        self.rows = iter(rows)
+        return self
+
+    def execute(self, sql, *params):
+        if self.conn.closed:
+            raise OperationalError('08003', 'Connection not open')
+        wait = latency('query_latency_ms')
+        if wait:
+            time.sleep(wait)
+        stmt = ' '.join(sql.split())
+        lower = stmt.lower()
+        options = self.conn.options
+        if lower.startswith('begin') and 'set temporary option' in lower:
+            for option, value in re.findall(r"set temporary option\s+([^;]+?)\s*=\s*([^;]*?);", stmt, re.I):
+                options[option.strip().strip('"').lower()] = value.strip().strip("'")
+            return self.result([])
+        match = re.match(r"set temporary option\s+(\S+)\s*=\s*(.*?);?$", stmt, re.I)
+        if match:
+            options[match.group(1).strip('"').lower()] = match.group(2).strip().strip("'")
+            return self.result([])
+        return self.result(self.catalog_query(stmt, lower))
+
+    # Function which returns result of a catalog or extraction query
+    def catalog_query(self, stmt, lower):
+        if '@@servername' in lower:
+            return [('benchiq',)]
+        if 'sysiqmpxserver' in lower and 'count' in lower:
+            return [(0,)]
+        if 'sysiqmpxserver' in lower:
+            return [(0,)] if lower.startswith('select role') else [('benchiq',)]
+        if 'db_name()' in lower:
+            return [('benchdb',)]
+        if 'collation' in lower:
+            return [('1252LATIN1',)]
+        if 'charset' in lower:
+            return [('windows-1252',)]
+        if '@@version' in lower:
+            return [('SAP IQ/16.1.040.1549/14297/P/sp04.08/Linux/64bit',)]
+        if "db_property('readonly')" in lower:
+            return [('On',)]
+        if 'sp_iqmpxinfo' in lower:
+            nodes = config.get('mpx_nodes', [])
+            if 'count(*)' in lower:
+                # Count of all nodes includes the coordinator, count with a filter only secondary nodes
+                return [(len(nodes) + (0 if 'where' in lower or not nodes else 1),)]
+            return [('host=%s'%(node[1]),) for node in nodes if "'%s'"%(node[0]) in lower]
+        if 'numlogicalprocessors' in lower:
+            for node in config.get('mpx_nodes', []):
+                if 'host=%s;'%(node[1]) in self.conn.connectstr.lower():
+                    return [(node[2],)]
+            return [(config.get('cores', 16),)]
+        if "connection_property('number')" in lower:
+            with connection_lock:
+                connection_number[0] += 1
+                return [(connection_number[0],)]
+        if lower.startswith('drop connection'):
+            return []
+        if 'sysoptions' in lower and 'string_rtruncation' in lower:
+            return [('On',)]
+        if 'sp_iqdbspace' in lower:
+            usage = config.get('temp_usage_pct', 10)
+            return [(random.uniform(usage[0], usage[1]) if type(usage) == list else usage,)]
+        if 'sp_iqconnection' in lower:
+            return [(config.get('user_connections', 5),)]
+        if "property('processcpu')" in lower:
+            return [(time.process_time(),)]
+        if 'sp_iqtablesize' in lower:
+            return table_sizes()
+        if 'syspartition' in lower:
+            rows = []
+            for index, (column, domain, bounds) in sorted(config.get('range_partitions', {}).items()):
+                table = tables[int(index)]
+                for position, bound in enumerate(bounds):
+                    rows.append((table['id'], position + 1, 'P%d'%(position + 1), column, position + 1, bound, domain))
+            return rows
+        if 'sysforeignkey' in lower and 'group by' in lower:
+            return []
+        if 'sysforeignkey' in lower:
+            return [(0,)]
+        if 'sum(width)' in lower:
+            return [(row_width(tables_by_id[int(re.search(r'table_id=(\d+)', lower).group(1))]),)]
+        match = re.search(r'where c.table_id = (\d+)', lower)
+        if 'syscolumn' in lower and match:
+            table = tables_by_id[int(match.group(1))]
+            return [(column[2], column[0], column[1], column[3], column[4]) for column in table['columns']]
+        if 'syscolumn' in lower and 'order by' in lower and 'c.table_id' in lower and "t.table_name='" not in lower:
+            return [(table['id'], column[2], column[0], column[1], column[3], column[4]) for table in tables for column in table['columns']]
+        if 'syscolumn' in lower and "t.table_name='" in lower:
+            table = tables_by_name[(re.search(r"u.user_name='([^']*)'", stmt, re.I).group(1).lower(),
+                                    re.search(r"t.table_name='([^']*)'", stmt, re.I).group(1).lower())]
+            if 'count(*)' in lower:
+                return [(len([column for column in table['columns'] if column[1] in ('long varchar', 'long binary')]),)]
+            if '"default"' in lower:
+                return [(column[4],) for column in table['columns']]
+            if 'c.nulls' in lower:
+                return [(column[0], column[1], column[3]) for column in table['columns']]
+            if 'domain_name' in lower:
+                return [(column[0], column[1], column[2]) for column in table['columns']]
+            return [(column[0],) for column in table['columns']]
+        if 'systable' in lower and 'is_rlv' in lower:
+            select_list = lower.split('from')[0]
+            if 'count(*)' in select_list and 'user_name' not in select_list:
+                return [(len(tables),)]
+            if 't.count' in lower or 'it.' in select_list:
+                return [(table['name'], table['owner'], table['id'], table['rows']) for table in tables]
+            return [(table['name'], table['owner'], table['id']) for table in tables]
+        match = re.search(r'from\s+"([^"]+)"\."([^"]+)"', stmt, re.I)
+        if match:
+            table = tables_by_name[(match.group(1).lower(), match.group(2).lower())]
+            select_list = lower.split(' from ')[0]
+            if 'min(rowid' in select_list:
+                return [(1 if table['rows'] else None, table['rows'] or None)]
+            if select_list.startswith('select count(*)'):
+                return [(table['rows'],)]
+            return self.extract(table, lower)
+        raise ProgrammingError('42000', 'Statement not simulated by benchmark pyodbc: %s'%(stmt[:200]))
+
+    # Function which simulates extraction of a table with Temp_Extract options set on the connection
+    def extract(self, table, lower):
+        options = self.conn.options
+        fail_every = config.get('fail_every', 0)
+        if fail_every and table['id'] % fail_every == 0:
+            raise Error('HY000', 'Simulated extraction failure of table %s'%(table['name']))
+        transient_fail_every = config.get('transient_fail_every', 0)
+        if transient_fail_every and table['id'] % transient_fail_every == 0:
+            key = (table['id'], re.sub(r'\s+', ' ', lower))
+            transient_failure_counts[key] = transient_failure_counts.get(key, 0) + 1
+            if transient_failure_counts[key] <= config.get('transient_failures', 1):
+                raise OperationalError('08S01', 'Simulated communication error: connection was terminated while extracting table %s'%(table['name']))
+        hang_every = config.get('hang_every', 0)
+        if hang_every and table['id'] % hang_every == 0:
+            time.sleep(config.get('hang_sec', 3600))
+        directory = options.get('temp_extract_directory', '')
+        prefix = options.get('temp_extract_file_prefix', '')
+        # Rows are fetched by migration.py when extraction is not enabled (LOB_Extract_Format Packed)
+        # and BFILE() pass of File_Per_Value format writes only files of LOB values, which are not simulated
+        if not directory or not prefix:
+            return [] if 'bfile(' in lower else fetched_rows(table)
+        fraction = 1.0
+        match = re.search(r'between (\d+) and (\d+)', lower)
+        if match and table['rows']:
+            fraction = (int(match.group(2)) - int(match.group(1)) + 1) / float(table['rows'])
+        size = int(table['rows'] * row_width(table) * fraction)
+        speed = config.get('extract_bytes_per_sec', 0)
+        if speed:
+            time.sleep(size / float(speed))
+        extension = options.get('temp_extract_file_extension', 'inp')
+        nfiles = max(1, min(int(options.get('temp_extract_max_parallel_degree', 1) or 1), 8))
+        file_size = int(size * config.get('file_scale', 1e-6) / nfiles) + 1
+        names = []
+        for k in range(nfiles):
+            name = '%s_%d.%s'%(prefix, k + 1, extension)
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(b'x' * file_size)
+            names.append(name)
+        # BFILE() in extraction query (LOB_Extract_Format Single_Scan) writes a file per LOB value,
+        # at most lob_files of them are simulated
+        if 'bfile(' in lower:
+            first = int(match.group(1)) if match else 1
+            for rowid in range(first, first + min(int(table['rows'] * fraction), config.get('lob_files', 100))):
+                with open(os.path.join(directory, '%s_row%d.4'%(prefix, rowid)), 'wb') as f:
+                    f.write(b'line %d' % (rowid))
+        with open(os.path.join(directory, '%sextractinfo'%(prefix)), 'w') as f:
+            f.write("rows: %d%sfiles: %s%s"%(int(table['rows'] * fraction), os.linesep, ','.join(["'%s'"%(name) for name in names]), os.linesep))
+        return []
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def fetchmany(self, size=1):
+        return list(itertools.islice(self.rows, size))
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+class Connection(object):
+    def __init__(self, connectstr):
+        self.connectstr = connectstr
+        self.options = {}
+        self.closed = False
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def connect(connectstr, timeout=0, **kwargs):
+    wait = latency('connect_latency_ms')
+    if wait:
+        time.sleep(wait)
+    return Connection(connectstr)
@@ -0,0 +1,223 @@
+# ----------------------------------------------------------------------
+# @(#)Migration                      2021              SAP
+# ----------------------------------------------------------------------
+# Migration utilities to migrate SAP IQ on SAP datalake IQ.
+# ----------------------------------------------------------------------
+#
+# ***************************************************************************
+# Copyright (c) 2021 SAP SE or an SAP affiliate company. All rights reserved.
+# ***************************************************************************
+# Benchmark of extraction orchestration of migration.py (scheduler queues, extraction processes,
+# status writers) without an IQ server. migration.py is run in data-only mode with the stand-in
+# pyodbc module of this directory, which simulates the IQ catalog and Temp_Extract file writes.
+# Throughput and latency of every scenario are computed from extraction_metrics.jsonl of the run
+# and recorded in a JSON result file, which can be compared with the result of another run.
+import subprocess
+import sys
+import os
+import json
+import getopt
+import shutil
+import datetime
+import tempfile
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+migration_dir = os.path.join(os.path.dirname(benchmark_dir), 'Migration')
+
+# Scenario settings of the stand-in pyodbc, see pyodbc.py
+default_scenario = {'seed': 1, 'size_distribution': 'pareto', 'mean_rows': 100000, 'empty_every': 7, 'lob_every': 0,
+                    'query_latency_ms': 1, 'connect_latency_ms': 5, 'extract_bytes_per_sec': 2000000000,
+                    'file_scale': 1e-6, 'fail_every': 0, 'migration_config': {}}
+
+usage = '''
+Usage:
+    run_benchmark.py [--tables <n>[,<n>...]] [--connections <n>] [--scenario <json file>] [--label <name>]
+                     [--results_dir <directory>] [--compare <result file>] [--timeout <seconds>]
+Same as:
+    run_benchmark.py [-t <n>[,<n>...]] [-c <n>] [-s <json file>] [-l <name>] [-r <directory>] [-p <result file>] [-o <seconds>]
+
+Switch Details:
+    --tables or -t          : Optional. Comma separated number of tables of each scenario. Default is 10,10000,100000.
+    --connections or -c     : Optional. Client_Num_Conn of migration.py. Default is 8.
+    --scenario or -s        : Optional. JSON file with settings of the stand-in pyodbc overriding the defaults, see pyodbc.py.
+    --label or -l           : Optional. Name of the run used in result file name. Default is run.
+    --results_dir or -r     : Optional. Directory of result files. Default is results directory in this directory.
+    --compare or -p         : Optional. Result file of an earlier run to compare with.
+    --timeout or -o         : Optional. Maximum seconds of each scenario. Default is 3600.
+'''
+
+# Function which returns the value at percentile p (0-100) of a list of values, None for an empty list
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+# Function which returns time of a metrics record in seconds since epoch
+def record_time(record):
+    return datetime.datetime.strptime(record['time'], '%Y-%m-%dT%H:%M:%S.%f').timestamp()
+
+# Function which writes config file of migration.py for a scenario and returns its path
+# migration_config of the scenario overrides keys of the config file, for example LOB_Extract_Format
+def write_migration_config(work_dir, connections, migration_config):
+    config = {"Datalake_Client_Install_Path": work_dir,
+              "Extract_Path": os.path.join(work_dir, "extract"),
+              "HDLFS_Configuration": {"Directory_Name": "Benchmark", "Files_endpoint": "bench.files.hdl",
+                                      "Cert_path": os.path.join(work_dir, "bench.crt"), "Key_path": os.path.join(work_dir, "bench.key")},
+              "Host_Name": "benchiq", "Port_Number": 2638, "DBA_User": "DBA", "DBA_Pwd": "benchmark",
+              "Client_Num_Conn": connections, "IQ_Server_On_Same_Host": "Yes", "IQ_Host_Login_Id": "", "IQ_Host_Login_Pwd": "",
+              "ENC": "", "Batch_Size_GB": 0, "Table_Inventory_Mode": "Catalog", "Verify_Exact_Row_Counts": "No",
+              "IQ_Server_Install_Path": work_dir, "IQ_Version": "16.1"}
+    config.update(migration_config)
+    os.makedirs(config["Extract_Path"])
+    config_file = os.path.join(work_dir, "migration_config.json")
+    with open(config_file, "w") as f:
+        json.dump(config, f, indent=1)
+    return config_file
+
+# Function which computes throughput and latency of a run from its extraction_metrics.jsonl
+def summarize_metrics(metrics_file, connections, file_scale):
+    records = []
+    with open(metrics_file) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    extract_records = [record for record in records if record['phase'] == 'extract' and record['status'] == 'ok']
+    if not extract_records:
+        return {}
+    # Start and end of every table, from start of its first extract to end of its last phase
+    table_start = {}
+    table_end = {}
+    for record in records:
+        end = record_time(record)
+        start = end - record['wall_time_sec']
+        if record['phase'] == 'extract':
+            table_start[record['table_id']] = min(table_start.get(record['table_id'], start), start)
+        table_end[record['table_id']] = max(table_end.get(record['table_id'], end), end)
+    window = max(table_end.values()) - min(table_start.values())
+    extract_times = [record['wall_time_sec'] for record in extract_records]
+    table_latencies = [table_end[tableid] - table_start[tableid] for tableid in table_start]
+    busy = sum(extract_times)
+    simulated_bytes = sum([record['bytes'] for record in extract_records]) / float(file_scale)
+    return {'tables_extracted': len(table_start),
+            'failed_phases': len([record for record in records if record['status'] != 'ok']),
+            'extract_window_sec': round(window, 3),
+            'tables_per_sec': round(len(table_start) / window, 2) if window > 0 else None,
+            'simulated_bytes_per_sec': int(simulated_bytes / window) if window > 0 else None,
+            'extract_sec_p50': round(percentile(extract_times, 50), 4),
+            'extract_sec_p99': round(percentile(extract_times, 99), 4),
+            'table_latency_sec_p50': round(percentile(table_latencies, 50), 4),
+            'table_latency_sec_p95': round(percentile(table_latencies, 95), 4),
+            'table_latency_sec_p99': round(percentile(table_latencies, 99), 4),
+            'table_latency_sec_max': round(max(table_latencies), 4),
+            # Share of connection time not spent in extraction statements, i.e. orchestration overhead and idle time
+            'connection_idle_share': round(1 - busy / (connections * window), 4) if window > 0 else None}
+
+# Function which runs migration.py in data-only mode for one scenario and returns its result
+def run_scenario(tables, connections, scenario, timeout):
+    work_dir = tempfile.mkdtemp(prefix="iq_bench_%s_"%(tables))
+    settings = dict(scenario)
+    settings['tables'] = tables
+    scenario_file = os.path.join(work_dir, "scenario.json")
+    with open(scenario_file, "w") as f:
+        json.dump(settings, f, indent=1)
+    config_file = write_migration_config(work_dir, connections, settings.get('migration_config', {}))
+
+    env_vars = os.environ.copy()
+    env_vars["IQ_BENCH_CONFIG"] = scenario_file
+    env_vars["PYTHONPATH"] = benchmark_dir + os.pathsep + env_vars.get("PYTHONPATH", "")
+    print("Running scenario of %s tables with %s connections, work directory %s"%(tables,connections,work_dir))
+    start = datetime.datetime.now()
+    with open(os.path.join(work_dir, "stdout.txt"), "w") as out:
+        try:
+            output = subprocess.run([sys.executable, "migration.py", "-f", config_file, "-d", "y"], cwd=migration_dir, env=env_vars,
+                                    input="yes\n", universal_newlines=True, stdout=out, stderr=subprocess.STDOUT, timeout=timeout)
+            returncode = output.returncode
+        except subprocess.TimeoutExpired:
+            returncode = None
+    total_sec = (datetime.datetime.now() - start).total_seconds()
+    # migration.py writes its log in its working directory
+    migration_log = os.path.join(migration_dir, "migration.log")
+    if os.path.isfile(migration_log):
+        shutil.move(migration_log, os.path.join(work_dir, "migration.log"))
+
+    result = {'tables': tables, 'connections': connections, 'returncode': returncode, 'total_sec': round(total_sec, 3), 'work_dir': work_dir}
+    metrics_file = os.path.join(work_dir, "extract", "Migration_Data", "extraction_metrics.jsonl")
+    if os.path.isfile(metrics_file):
+        result.update(summarize_metrics(metrics_file, connections, settings['file_scale']))
+    if returncode != 0:
+        print("migration.py did not complete for scenario of %s tables, please check %s"%(tables,work_dir))
+    return result
+
+# Function which prints results of scenarios, with change in percent against results of an earlier run
+def print_results(results, previous):
+    keys = ['total_sec', 'tables_extracted', 'tables_per_sec', 'simulated_bytes_per_sec', 'extract_sec_p99',
+            'table_latency_sec_p50', 'table_latency_sec_p99', 'table_latency_sec_max', 'connection_idle_share']
+    previous_by_tables = {}
+    if previous:
+        previous_by_tables = dict([(result['tables'], result) for result in previous['results']])
+    for result in results:
+        print("-" * 90)
+        print("Scenario: %s tables, %s connections"%(result['tables'],result['connections']))
+        earlier = previous_by_tables.get(result['tables'], {})
+        for key in keys:
+            value = result.get(key)
+            line = "  %-28s: %s"%(key, value)
+            if earlier.get(key) and value is not None:
+                line = line + "  (%+.1f%% against %s)"%((value - earlier[key]) * 100.0 / earlier[key], earlier[key])
+            print(line)
+    print("-" * 90)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ht:c:s:l:r:p:o:", ["help", "tables=", "connections=", "scenario=", "label=", "results_dir=", "compare=", "timeout="])
+    except getopt.GetoptError as err:
+        print(str(err))
+        print(usage)
+        sys.exit(2)
+
+    table_counts = [10, 10000, 100000]
+    connections = 8
+    scenario = dict(default_scenario)
+    label = "run"
+    results_dir = os.path.join(benchmark_dir, "results")
+    previous = None
+    timeout = 3600
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit(0)
+        elif opt in ("-t", "--tables"):
+            table_counts = [int(value) for value in arg.split(',')]
+        elif opt in ("-c", "--connections"):
+            connections = int(arg)
+        elif opt in ("-s", "--scenario"):
+            with open(arg) as f:
+                scenario.update(json.load(f))
+        elif opt in ("-l", "--label"):
+            label = arg
+        elif opt in ("-r", "--results_dir"):
+            results_dir = arg
+        elif opt in ("-p", "--compare"):
+            with open(arg) as f:
+                previous = json.load(f)
+        elif opt in ("-o", "--timeout"):
+            timeout = int(arg)
+
+    results = []
+    for tables in table_counts:
+        results.append(run_scenario(tables, connections, scenario, timeout))
+
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    result_file = os.path.join(results_dir, "%s_%s.json"%(label, datetime.datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(result_file, "w") as f:
+        json.dump({'label': label, 'time': datetime.datetime.now().isoformat(), 'scenario': scenario, 'results': results}, f, indent=1)
+    print_results(results, previous)
+    print("Results are recorded in %s"%(result_file))
+
+if __name__ == '__main__':
+    main()
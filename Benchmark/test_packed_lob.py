@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------
+# @(#)Migration                      2021              SAP
+# ----------------------------------------------------------------------
+# Migration utilities to migrate SAP IQ on SAP datalake IQ.
+# ----------------------------------------------------------------------
+#
+# ***************************************************************************
+# Copyright (c) 2021 SAP SE or an SAP affiliate company. All rights reserved.
+# ***************************************************************************
+# Test of LOB_Extract_Format Packed. migration.py is run in data-only mode with the stand-in pyodbc module
+# of this directory, as by run_benchmark.py, on tables with multi-line long varchar values and long binary
+# values larger than LOB_Segment_Size_MB. Segment files are read back with the options of the load table
+# statement (quotes on, escapes off, row delimiter of packed format) and compared with the fetched rows.
+import os
+import io
+import csv
+import shutil
+import unittest
+import importlib.util
+
+import run_benchmark
+
+segment_size = 1024 * 1024
+row_delimiter = b"\x1e\n"
+# Hexadecimal long binary values are larger than the default field limit of csv
+csv.field_size_limit(4 * segment_size)
+
+scenario = dict(run_benchmark.default_scenario)
+scenario.update({'size_distribution': 'fixed', 'mean_rows': 40, 'empty_every': 0, 'lob_every': 2,
+                 'lob_binary_bytes': segment_size + 100000,
+                 'migration_config': {'LOB_Extract_Format': 'Packed', 'LOB_Segment_Size_MB': 1}})
+
+# Function which loads the stand-in pyodbc module with the scenario of a run, to generate the rows it returned
+def load_stand_in(scenario_file):
+    os.environ['IQ_BENCH_CONFIG'] = scenario_file
+    spec = importlib.util.spec_from_file_location('bench_pyodbc', os.path.join(run_benchmark.benchmark_dir, 'pyodbc.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class PackedLobTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.result = run_benchmark.run_scenario(4, 2, scenario, 600)
+        cls.work_dir = cls.result['work_dir']
+        cls.stand_in = load_stand_in(os.path.join(cls.work_dir, 'scenario.json'))
+        cls.datapath = os.path.join(cls.work_dir, 'extract', 'Migration_Data', 'Extracted_Data')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def lob_tables(self):
+        return [table for table in self.stand_in.tables if len(table['columns']) > 3]
+
+    def test_run_completes(self):
+        self.assertEqual(self.result['returncode'], 0)
+        self.assertFalse(os.path.isfile(os.path.join(self.work_dir, 'extract', 'Migration_Data', 'extractFailure.err')))
+
+    def test_segments_read_back_as_fetched_rows(self):
+        self.assertTrue(self.lob_tables())
+        for table in self.lob_tables():
+            directory = os.path.join(self.datapath, str(table['id']))
+            with open(os.path.join(directory, '%sextractinfo'%(table['id']))) as f:
+                names = [name.strip("'") for name in f.read().split('files:')[1].strip().split(',')]
+            rows = []
+            for name in names:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    data = f.read()
+                # A row is never split between segment files, a file larger than the segment size holds one row
+                self.assertTrue(data.endswith(row_delimiter))
+                records = data[:-len(row_delimiter)].split(row_delimiter)
+                if len(data) > segment_size:
+                    self.assertEqual(len(records), 1)
+                rows.extend(records)
+
+            expected = list(self.stand_in.fetched_rows(table))
+            self.assertEqual(len(rows), len(expected))
+            for record, row in zip(rows, expected):
+                text = record.decode('windows-1252')
+                fields = next(csv.reader(io.StringIO(text, newline=''), quotechar='"', doublequote=True))
+                self.assertEqual(len(fields), len(row))
+                self.assertEqual(int(fields[0]), row[0])
+                self.assertEqual(fields[1], row[1])
+                self.assertEqual(fields[3], row[3] if row[3] is not None else 'NULL')
+                if row[4] is None:
+                    self.assertEqual(fields[4], 'NULL')
+                else:
+                    self.assertEqual(bytes.fromhex(fields[4]), row[4])
+            self.assertTrue(any('\n' in (row[3] or '') for row in expected))
+            self.assertTrue(any(len(row[4] or b'') > segment_size for row in expected))
+
+    def test_load_statement_row_delimiter(self):
+        for table in self.lob_tables():
+            with open(os.path.join(self.datapath, str(table['id']), '%s.sql'%(table['id']))) as f:
+                statement = f.read()
+            self.assertIn("escapes off quotes on", statement)
+            self.assertIn("row delimited by '\\x1e\\n'", statement)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# ----------------------------------------------------------------------
+# @(#)Migration                      2021              SAP
+# ----------------------------------------------------------------------
+# Migration utilities to migrate SAP IQ on SAP datalake IQ.
+# ----------------------------------------------------------------------
+#
+# ***************************************************************************
+# Copyright (c) 2021 SAP SE or an SAP affiliate company. All rights reserved.
+# ***************************************************************************
+# Test of extraction of range partitioned tables in parts. migration.py is run in data-only mode with the
+# stand-in pyodbc module of this directory, as by run_benchmark.py, on tables range partitioned on char,
+# date and integer columns. Predicates of the partitions recorded in ExtractedRanges.out must quote
+# the bounds of char and date columns, with embedded quotes doubled, and leave numeric bounds as they are.
+import os
+import shutil
+import unittest
+
+import run_benchmark
+
+scenario = dict(run_benchmark.default_scenario)
+scenario.update({'size_distribution': 'fixed', 'mean_rows': 100, 'empty_every': 0,
+                 'range_partitions': {'0': ['name', 'varchar', ["<= ('M')", "<= (O'Brien)", "MAX"]],
+                                      '1': ['created', 'date', ["<= ('2020-01-01')", "<= (2021-06-30)", "MAX"]],
+                                      '2': ['id', 'integer', ["<= (50)", "MAX"]]}})
+
+expected = {'1000': ['("name" <= \'M\' OR "name" IS NULL)',
+                     '"name" > \'M\' AND "name" <= \'O\'\'Brien\'',
+                     '"name" > \'O\'\'Brien\''],
+            '1001': ['("created" <= \'2020-01-01\' OR "created" IS NULL)',
+                     '"created" > \'2020-01-01\' AND "created" <= \'2021-06-30\'',
+                     '"created" > \'2021-06-30\''],
+            '1002': ['("id" <= 50 OR "id" IS NULL)',
+                     '"id" > 50']}
+
+class RangePartitionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.result = run_benchmark.run_scenario(4, 2, scenario, 600)
+        cls.work_dir = cls.result['work_dir']
+        cls.migration_data = os.path.join(cls.work_dir, 'extract', 'Migration_Data')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def test_run_completes(self):
+        self.assertEqual(self.result['returncode'], 0)
+        self.assertFalse(os.path.isfile(os.path.join(self.migration_data, 'extractFailure.err')))
+
+    def test_partition_predicates(self):
+        predicates = {}
+        with open(os.path.join(self.migration_data, 'ExtractedRanges.out')) as f:
+            for line in f:
+                tableid, part, nparts, subdir, predicate = line.rstrip('\n').split(',', 4)
+                predicates.setdefault(tableid, {})[int(part)] = predicate
+                self.assertEqual(subdir, 'partition_%s'%(part))
+        for tableid in expected:
+            self.assertEqual([predicates[tableid][part] for part in sorted(predicates[tableid])], expected[tableid])
+
+if __name__ == '__main__':
+    unittest.main()
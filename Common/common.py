@@ -15,6 +15,8 @@ import logging
 import json
 import sys,getopt
 import datetime
+import gzip
+import random
 from sys import byteorder
 
 global double_divider_line
@@ -37,6 +39,28 @@ else:
     path_sep = "/"
     newline = "\n"
 
+# Compression codecs of extracted data files as name: (file extension, default level, maximum level, open function)
+# Only codecs read by LOAD TABLE of data lake Relational Engine can be added here
+global compression_codecs
+compression_codecs = {'gzip': ('gz', 1, 9, gzip.open), 'none': (None, None, None, None)}
+
+# Table classes of Compression and their default (codec, level)
+# Binary are tables without LOB columns extracted in binary format, LOB are tables with LOB columns extracted as text
+global compression_defaults
+compression_defaults = {'binary': ('gzip', 1), 'lob': ('none', None)}
+
+# SQLSTATE classes of transient errors: connection exception, transaction rollback and timeout
+global transient_sqlstates
+transient_sqlstates = ('08', '40', 'HYT')
+
+# Messages (in lower case) of transient errors of SAP IQ, data lake Relational Engine and data lake Files
+global transient_error_patterns
+transient_error_patterns = ['communication error', 'connection reset', 'connection was terminated', 'connection refused', 'connection aborted',
+                            'connection timed out', 'broken pipe', 'timed out', 'timeout expired', 'database server not found',
+                            'run out of space', 'out of temp space', 'temp space', 'deadlock', 'resource temporarily unavailable',
+                            'http 500', 'http 502', 'http 503', 'http 504', 'internal server error', 'bad gateway',
+                            'service unavailable', 'gateway timeout', 'too many requests', 'try again']
+
 def file_input(config_file,util):
     # Opening JSON file
     f = open('%s'%(config_file),)
@@ -279,6 +303,49 @@ def premig_inputs(config_file,util):
         else :
             client_pwd = getpass.getpass("Enter IQ host login password: ")
 
+# Function which classifies an error of extraction, upload or load as 'transient' or 'permanent'
+# exp is the exception or the error message. Errors of pyodbc have SQLSTATE as first argument.
+def classify_error(exp):
+    if exp is None:
+        return 'permanent'
+    args = getattr(exp, 'args', ())
+    if len(args) > 1 and isinstance(args[0], str) and len(args[0]) == 5 and args[0].upper().startswith(transient_sqlstates):
+        return 'transient'
+    message = str(exp).lower()
+    for pattern in transient_error_patterns:
+        if pattern in message:
+            return 'transient'
+    return 'permanent'
+
+# Function which returns seconds to wait before a retry of a transient error, attempt is 1 for first retry
+# Wait doubles with every attempt from Retry_Backoff_Sec up to 32 times of it, with jitter of 20%
+# so that connections which failed together do not retry together
+def retry_backoff(attempt):
+    wait = retry_backoff_sec * (2 ** min(attempt - 1, 5))
+    return wait * random.uniform(0.8, 1.2)
+
+# Function which reads the retry config of transient errors, same for migration and load utilities
+def retry_inputs(config_file):
+    global max_retries
+    max_retries = optional_input('Max_Retries',3)
+    if type(max_retries) != int or max_retries < 0:
+        sys.exit("Please enter integer value greater than or equal to 0 for Max_Retries in %s file"%config_file)
+
+    global retry_backoff_sec
+    retry_backoff_sec = optional_input('Retry_Backoff_Sec',30)
+    if type(retry_backoff_sec) != int or retry_backoff_sec < 1:
+        sys.exit("Please enter integer value greater than 0 for Retry_Backoff_Sec in %s file"%config_file)
+
+# Function which returns value of an optional key of config file
+# Returns default if key is not present or its value is left as <Optional...> placeholder
+def optional_input(key,default):
+    if key not in data:
+        return default
+    value = data[key]
+    if (str(value).startswith('<Optional')):
+        return default
+    return value
+
 def mig_inputs(config_file,util):
 
     file_input(config_file,util)
@@ -312,6 +379,143 @@ def mig_inputs(config_file,util):
     if type(batch_size) != int or ( batch_size < batch_size_100GB and batch_size != 0 ):
         sys.exit("Please enter integer value greater than or equal to 100GB for Batch_Size in %s file"%config_file)
 
+    global batch_mode
+    batch_mode = optional_input('Batch_Mode','Interactive')
+    if type(batch_mode) != str or batch_mode.strip().lower() not in ('interactive','unattended'):
+        sys.exit("Please enter valid value (Interactive/Unattended) for Batch_Mode in %s file"%config_file)
+    batch_mode = batch_mode.strip().lower()
+    if batch_mode == 'unattended' and platform.system() == "Windows":
+        sys.exit("Batch_Mode Unattended is supported only on Linux. Please change Batch_Mode in %s file"%config_file)
+
+    global inventory_mode
+    inventory_mode = optional_input('Table_Inventory_Mode','Exact')
+    if type(inventory_mode) != str or inventory_mode.strip().lower() not in ('exact','catalog'):
+        sys.exit("Please enter valid value (Exact/Catalog) for Table_Inventory_Mode in %s file"%config_file)
+    inventory_mode = inventory_mode.strip().lower()
+
+    global verify_row_counts
+    verify_row_counts = optional_input('Verify_Exact_Row_Counts','No')
+    if type(verify_row_counts) != str or verify_row_counts.strip().lower() not in ('yes','no'):
+        sys.exit("Please enter valid value (Yes/No) for Verify_Exact_Row_Counts in %s file"%config_file)
+    verify_row_counts = (verify_row_counts.strip().lower() == 'yes')
+
+    global split_table_size
+    # Input of split_table_size is in GB, convert into Bytes
+    split_table_size = optional_input('Split_Table_Size_GB',0)
+    if type(split_table_size) != int or split_table_size < 0:
+        sys.exit("Please enter integer value greater than or equal to 0 for Split_Table_Size_GB in %s file"%config_file)
+    split_table_size = split_table_size * convert_to_bytes
+
+    global split_table_ranges
+    split_table_ranges = optional_input('Split_Table_Ranges',0)
+    if type(split_table_ranges) != int or split_table_ranges == 1 or split_table_ranges < 0:
+        sys.exit("Please enter integer value greater than 1 for Split_Table_Ranges in %s file"%config_file)
+
+    global node_affinity
+    node_affinity = optional_input('Node_Affinity',{})
+    if type(node_affinity) != dict:
+        sys.exit("Please enter valid value for Node_Affinity in %s file. It should be a JSON object of <owner>.<table name> and <host>:<port> of MPX node."%config_file)
+    for table in node_affinity:
+        if type(node_affinity[table]) != str or not node_affinity[table].strip():
+            sys.exit("Please enter valid string value of MPX node for table %s in Node_Affinity in %s file"%(table,config_file))
+
+    global compression
+    compression = dict(compression_defaults)
+    compression_input = optional_input('Compression',{})
+    if type(compression_input) != dict:
+        sys.exit("Please enter valid value for Compression in %s file. It should be a JSON object of table class (Binary/LOB) and <codec> or <codec>:<level>."%config_file)
+    for table_class in compression_input:
+        if table_class.strip().lower() not in compression_defaults:
+            sys.exit("Please enter valid table class (Binary/LOB) instead of %s in Compression in %s file"%(table_class,config_file))
+        value = compression_input[table_class]
+        if type(value) != str or value.split(':')[0].strip().lower() not in compression_codecs:
+            sys.exit("Please enter valid codec (%s) for %s in Compression in %s file"%("/".join(sorted(compression_codecs)),table_class,config_file))
+        codec = value.split(':')[0].strip().lower()
+        level = compression_codecs[codec][1]
+        if ':' in value:
+            level = value.split(':',1)[1].strip()
+            if codec == 'none' or not level.isdigit() or int(level) < 1 or int(level) > compression_codecs[codec][2]:
+                sys.exit("Please enter valid level for %s in Compression in %s file. It should be from 1 to maximum level of the codec."%(table_class,config_file))
+            level = int(level)
+        compression[table_class.strip().lower()] = (codec, level)
+
+    global lob_extract_format
+    lob_extract_format = optional_input('LOB_Extract_Format','File_Per_Value')
+    if type(lob_extract_format) != str or lob_extract_format.strip().lower() not in ('file_per_value','single_scan','packed'):
+        sys.exit("Please enter valid value (File_Per_Value/Single_Scan/Packed) for LOB_Extract_Format in %s file"%config_file)
+    lob_extract_format = lob_extract_format.strip().lower()
+
+    global lob_segment_size
+    # Input of lob_segment_size is in MB, convert into Bytes
+    lob_segment_size = optional_input('LOB_Segment_Size_MB',1024)
+    if type(lob_segment_size) != int or lob_segment_size < 1:
+        sys.exit("Please enter integer value greater than 0 for LOB_Segment_Size_MB in %s file"%config_file)
+    lob_segment_size = lob_segment_size*1024*1024
+
+    global table_extract_timeout
+    # Input of table_extract_timeout is in minutes, convert into seconds
+    table_extract_timeout = optional_input('Table_Extract_Timeout_Min',0)
+    if type(table_extract_timeout) != int or table_extract_timeout < 0:
+        sys.exit("Please enter integer value greater than or equal to 0 for Table_Extract_Timeout_Min in %s file"%config_file)
+    table_extract_timeout = table_extract_timeout * 60
+
+    retry_inputs(config_file)
+
+    global node_max_conn
+    node_max_conn = optional_input('Node_Max_Conn',{})
+    if type(node_max_conn) != dict:
+        sys.exit("Please enter valid value for Node_Max_Conn in %s file. It should be a JSON object of <host>:<port> of MPX node and number of connections."%config_file)
+    for node in node_max_conn:
+        if type(node_max_conn[node]) != int or node_max_conn[node] < 1:
+            sys.exit("Please enter integer value greater than 0 for node %s in Node_Max_Conn in %s file"%(node,config_file))
+
+    global role_weights
+    role_weights = optional_input('Role_Weights',{})
+    if type(role_weights) != dict:
+        sys.exit("Please enter valid value for Role_Weights in %s file. It should be a JSON object of role of MPX node (Coordinator/Reader/Writer) and its weight."%config_file)
+    role_weights = dict([(role.strip().lower(), weight) for role, weight in role_weights.items()])
+    for role in role_weights:
+        if role not in ('coordinator','reader','writer'):
+            sys.exit("Please enter valid role (Coordinator/Reader/Writer) in place of %s in Role_Weights in %s file"%(role,config_file))
+        if type(role_weights[role]) not in (int, float) or role_weights[role] <= 0:
+            sys.exit("Please enter number greater than 0 for role %s in Role_Weights in %s file"%(role,config_file))
+
+    global node_weights
+    node_weights = optional_input('Node_Weights',{})
+    if type(node_weights) == str and node_weights.strip().lower() == 'cores':
+        node_weights = 'cores'
+    elif type(node_weights) != dict:
+        sys.exit("Please enter valid value for Node_Weights in %s file. It should be Cores or a JSON object of <host>:<port> of MPX node and its weight."%config_file)
+    else:
+        for node in node_weights:
+            if type(node_weights[node]) not in (int, float) or node_weights[node] <= 0:
+                sys.exit("Please enter number greater than 0 for node %s in Node_Weights in %s file"%(node,config_file))
+
+    global throttle_interval
+    throttle_interval = optional_input('Throttle_Interval_Sec',0)
+    if type(throttle_interval) != int or throttle_interval < 0:
+        sys.exit("Please enter integer value greater than or equal to 0 for Throttle_Interval_Sec in %s file"%config_file)
+
+    global throttle_max_temp_pct
+    throttle_max_temp_pct = optional_input('Throttle_Max_Temp_Pct',80)
+    if type(throttle_max_temp_pct) != int or throttle_max_temp_pct < 1 or throttle_max_temp_pct > 100:
+        sys.exit("Please enter integer value between 1 and 100 for Throttle_Max_Temp_Pct in %s file"%config_file)
+
+    global throttle_max_cpu_pct
+    throttle_max_cpu_pct = optional_input('Throttle_Max_CPU_Pct',90)
+    if type(throttle_max_cpu_pct) != int or throttle_max_cpu_pct < 1 or throttle_max_cpu_pct > 100:
+        sys.exit("Please enter integer value between 1 and 100 for Throttle_Max_CPU_Pct in %s file"%config_file)
+
+    global throttle_max_user_conn
+    throttle_max_user_conn = optional_input('Throttle_Max_User_Conn',0)
+    if type(throttle_max_user_conn) != int or throttle_max_user_conn < 0:
+        sys.exit("Please enter integer value greater than or equal to 0 for Throttle_Max_User_Conn in %s file"%config_file)
+
+    global throttle_min_conn
+    throttle_min_conn = optional_input('Throttle_Min_Conn',1)
+    if type(throttle_min_conn) != int or throttle_min_conn < 1:
+        sys.exit("Please enter integer value greater than 0 for Throttle_Min_Conn in %s file"%config_file)
+
     object_store_hdlfs(config_file)
 
     if same_host == False:
@@ -442,6 +646,14 @@ def load_inputs(config_file,util):
     except KeyError:
         sys.exit("Error: Please add Object_Store_Copy_Validation key in %s file"%config_file)
 
+    # Number of tables uploaded in parallel to data lake Files when data is loaded in pipeline mode
+    global pipeline_upload_conn
+    pipeline_upload_conn = optional_input('Pipeline_Upload_Conn',4)
+    if type(pipeline_upload_conn) != int or pipeline_upload_conn < 1:
+        sys.exit("Error: Please enter integer value greater than 0 for Pipeline_Upload_Conn in %s file"%config_file)
+
+    retry_inputs(config_file)
+
     global charset
     global conn
     ENC="tls(tls_type=rsa;direct=yes)"
@@ -0,0 +1,220 @@
+# ----------------------------------------------------------------------
+# @(#)Migration                      2021              SAP
+# ----------------------------------------------------------------------
+# Migration utilities to migrate SAP IQ on SAP datalake IQ.
+# ----------------------------------------------------------------------
+#
+# ***************************************************************************
+# Copyright (c) 2021 SAP SE or an SAP affiliate company. All rights reserved.
+# ***************************************************************************
+# Run state of migration and load utilities.
+# One row per table with its extraction and load status is kept in an SQLite database
+# (migration_state.db in Migration_Data directory). Every status change is written in its own
+# transaction, so state of a run which is stopped in between is consistent for resume.
+# iq_tables.list, ExtractedTables.out and HDL_LoadedTables.out are still written for compatibility.
+# Upload status of a table is used when extraction, upload and load run as a pipeline.
+# run_state keeps state of the utilities themselves, for example whether extraction is still running.
+import sqlite3
+import codecs
+
+global state_file_name
+state_file_name = "migration_state.db"
+
+# Seconds between heartbeats of a running extraction in run state
+global heartbeat_interval
+heartbeat_interval = 60
+
+# Function which opens the state database and creates the state table if it does not exist
+def open_state(state_file):
+    conn = sqlite3.connect(state_file, timeout=60)
+    with conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS table_state (
+                            table_name TEXT PRIMARY KEY,
+                            row_count INTEGER,
+                            table_size INTEGER,
+                            table_id TEXT,
+                            table_type TEXT,
+                            batch INTEGER NOT NULL DEFAULT 0,
+                            extract_status TEXT NOT NULL DEFAULT 'pending',
+                            extract_error TEXT,
+                            load_status TEXT NOT NULL DEFAULT 'pending',
+                            load_rowcount INTEGER,
+                            load_error TEXT,
+                            updated_at TEXT)""")
+        # Upload columns are added to state database created without them
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(table_state)")]
+        if 'upload_status' not in columns:
+            conn.execute("ALTER TABLE table_state ADD COLUMN upload_status TEXT NOT NULL DEFAULT 'pending'")
+            conn.execute("ALTER TABLE table_state ADD COLUMN upload_error TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS table_state_extract ON table_state (batch, extract_status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS table_state_load ON table_state (extract_status, load_status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS table_state_upload ON table_state (extract_status, upload_status)")
+        # Rowid range parts of tables larger than batch size, each part is extracted in its own batch
+        conn.execute("""CREATE TABLE IF NOT EXISTS batch_parts (
+                            table_name TEXT,
+                            part INTEGER,
+                            nparts INTEGER,
+                            batch INTEGER,
+                            upload_status TEXT NOT NULL DEFAULT 'pending',
+                            PRIMARY KEY (table_name, part))""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS run_state (
+                            name TEXT PRIMARY KEY,
+                            value TEXT,
+                            updated_at TEXT)""")
+    return conn
+
+# Function which returns number of tables in state database
+def table_count(conn):
+    return conn.execute("SELECT count(*) FROM table_state").fetchone()[0]
+
+# Function which records the inventory of IQ tables
+# inventory is list of (<owner>.<table name>, row count, size, table id, table type)
+# Status of tables already in state database is kept, tables no longer in inventory are removed
+def record_inventory(conn, inventory):
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS inventory_names (table_name TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM inventory_names")
+        conn.executemany("INSERT OR IGNORE INTO inventory_names VALUES (?)", [(entry[0],) for entry in inventory])
+        conn.execute("DELETE FROM table_state WHERE table_name NOT IN (SELECT table_name FROM inventory_names)")
+        conn.executemany("""INSERT INTO table_state (table_name, row_count, table_size, table_id, table_type, updated_at)
+                            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                            ON CONFLICT (table_name) DO UPDATE SET row_count = excluded.row_count,
+                                table_size = excluded.table_size, table_id = excluded.table_id,
+                                table_type = excluded.table_type, updated_at = excluded.updated_at""",
+                         [(entry[0], int(entry[1]), int(entry[2]), str(entry[3]), entry[4]) for entry in inventory])
+
+# Function which records the batch of given tables
+def set_batch(conn, table_names, batch):
+    with conn:
+        conn.executemany("UPDATE table_state SET batch = ?, updated_at = CURRENT_TIMESTAMP WHERE table_name = ?",
+                         [(batch, name) for name in table_names])
+
+# Function which records parts of tables extracted in different batches
+# Earlier parts of the tables in table_names are removed, parts is list of (<owner>.<table name>, part, number of parts, batch)
+def record_batch_parts(conn, table_names, parts):
+    with conn:
+        conn.executemany("DELETE FROM batch_parts WHERE table_name = ?", [(name,) for name in table_names])
+        conn.executemany("INSERT INTO batch_parts (table_name, part, nparts, batch) VALUES (?, ?, ?, ?)", parts)
+
+# Function which returns (part, number of parts, batch, upload status) of parts of a table extracted in different batches
+def table_batch_parts(conn, table_name):
+    return conn.execute("""SELECT part, nparts, batch, upload_status FROM batch_parts WHERE table_name = ? ORDER BY part""",
+                        (table_name,)).fetchall()
+
+# Function which returns parts of tables in a batch as
+# (<owner>.<table name>, row count, size, table id, table type, extract status, part, number of parts, upload status)
+def batch_parts(conn, batch):
+    return conn.execute("""SELECT t.table_name, t.row_count, t.table_size, t.table_id, t.table_type, t.extract_status,
+                                  p.part, p.nparts, p.upload_status
+                           FROM batch_parts p JOIN table_state t ON (t.table_name = p.table_name)
+                           WHERE p.batch = ? ORDER BY t.rowid, p.part""", (batch,)).fetchall()
+
+# Function which records upload status of a part of a table extracted in different batches
+def record_part_upload(conn, table_name, part, status):
+    with conn:
+        conn.execute("UPDATE batch_parts SET upload_status = ? WHERE table_name = ? AND part = ?", (status, table_name, part))
+
+# Function which records tables as extracted
+# entries is list of (<owner>.<table name>, row count, table id, table type) as in ExtractedTables.out
+def record_extracted(conn, entries):
+    with conn:
+        conn.executemany("""INSERT INTO table_state (table_name, row_count, table_id, table_type, extract_status, updated_at)
+                            VALUES (?, ?, ?, ?, 'extracted', CURRENT_TIMESTAMP)
+                            ON CONFLICT (table_name) DO UPDATE SET extract_status = 'extracted', extract_error = NULL,
+                                upload_status = 'pending', upload_error = NULL, updated_at = excluded.updated_at""",
+                         [(entry[0], int(entry[1]), str(entry[2]), entry[3]) for entry in entries])
+
+# Function which records a table as failed to extract
+def record_extract_failure(conn, table_name, error):
+    with conn:
+        conn.execute("""UPDATE table_state SET extract_status = 'failed', extract_error = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE table_name = ? AND extract_status != 'extracted'""", (error, table_name))
+
+# Function which returns (<owner>.<table name>, row count, size, table id, table type) of tables
+# not yet extracted in a batch, batch 0 returns tables of all batches
+def tables_to_extract(conn, batch):
+    return conn.execute("""SELECT table_name, row_count, table_size, table_id, table_type FROM table_state
+                           WHERE extract_status != 'extracted' AND (? = 0 OR batch = ?) ORDER BY rowid""",
+                        (batch, batch)).fetchall()
+
+# Function which returns (number of tables, number of extracted tables) of a batch, batch 0 returns for all batches
+def extract_counts(conn, batch):
+    return conn.execute("""SELECT count(*), count(CASE WHEN extract_status = 'extracted' THEN 1 END) FROM table_state
+                           WHERE (? = 0 OR batch = ?)""", (batch, batch)).fetchone()
+
+# Function which returns (<owner>.<table name>, row count, table id, table type) of extracted tables
+def extracted_tables(conn):
+    return conn.execute("""SELECT table_name, row_count, table_id, table_type FROM table_state
+                           WHERE extract_status = 'extracted' ORDER BY batch, rowid""").fetchall()
+
+# Function which records upload status of a table, status is 'verified' or 'failed'
+def record_upload(conn, table_name, status, error):
+    with conn:
+        conn.execute("""UPDATE table_state SET upload_status = ?, upload_error = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE table_name = ?""", (status, error, table_name))
+
+# Function which returns (<owner>.<table name>, table id, row count, extract status, upload status) of tables of a batch
+def batch_tables(conn, batch):
+    return conn.execute("""SELECT table_name, table_id, row_count, extract_status, upload_status FROM table_state
+                           WHERE batch = ? ORDER BY rowid""", (batch,)).fetchall()
+
+# Function which returns (<owner>.<table name>, table id, row count, upload status) of extracted tables
+# not yet loaded, in order of extraction
+def tables_to_pipeline(conn):
+    return conn.execute("""SELECT table_name, table_id, row_count, upload_status FROM table_state
+                           WHERE extract_status = 'extracted' AND load_status != 'loaded' ORDER BY updated_at, rowid""").fetchall()
+
+# Function which sets load status of all tables to pending for a new load
+def reset_load_status(conn):
+    with conn:
+        conn.execute("UPDATE table_state SET load_status = 'pending', load_rowcount = NULL, load_error = NULL")
+
+# Function which records a table as loaded with number of loaded rows
+def record_loaded(conn, table_name, load_rowcount):
+    with conn:
+        conn.execute("""UPDATE table_state SET load_status = 'loaded', load_rowcount = ?, load_error = NULL,
+                        updated_at = CURRENT_TIMESTAMP WHERE table_name = ?""", (int(load_rowcount), table_name))
+
+# Function which records a table as failed to load
+def record_load_failure(conn, table_name, error):
+    with conn:
+        conn.execute("""UPDATE table_state SET load_status = 'failed', load_error = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE table_name = ? AND load_status != 'loaded'""", (error, table_name))
+
+# Function which returns (<owner>.<table name>, table id, row count) of extracted tables with given load status
+def tables_to_load(conn, load_status):
+    return conn.execute("""SELECT table_name, table_id, row_count FROM table_state
+                           WHERE extract_status = 'extracted' AND load_status = ? ORDER BY rowid""",
+                        (load_status,)).fetchall()
+
+# Function which returns (number of extracted tables, number of loaded tables)
+def load_counts(conn):
+    return conn.execute("""SELECT count(*), count(CASE WHEN load_status = 'loaded' THEN 1 END) FROM table_state
+                           WHERE extract_status = 'extracted'""").fetchone()
+
+# Function which sets a value in run state, also used as heartbeat of a running utility
+def set_run_state(conn, name, value):
+    with conn:
+        conn.execute("""INSERT INTO run_state (name, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at""",
+                     (name, value))
+
+# Function which returns (value, seconds since value was set) of run state, (None, None) if it is not set
+def get_run_state(conn, name):
+    row = conn.execute("""SELECT value, (julianday('now') - julianday(updated_at)) * 86400 FROM run_state
+                           WHERE name = ?""", (name,)).fetchone()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+# Function which reads entries of ExtractedTables.out
+# Returns list of (<owner>.<table name>, row count, table id, table type)
+def read_extracted_file(filename, charset):
+    entries = []
+    with codecs.open(filename, "r", charset) as f:
+        for line in f.readlines():
+            tbl = line.strip().split(',')
+            #tbl is list of [<owner>.<tablename>,rowcount,tableid,table_type]
+            if len(tbl) == 4:
+                entries.append((tbl[0].strip(), tbl[1].strip(), tbl[2].strip(), tbl[3].strip()))
+    return entries
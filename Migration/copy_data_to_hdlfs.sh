@@ -9,6 +9,8 @@
 : "${KEY_PATH:?Need KEY_PATH}"
 
 SOURCE_DIR="${EXTRACT_PATH}/Migration_Data"  # always fixed
+# Optional: upload only this directory under SOURCE_DIR (used by load utility in pipeline mode)
+UPLOAD_DIR="${UPLOAD_DIR:-$SOURCE_DIR}"
 CERT_DIR=$(dirname "$CERT_PATH")
 CLIENT=$(basename "$CERT_PATH" .crt)
 CONTAINER=$(echo "$ENDPOINT" | cut -f 1 -d '.')
@@ -20,14 +22,15 @@ success_count=0
 fail_count=0
 all_files=()
 success_files=()
-log_file="upload_log_$(date +%Y%m%d_%H%M%S).log"
+log_file="${UPLOAD_LOG:-upload_log_$(date +%Y%m%d_%H%M%S).log}"
+# History of uploaded files, it is not used to skip files as a table extracted again has new files of the same names
 success_record_file="successful_uploads.log"
 touch "$success_record_file"
 
 exec > >(tee -a "$log_file") 2>&1
 
 echo "Logging to: $log_file"
-echo "Starting recursive upload from $SOURCE_DIR"
+echo "Starting recursive upload from $UPLOAD_DIR"
 echo "========================"
 echo "Start Time: $(date)"
 echo "========================"
@@ -39,15 +42,79 @@ get_relative_path() {
   echo "$1" | sed "s|^$SOURCE_DIR/||"
 }
 
+# Prints a field (2: size, 3: sha256) of a file from the manifest in its directory
+# (<tableid>manifest written by migration utility), prints nothing if the file is not in a manifest
+# sha256 is verified on the local file before upload, size of the uploaded file is verified after upload
+# as sha256 of the uploaded content is not computed by data lake Files
+manifest_field() {
+  local file=$1
+  local field=$2
+  local filename=$(basename "$file")
+  local manifest
+  for manifest in "$(dirname "$file")"/*manifest; do
+    if [[ -f "$manifest" ]]; then
+      awk -F, -v f="$filename" -v n="$field" '$1 == f {print $n; exit}' "$manifest"
+    fi
+  done | head -1
+}
+
+# Size of a file at the time of its extraction from manifest, else its current size
+expected_size() {
+  local size=$(manifest_field "$1" 2)
+  if [[ -z "$size" ]]; then
+    size=$(stat -c%s "$1")
+  fi
+  echo "$size"
+}
+
+# Size of a file on data lake Files, prints nothing if the file does not exist
+remote_file_size() {
+  curl -s \
+    -H "x-sap-filecontainer: $CONTAINER" \
+    --cert "$CERT_PATH" --key "$KEY_PATH" \
+    "https://${ENDPOINT}/webhdfs/v1/${DEST_FOLDER}/$1?op=GETFILESTATUS" \
+    | grep -o '"length":[0-9]*' | sed 's/[^0-9]*//g'
+}
+
+# Returns zero status if a file is already on data lake Files with the size recorded in its manifest,
+# so that a run started again does not upload it again. A file not in a manifest is always uploaded.
+already_uploaded() {
+  local size=$(manifest_field "$1" 2)
+  if [[ -z "$size" ]]; then
+    return 1
+  fi
+  [[ "$(remote_file_size "$2")" == "$size" ]]
+}
+
+# Verifies sha256 of a local file against its manifest, so that a file changed or damaged after its extraction
+# is not uploaded. Returns non-zero status on mismatch, a file not in a manifest is not verified.
+verify_local_hash() {
+  local expected=$(manifest_field "$1" 3)
+  if [[ -z "$expected" ]]; then
+    return 0
+  fi
+  local actual=$(sha256sum "$1" | cut -d' ' -f1)
+  if [[ "$actual" != "$expected" ]]; then
+    echo "SHA-256 of $1 ($actual) does not match its manifest ($expected), it is not uploaded"
+    return 1
+  fi
+  echo "SHA-256 verified for $1"
+}
+
 upload_small_file() {
   local file=$1
   local rel_path=$(get_relative_path "$file")
 
-  if grep -Fxq "$rel_path" "$success_record_file"; then
+  if already_uploaded "$file" "$rel_path"; then
     echo "Skipping already uploaded file: $rel_path"
     return
   fi
 
+  if ! verify_local_hash "$file"; then
+    ((fail_count++))
+    return
+  fi
+
   echo "Uploading $file as $rel_path..."
   curl -s -w "\nTime Total: %{time_total}s\n" \
     -H 'Content-Type: application/octet-stream' \
@@ -57,15 +124,11 @@ upload_small_file() {
     -X PUT \
     "https://${ENDPOINT}/webhdfs/v1/${DEST_FOLDER}/${rel_path}?op=CREATE&data=true&overwrite=true"
 
-  local_size=$(stat -c%s "$file")
-  remote_size=$(curl -s \
-    -H "x-sap-filecontainer: $CONTAINER" \
-    --cert "$CERT_PATH" --key "$KEY_PATH" \
-    "https://${ENDPOINT}/webhdfs/v1/${DEST_FOLDER}/${rel_path}?op=GETFILESTATUS" \
-    | grep -o '"length":[0-9]*' | sed 's/[^0-9]*//g')
+  local_size=$(expected_size "$file")
+  remote_size=$(remote_file_size "$rel_path")
 
   if [[ "$local_size" == "$remote_size" ]]; then
-    echo "File size matches for $file"
+    echo "File size verified for $file"
     success_files+=("$rel_path")
     echo "$rel_path" >> "$success_record_file"
     ((success_count++))
@@ -79,11 +142,16 @@ upload_large_file() {
   local file=$1
   local rel_path=$(get_relative_path "$file")
 
-  if grep -Fxq "$rel_path" "$success_record_file"; then
+  if already_uploaded "$file" "$rel_path"; then
     echo "Skipping already uploaded file: $rel_path"
     return
   fi
 
+  if ! verify_local_hash "$file"; then
+    ((fail_count++))
+    return
+  fi
+
   local basedir=$(dirname "$rel_path")
   local filename=$(basename "$file")
   local name_no_ext="${filename%.*}"
@@ -138,15 +206,11 @@ upload_large_file() {
     "https://${ENDPOINT}/webhdfs/v1/?op=DELETE_BATCH" \
     --data-raw "$delete_json"
 
-  local_size=$(stat -c%s "$file")
-  remote_size=$(curl -s \
-    -H "x-sap-filecontainer: $CONTAINER" \
-    --cert "$CERT_PATH" --key "$KEY_PATH" \
-    "https://${ENDPOINT}/webhdfs/v1/${DEST_FOLDER}/${rel_path}?op=GETFILESTATUS" \
-    | grep -o '"length":[0-9]*' | sed 's/[^0-9]*//g')
+  local_size=$(expected_size "$file")
+  remote_size=$(remote_file_size "$rel_path")
 
   if [[ "$local_size" == "$remote_size" ]]; then
-    echo "File $file copied successfully"
+    echo "File size verified for $file, copied successfully"
     success_files+=("$rel_path")
     echo "$rel_path" >> "$success_record_file"
     ((success_count++))
@@ -161,10 +225,15 @@ upload_large_file() {
 export -f upload_small_file
 export -f upload_large_file
 export -f get_relative_path
+export -f manifest_field
+export -f expected_size
+export -f verify_local_hash
+export -f remote_file_size
+export -f already_uploaded
 
 while IFS= read -r -d '' file; do
   all_files+=("$file")
-  filesize=$(stat -c%s "$file")
+  filesize=$(expected_size "$file")
   if (( filesize < CHUNK_SIZE )); then
     upload_small_file "$file"
   else
@@ -172,7 +241,7 @@ while IFS= read -r -d '' file; do
   fi
   sleep 1
   echo "---"
-done < <(find "$SOURCE_DIR" -type f -print0)
+done < <(find "$UPLOAD_DIR" -type f -print0)
 
 total_files=${#all_files[@]}
 echo -e "\n===== SUMMARY ====="
@@ -189,3 +258,8 @@ echo "Total time taken: ${minutes} minutes and ${seconds} seconds"
 echo "All steps completed."
 echo "Log file saved as: $log_file"
 
+# Non-zero exit status when any file could not be copied
+if (( fail_count > 0 )); then
+  exit 1
+fi
+
@@ -16,6 +16,8 @@ import subprocess
 import datetime
 import time,shutil
 import multiprocessing
+import threading
+import queue
 import os, uuid
 import ctypes
 import re
@@ -45,36 +47,40 @@ config_file = ''
 onlyschema = 'n'
 onlydata = 'n'
 fullload = 'n'
+pipeline = 'n'
 
 # Handle help first
 if '-h' in argv or '--help' in argv:
     print('''
 Usage:
-    load_schema_and_data.py --config_file <config file path> [--onlyschema y] [--onlydata y] [--fullload y]
+    load_schema_and_data.py --config_file <config file path> [--onlyschema y] [--onlydata y] [--fullload y] [--pipeline y]
 Same as:
-    load_schema_and_data.py -f <config file path> [-s y] [-d y] [-e y]
+    load_schema_and_data.py -f <config file path> [-s y] [-d y] [-e y] [-p y]
 
 Switch Details:
     --config_file or -f  : Mandatory. Denotes utilizing the config file to access parameters from.
     --onlyschema or -s   : Optional. To run the load utility only for schema load. Use 'y' to load only schema.
     --onlydata or -d     : Optional. To run the load utility only for data load. Use 'y' to load only data.
     --fullload or -e     : Optional. To run the load utility for both schema and data load. Use 'y' to load both schema and data.
+    --pipeline or -p     : Optional. To upload and load each table as soon as it is extracted, while the migration utility
+                           is still extracting data. Use 'y' with --onlydata or --fullload. Supported only on Linux.
 
 Note:
     Only one of --onlyschema, --onlydata, or --fullload can be 'y'. They are mutually exclusive.
     One of the three options must be provided and set to 'y'.
+    --pipeline uploads extracted data to data lake Files itself, copy_hdlfs.py need not be run.
         ''')
     sys.exit()
 
 # Validate for incorrect short forms like -onlyschema etc.
 for arg in argv:
     if arg.startswith('-') and not arg.startswith('--'):
-        if arg not in ['-h', '-f', '-s', '-d', '-e']:
+        if arg not in ['-h', '-f', '-s', '-d', '-e', '-p']:
             print(f"Error: Unsupported or incorrectly formatted option '{arg}'. Use proper short or long options.")
             sys.exit(2)
 
 try:
-    opts, args = getopt.getopt(argv, "hf:s:d:e:", ["help", "config_file=", "onlyschema=", "onlydata=", "fullload="])
+    opts, args = getopt.getopt(argv, "hf:s:d:e:p:", ["help", "config_file=", "onlyschema=", "onlydata=", "fullload=", "pipeline="])
 except getopt.GetoptError:
     print("Error : Unsupported option/values. Run load_schema_and_data.py -h or --help for help")
     sys.exit(2)
@@ -94,6 +100,10 @@ for opt, arg in opts:
         if arg.lower() != 'y':
             sys.exit("Error: --fullload or -e only supports 'y'. Use this option only if you want to load both schema and data.")
         fullload = arg.lower()
+    elif opt in ("-p", "--pipeline"):
+        if arg.lower() != 'y':
+            sys.exit("Error: --pipeline or -p only supports 'y'. Use this option only if you want to load data while it is extracted.")
+        pipeline = arg.lower()
 
 # Check if config_file is provided
 if config_file.strip() == '':
@@ -105,6 +115,10 @@ if flags.count(True) > 1:
     sys.exit("Error: --onlyschema, --onlydata, and --fullload are mutually exclusive. Only one can be 'y'. Run load_schema_and_data.py -h or --help for help.")
 elif flags.count(True) == 0:
     sys.exit("Error: One of --onlyschema, --onlydata, or --fullload must be 'y'. Run load_schema_and_data.py -h or --help for help.")
+if pipeline == 'y' and onlyschema == 'y':
+    sys.exit("Error: --pipeline can be used only with --onlydata or --fullload. Run load_schema_and_data.py -h or --help for help.")
+if pipeline == 'y' and platform.system() == "Windows":
+    sys.exit("Error: --pipeline is supported only on Linux.")
 
 # detect the current working directory and print it
 path = os.getcwd()
@@ -122,6 +136,7 @@ else:
 
 sys.path.insert(0, '%s%s..%sCommon%s'%(path,path_sep,path_sep,path_sep))
 import common
+import state_store
 common.load_inputs(config_file,'load_schema_and_data')
 global migrationpath
 migrationpath = "%s%sMigration_Data"%(common.extract_path,path_sep)
@@ -136,6 +151,11 @@ global loadFailure_err_bkp
 loadFailure_err_bkp = "%s%sHDL_LoadFailure_bkp.err"%(reload_file_location,path_sep)
 global HDLLoad_out
 HDLLoad_out = "%s%sHDL_LoadedTables.out"%(reload_file_location,path_sep)
+# Database with extraction and load status of every table, see state_store.py
+global state_db
+state_db = "%s%s%s"%(reload_file_location,path_sep,state_store.state_file_name)
+global state_conn
+state_conn = None
 load_schema_and_data_log = "%s%sload_schema_and_data.log"%(path,path_sep)
 lock = multiprocessing.Lock()
 tables_count = multiprocessing.Value(ctypes.c_int, 0)
@@ -143,6 +163,8 @@ fail_count = multiprocessing.Value(ctypes.c_int, 0)
 total_table = multiprocessing.Value(ctypes.c_int, 0)
 global data_path
 data_path =  "%s%sExtracted_Data"%(reload_file_location,path_sep)
+# Seconds between checks of state database for newly extracted tables in pipeline mode
+pipeline_poll_interval = 10
 
 # Read the json config file and get all values
 def get_inputs(config_file):
@@ -194,6 +216,9 @@ def get_inputs(config_file):
     if (common.Object_Store_Copy_Validation.lower() == 'yes' and requests == None):
         sys.exit("Error: Module requests not found. %sPlease enter Object_Store_Copy_Validation as 'No' in %s file to proceed load without validating data copied to object store"%(newline,config_file))
 
+    if (pipeline == 'y' and requests == None):
+        sys.exit("Error: Module requests not found. It is required with --pipeline to verify data copied to object store")
+
     logging.info("%s"%(common.dividerline))
     logging.info("Data Lake Relational Engine common.charset: %s"%common.charset)
 
@@ -339,6 +364,44 @@ def check_schema_load_required():
         schema_load_needed = True
     return schema_load_needed
 
+# Function which lists files of a directory on data lake Files including its subdirectories
+# (rowid ranges of a table are extracted in subdirectories)
+# Returns list of (file path relative to the table directory, size)
+def list_hdlfs_files(url, dirname, headers, cert, subdir):
+    files = []
+    r = requests.get(url+dirname,verify=False,headers=headers,cert=cert, params={'op':'LISTSTATUS'})
+    assert r.status_code ==200, r.text
+    # Use the json module to load CKAN's response into a dictionary.
+    response_dict = json.loads(r.content)
+
+    for i in response_dict['FileStatuses']['FileStatus']:
+        name = subdir + i["pathSuffix"]
+        if i.get("type") == "DIRECTORY":
+            files.extend(list_hdlfs_files(url, dirname + "/" + i["pathSuffix"], headers, cert, name + "/"))
+        else:
+            files.append((name, i["length"]))
+    return files
+
+# Function which reads manifests (<tableid>manifest) of a table and its parts written by migration utility
+# Returns dictionary of file path relative to directory of the table and its size at the time of extraction
+def read_manifests(tableid, table_path):
+    files = {}
+    for path, subdirs, names in os.walk(table_path):
+        if "%smanifest"%(tableid) not in names:
+            continue
+        subdir = os.path.relpath(path, table_path).replace(os.sep, "/")
+        with codecs.open(os.path.join(path, "%smanifest"%(tableid)), "r", common.charset) as f:
+            for line in f:
+                entry = line.strip().split(',')
+                # entry is list of [<file name>,<size>,<sha256>]
+                if len(entry) == 3:
+                    name = entry[0] if subdir == "." else subdir + "/" + entry[0]
+                    files[name] = int(entry[1])
+    return files
+
+# Function which verifies that extracted files of a table are copied to data lake Files
+# Files and sizes are read from manifests of the table, files not in a manifest (files of LOB values,
+# or tables extracted without manifest) are read from the directory of the table
 def validate_upload_hdlfs(tableid):
 
     upload_success = False
@@ -346,15 +409,17 @@ def validate_upload_hdlfs(tableid):
     pattern1 = "%s*.inp"%(tableid)
     pattern2 = "%s*.txt"%(tableid)
     pattern3 = "%s_row*"%(tableid)
-    file_count = 0
     hdlfs_count = 0
     global data_path
     table_path = data_path + "/" +tableid
 
+    expected = read_manifests(tableid, table_path)
     for path, subdirs, files in os.walk(table_path):
         for name in files:
-            if fnmatch(name, pattern) or fnmatch(name, pattern1) or fnmatch(name, pattern2) or fnmatch(name, pattern3):
-                file_count += 1
+            if fnmatch(name, pattern3) or (not expected and (fnmatch(name, pattern) or fnmatch(name, pattern1) or fnmatch(name, pattern2))):
+                file_path = os.path.join(path, name)
+                expected[os.path.relpath(file_path, table_path).replace(os.sep, "/")] = os.stat(file_path).st_size
+    file_count = len(expected)
 
     endpoint = common.hdlfs_files_endpoint
     url="https://%s/webhdfs/v1/" %endpoint
@@ -372,25 +437,13 @@ def validate_upload_hdlfs(tableid):
 
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     filename="/" + common.hdlfs_directory + "/Extracted_Data" + "/" +tableid
-    r = requests.get(url+filename,verify=False,headers=headers,cert=cert, params={'op':'LISTSTATUS'})
-    assert r.status_code ==200, r.text
-    # Use the json module to load CKAN's response into a dictionary.
-    response_dict = json.loads(r.content)
-
-    for i in response_dict['FileStatuses']['FileStatus']:
-        hdlfs_name = i["pathSuffix"]
-        if (tableid in hdlfs_name) and (hdlfs_name.endswith(".gz") or hdlfs_name.endswith(".inp") or hdlfs_name.endswith(".txt") or ("%s_row"%(tableid) in hdlfs_name)):
-            file_path = table_path + "/" + hdlfs_name
-            hdlfs_size = i["length"]
-            file_size = 0  # Initialize file_size with a default value
-            if os.path.exists(file_path):
-                file_size = os.stat(file_path).st_size
-            else:
-                logging.info("Table %s data copy failed on data lake Files."%(tableid))
-                upload_success = False
 
-            if hdlfs_size == file_size:
+    for hdlfs_name, hdlfs_size in list_hdlfs_files(url, filename, headers, cert, ""):
+        if hdlfs_name in expected:
+            if hdlfs_size == expected[hdlfs_name]:
                 hdlfs_count += 1
+            else:
+                logging.info("Size of file %s of table %s on data lake Files is %s, expected %s"%(hdlfs_name,tableid,hdlfs_size,expected[hdlfs_name]))
 
     if (file_count == hdlfs_count) and (file_count or hdlfs_count):
        logging.info("%s"%(common.dividerline))
@@ -473,52 +526,133 @@ def load_table(host_name, table, tableid, already_processed, expected_rowcount):
 
     return status,row_count
 
-#Function to track status of tables loaded successfuly
-def updateLoadStatus(qSuccess,total_table,tables_count,fail_count,file_write_lock):
-    with file_write_lock:
-        with codecs.open(HDLLoad_out, "a",common.charset) as f:
-            while True:
-                try:
-                    tableName,tableid,load_rowcount= qSuccess.get_nowait()
-                    f.write("%s,%s,%s%s"%(tableName,tableid,load_rowcount,newline))
-                    logging.info( "Adding entry in %s file %sfor table : %s [tableID:%s]"%(HDLLoad_out,newline,tableName,tableid))
-                    f.flush()
-                    tables_count.value = tables_count.value + 1
-                    progressBar(tables_count,fail_count,total_table)
-                    if total_table.value == tables_count.value + fail_count.value:
-                        break
-                except Exception as exp:
-                    break
+# Function which returns the connection log files of load of a table, errors of a failed load are read from them
+def load_log_files(tableid):
+    log_dir = "%s%sHDL_Conn_Logs"%(reload_file_location,path_sep)
+    if is_windows:
+        return ["%s%s%s_load.err"%(log_dir,path_sep,tableid), "%s%s%s_load_conn.log"%(log_dir,path_sep,tableid)]
+    return ["%s%s%s_load.log"%(log_dir,path_sep,tableid)]
+
+# Function which returns the sizes of the given files, 0 for a file which does not exist
+def file_sizes(files):
+    return [os.path.getsize(name) if os.path.isfile(name) else 0 for name in files]
+
+# Function which returns the text appended to the given files since they had the given sizes,
+# so that an error is classified only on the log of the attempt which failed
+def text_since(files, sizes):
+    text = ""
+    for name, size in zip(files, sizes):
+        if os.path.isfile(name):
+            with open(name, 'rb') as f:
+                f.seek(size)
+                text = text + f.read().decode(common.charset, 'replace').replace('\x00', '')
+    return text
+
+# Function which runs one load of a table by load_table.sh (load_table on Windows)
+# Returns (status OK/FAIL, 1 if row count of loaded table is known else 0, row count of loaded table)
+def run_table_load(host_name, tableName, tableid, already_processed, expected_rowcount):
+    loadstatus = 0
+    if is_windows:
+        status,load_rowcount=load_table(host_name,tableName,tableid,already_processed, expected_rowcount)
+        if status == 'OK' and load_rowcount != 0:
+            loadstatus = 1
+    else:
+        try:
+            output=subprocess.check_output(['bash', 'load_table.sh', common.user, common.password, host_name,  reload_file_location, tableName, common.Datalake_Client_Install_Path, tableid, common.charset, str(already_processed), expected_rowcount] )
+        except subprocess.CalledProcessError as loadTable:
+            logging.info( "Script load_table.sh failed with %s error code "%( loadTable.returncode))
+
+        if sys.version_info < (3, 0):
+            out_put = str(output)
+        else:
+            out_put = str(output,'utf-8')
+
+        out = out_put.splitlines()
+        status = out[0].strip()
+        res = (out[1].strip()).split()
+
+        if len(res) == 5:
+            load_rowcount = int(res[2].strip())
+            loadstatus = 1
+        else:
+            # Unable to fetch result in case if table load failed
+            load_rowcount = 0
+    return status,loadstatus,load_rowcount
+
+# Function which runs in a thread of load_main and adds entries of successfully loaded tables,
+# posted by load processes in qSuccess, in HDL_LoadedTables.out till None is posted
+# It is the only writer of the file and of tables_count, so processes do not wait on each other
+def load_status_writer(qSuccess, status_lock):
+    conn = state_store.open_state(state_db)
+    f = None
+    while True:
+        entry = qSuccess.get()
+        if entry is None:
+            break
+        tableName,tableid,load_rowcount = entry
+        if f is None:
+            f = codecs.open(HDLLoad_out, "a", common.charset)
+        f.write("%s,%s,%s%s"%(tableName,tableid,load_rowcount,newline))
+        f.flush()
+        state_store.record_loaded(conn, tableName, load_rowcount)
+        logging.info( "Adding entry in %s file %sfor table : %s [tableID:%s]"%(HDLLoad_out,newline,tableName,tableid))
+        with status_lock:
+            tables_count.value = tables_count.value + 1
+            progressBar(tables_count,fail_count,total_table)
+    if f is not None:
         f.close()
+    conn.close()
 
-#Function to track status of tables failed to load
-def updateFailureStatus(qFail,total_table,tables_count,fail_count,file_write_lock):
-    with file_write_lock:
-        with codecs.open(loadFailure_err, "a+", common.charset) as f:
-            while True:
-                try:
-                    tableName,tableid,exp= qFail.get_nowait()
-                    if not tableName in f.read():
-                        if exp:
-                            f.write( "%s,%s:%s%s"%(tableName,tableid,str(exp),newline))
-                        else:
-                            f.write( "%s,%s%s"%(tableName,tableid,newline))
-                    logging.info("Adding entry in %s file %sfor table : %s [tableID:%s] "%(loadFailure_err,newline,tableName,tableid))
-                    f.flush()
-                    fail_count.value = fail_count.value + 1
-                    progressBar(tables_count,fail_count,total_table)
-                    if total_table.value == tables_count.value + fail_count.value:
-                        break
-                except Exception as exp:
-                    break
+# Function which runs in a thread of load_main and adds tables failed to load,
+# posted by load processes in qFail, in HDL_LoadFailure.err till None is posted
+# A table is added only once in the file, tables already in the file are read once at start
+def load_failure_status_writer(qFail, status_lock):
+    conn = state_store.open_state(state_db)
+    failed_tables = set()
+    if os.path.isfile(loadFailure_err):
+        with codecs.open(loadFailure_err, "r", common.charset) as f:
+            for line in f:
+                failed_tables.add(line.split(',')[0])
+    f = None
+    while True:
+        entry = qFail.get()
+        if entry is None:
+            break
+        tableName,tableid,exp = entry
+        if not tableName in failed_tables:
+            if f is None:
+                f = codecs.open(loadFailure_err, "a", common.charset)
+            if exp:
+                f.write( "%s,%s:%s%s"%(tableName,tableid,str(exp),newline))
+            else:
+                f.write( "%s,%s%s"%(tableName,tableid,newline))
+            f.flush()
+            failed_tables.add(tableName)
+        state_store.record_load_failure(conn, tableName, str(exp) if exp else None)
+        logging.info("Adding entry in %s file %sfor table : %s [tableID:%s] "%(loadFailure_err,newline,tableName,tableid))
+        with status_lock:
+            fail_count.value = fail_count.value + 1
+            progressBar(tables_count,fail_count,total_table)
+    if f is not None:
         f.close()
+    conn.close()
+
+# Function which starts the status writer threads of load
+def start_load_status_writers(qSuccess, qFail, status_lock):
+    writers = [threading.Thread(target=load_status_writer, args=(qSuccess, status_lock)),
+               threading.Thread(target=load_failure_status_writer, args=(qFail, status_lock))]
+    for writer in writers:
+        writer.daemon = True
+        writer.start()
+    return writers
 
 # Function to load data for tables in multiprocessing queue by host from hostname list
 # I/P parameters:
 # q1 = multiprocessing queue of tables to be loaded
 # hostname = Host by which tables will be loaded
 # already_processed = flag indicating already processed tables for load
-def load_single( q1,hostname,already_processed,total_table,log_q,qSuccess,qFail,tables_count,fail_count,file_write_lock):
+# wait_for_tables = in pipeline mode, wait for tables till None is posted in q1, data of posted tables is already verified
+def load_single( q1,hostname,already_processed,log_q,qSuccess,qFail,wait_for_tables=False):
     if log_q:
         qh = QueueHandler(log_q)
         logger = logging.getLogger()
@@ -527,12 +661,17 @@ def load_single( q1,hostname,already_processed,total_table,log_q,qSuccess,qFail,
     upload_success = False
     while True:
         try:
-            table_with_tid = q1.get_nowait()
+            if wait_for_tables:
+                table_with_tid = q1.get()
+                if table_with_tid is None:
+                    return
+            else:
+                table_with_tid = q1.get_nowait()
             tableName = table_with_tid[0]
             tableid = table_with_tid[1]
             host_name = hostname[0]
             expected_rowcount = table_with_tid[2]
-            if common.Object_Store_Copy_Validation.lower() == 'yes':
+            if common.Object_Store_Copy_Validation.lower() == 'yes' and not wait_for_tables:
                 upload_success = validate_upload_hdlfs(tableid)
             else:
                 upload_success = True
@@ -541,32 +680,31 @@ def load_single( q1,hostname,already_processed,total_table,log_q,qSuccess,qFail,
                 strt = datetime.datetime.now()
                 logging.info( "Starting loading of table: %s [tableID:%s] by : %s"%(tableName,tableid,hostname[1]))
                 logging.info("%s"%(common.dividerline))
-                loadstatus = 0
-                if is_windows:
-                    status,load_rowcount=load_table(host_name,tableName,tableid,already_processed, expected_rowcount)
-                    if status == 'OK' and load_rowcount != 0:
-                        loadstatus = 1
-                else:
+                # Load which failed with a transient error (see common.classify_error) is run again after a backoff wait.
+                # Row count of the table is checked before it is loaded again, as a load committed before its
+                # connection failed is not to be loaded twice.
+                check_loaded = already_processed
+                attempt = 0
+                while True:
+                    log_files = load_log_files(tableid)
+                    log_sizes = file_sizes(log_files)
+                    error = None
                     try:
-                        output=subprocess.check_output(['bash', 'load_table.sh', common.user, common.password, host_name,  reload_file_location, tableName, common.Datalake_Client_Install_Path, tableid, common.charset, str(already_processed), expected_rowcount] )
-                    except subprocess.CalledProcessError as loadTable:
-                        logging.info( "Script load_table.sh failed with %s error code "%( loadTable.returncode))
-
-                    if sys.version_info < (3, 0):
-                        out_put = str(output)
-                    else:
-                        out_put = str(output,'utf-8')
-
-                    out = out_put.splitlines()
-                    status = out[0].strip()
-                    res = (out[1].strip()).split()
-
-                    if len(res) == 5:
-                        load_rowcount = int(res[2].strip())
-                        loadstatus = 1
-                    else:
-                        # Unable to fetch result in case if table load failed
-                        load_rowcount = 0
+                        status,loadstatus,load_rowcount = run_table_load(host_name,tableName,tableid,check_loaded,expected_rowcount)
+                        if (status == 'OK') and (loadstatus == 1):
+                            break
+                        error = text_since(log_files, log_sizes)
+                    except Exception as exp:
+                        error = exp
+                    if attempt == common.max_retries or common.classify_error(error) != 'transient':
+                        break
+                    attempt = attempt + 1
+                    wait = common.retry_backoff(attempt)
+                    logging.warning("Loading of table :%s [tableID:%s] failed with transient error, it will be loaded again in %d seconds (retry %s of %s)"%(tableName,tableid,wait,attempt,common.max_retries))
+                    sleep(wait)
+                    check_loaded = True
+                if isinstance(error, Exception):
+                    raise error
 
                 if already_processed:
                     log_str="Table :%s [tableID:%s] data with row_count :%s already loaded successfully "%(tableName,tableid,load_rowcount)
@@ -577,7 +715,6 @@ def load_single( q1,hostname,already_processed,total_table,log_q,qSuccess,qFail,
                     logging.info(log_str)
 
                     qSuccess.put((tableName,tableid,load_rowcount))
-                    updateLoadStatus(qSuccess,total_table,tables_count,fail_count,file_write_lock)
 
                     elap_sec = common.elap_time(strt)
                     days, hours, minutes, seconds = common.calculate_time(elap_sec)
@@ -588,10 +725,11 @@ def load_single( q1,hostname,already_processed,total_table,log_q,qSuccess,qFail,
                 else:
                     logging.info("%s"%(common.dividerline))
                     logging.info("Loading of table :%s [tableID:%s] failed"%(tableName,tableid))
+                    if attempt != 0:
+                        logging.info("Load failed again after %s retries of transient errors"%(attempt))
                     logging.info("%s"%(common.dividerline))
 
                     qFail.put((tableName,tableid,None))
-                    updateFailureStatus(qFail,total_table,tables_count,fail_count,file_write_lock)
 
                     logging.info("%s"%newline)
 
@@ -599,7 +737,6 @@ def load_single( q1,hostname,already_processed,total_table,log_q,qSuccess,qFail,
             if str(exp) != "":
                 logging.error("Unexpected error reported while loading data: %s"%(str(exp)))
                 qFail.put((tableName,tableid,exp))
-                updateFailureStatus(qFail,total_table,tables_count,fail_count,file_write_lock)
                 logging.info("%s"%newline)
             else:
                 return
@@ -611,95 +748,74 @@ def hosts_list(conn_num,hostname,servertype):
     for i in range(conn_num):
         host_list.append((hostname,servertype))
 
+# Function which returns connection of this process to the state database
+# If the state database has no extracted or loaded tables, for example when data is extracted or loaded
+# by an older version of the utilities, they are filled once from ExtractedTables.out and load files
+def get_state_conn():
+    global state_conn
+    if state_conn is None:
+        state_conn = state_store.open_state(state_db)
+        extracted_count, loaded_count = state_store.load_counts(state_conn)
+        if extracted_count == 0 and os.path.exists(extractedTables_out):
+            state_store.record_extracted(state_conn, state_store.read_extracted_file(extractedTables_out, common.charset))
+            logging.info("Extracted tables in state database %s filled from %s"%(state_db,extractedTables_out))
+        if loaded_count == 0 and os.path.exists(HDLLoad_out):
+            with codecs.open(HDLLoad_out, "r", common.charset) as f:
+                for line in f.readlines():
+                    tbl = line.strip().split(",")
+                    #tbl is list of [<owner>.<tablename>,tableid,rowcount]
+                    if len(tbl) == 3:
+                        state_store.record_loaded(state_conn, tbl[0].strip(), tbl[2].strip())
+            if os.path.exists(loadFailure_err_bkp):
+                with codecs.open(loadFailure_err_bkp, "r", common.charset) as f:
+                    for line in f.readlines():
+                        tbl = line.strip().split(',')
+                        #tbl is list of [<owner>.<tablename>,tableid] or [<owner>.<tablename>,tableid:exp]
+                        if len(tbl) >= 2:
+                            state_store.record_load_failure(state_conn, tbl[0].strip(), None)
+            logging.info("Loaded tables in state database %s filled from %s"%(state_db,HDLLoad_out))
+    return state_conn
+
+# Function which adds entry of an empty table in HDL_LoadedTables.out, empty table need not be loaded
+def write_empty_table_loaded(conn, tableName, tableid):
+    tables_count.value = tables_count.value + 1
+    with codecs.open(HDLLoad_out, "a", common.charset) as f:
+        f.write(tableName + "," + tableid + ",0" + newline)
+        logging.info( "Adding entry in %s file %sfor table : %s [tableID:%s]"%(HDLLoad_out,newline,tableName,tableid))
+        logging.info("%s"%(common.dividerline))
+    state_store.record_loaded(conn, tableName, 0)
+
 # Function to form table list to be loaded when the loading is in resume mode
+# Tables failed to load and tables not yet loaded are read from state database
 def recover_table_list():
     q1 = multiprocessing.Queue() #Queue of failed tables in previous run
     q2 = multiprocessing.Queue() #Queue of tables not yet processed for load
-    loaded_tables = []
-    copied_tables = []
-    failed_tables = []
     logging.info("*************************************************")
     logging.info("%s Data Load started in resume mode"%(datetime.datetime.now()))
     logging.info("*************************************************")
 
-    load_file = codecs.open(HDLLoad_out,'r', common.charset)
-    lines = load_file.readlines()
-    for line in lines:
-        stripped_line = line.strip()
-        tbl = stripped_line.split(",")
-        #tbl is list of [<owner>.<tablename>,tableid,rowcount]
-        #validate length of tbl list, should always be 3
-        len_load_tbl = len(tbl)
-        if len_load_tbl == 3 :
-            loaded_tables.append(tbl[0].strip())
-    load_file.close()
-
-    if os.path.exists(loadFailure_err_bkp):
-        failure_file = codecs.open(loadFailure_err_bkp,'r', common.charset)
-        lines = failure_file.readlines()
-        for line in lines:
-            stripped_line = line.strip()
-            tbl = stripped_line.split(',')
-            #tbl is list of [<owner>.<tablename>,tableid] or [<owner>.<tablename>,tableid:exp] - exp can 0 or multiple commas
-            #validate length of tbl list, should always be greater than 2
-            len_fail_tbl = len(tbl)
-            if len_fail_tbl >= 2:
-                failed_tables.append(tbl[0].strip())
-        failure_file.close()
-
     if os.path.exists(extractedTables_out):
-        extract_file = codecs.open(extractedTables_out,'r', common.charset)
-        lines = extract_file.readlines()
-        for line in lines:
-            stripped_line = line.strip()
-            tbl = stripped_line.split(',')
-            #tbl is list of [<owner>.<tablename>,rowcount,tableid,table_type]
-            #validate length of tbl list, should always be 4
-            len_ext_tbl = len(tbl)
-            if len_ext_tbl == 4:
-                copied_tables.append(tbl[0].strip())
-        extract_file.close()
-
-        delta = [item for item in copied_tables  if item not in loaded_tables]
-        delta_in_success = [item for item in delta  if item not in failed_tables]
-        tables_already_loaded = len(loaded_tables)
-        total_extracted_table = len(copied_tables)
+        conn = get_state_conn()
+        total_extracted_table, tables_already_loaded = state_store.load_counts(conn)
+        failed_tables = state_store.tables_to_load(conn, 'failed')
+        delta_in_success = state_store.tables_to_load(conn, 'pending')
 
         print("%s"%(common.dividerline))
         print("%s tables out of %s tables already successfully loaded by previous run of load utility."%(tables_already_loaded,total_extracted_table))
 
-        for i in failed_tables:
+        for tableName, tableid, row_count in failed_tables:
             total_table.value = total_table.value + 1
-            for line in lines:
-                stripped_line = line.strip()
-                tbl = stripped_line.split(',')
-                #tbl is list of [<owner>.<tablename>,rowcount,tableid,table_type]
-                #validate length of tbl list, should always be 4
-                len_ext_tbl = len(tbl)
-                if len_ext_tbl == 4:
-                    if i == tbl[0].strip():
-                        q1.put((i,tbl[2],tbl[1]))
+            q1.put((tableName,tableid,str(row_count)))
 
         if (not delta_in_success) and (not failed_tables):
             logging.info("All extracted tables are already processed for data load")
         else:
-            for i in delta_in_success:
+            for tableName, tableid, row_count in delta_in_success:
                 total_table.value = total_table.value + 1
-                for line in lines:
-                    stripped_line = line.strip()
-                    tbl = stripped_line.split(',')
-                    #tbl is list of [<owner>.<tablename>,rowcount,tableid,table_type]
-                    #validate length of tbl list, should always be 4
-                    len_ext_tbl = len(tbl)
-                    if len_ext_tbl == 4:
-                        if i == tbl[0].strip() and tbl[1] == 0:
-                            tables_count.value = tables_count.value + 1
-                            with codecs.open(HDLLoad_out, "a", common.charset) as f:
-                                f.write(tbl[0].strip()  + "," + tbl[2].strip() + ",0"  + newline)
-                                logging.info( "Adding entry in %s file %sfor table : %s [tableID:%s]"%(HDLLoad_out,newline,tbl[0].strip(),tbl[2].strip()))
-                            f.close()
-                        elif i == tbl[0].strip():
-                            q2.put((i,tbl[2],tbl[1]))
+                if row_count == 0:
+                    write_empty_table_loaded(conn, tableName, tableid)
+                else:
+                    q2.put((tableName,tableid,str(row_count)))
     else:
         logging.info("%s file does not exist."%extractedTables_out)
 
@@ -709,26 +825,14 @@ def recover_table_list():
 def load_table_list():
     q = multiprocessing.Queue()
     if os.path.exists(extractedTables_out):
-        f = codecs.open(extractedTables_out,"r", common.charset)
-        lines = f.readlines()
-        for line in lines:
-            stripped_line = line.strip()
-            tbl = stripped_line.split(',')
-            #tbl is list of [<owner>.<tablename>,rowcount,tableid,table_type]
-            #validate length of tbl list, should always be 4
-            len_ext_tbl = len(tbl)
-            if len_ext_tbl == 4:
-                total_table.value = total_table.value + 1
-                if tbl[1] == "0":
-                    tables_count.value = tables_count.value + 1
-                    with codecs.open(HDLLoad_out, "a", common.charset) as f:
-                        f.write(tbl[0].strip() + "," + tbl[2].strip() +",0" + newline)
-                        logging.info( "Adding entry in %s file %sfor table : %s [tableID:%s]"%(HDLLoad_out,newline,tbl[0].strip(),tbl[2].strip()))
-                        logging.info("%s"%(common.dividerline))
-                    f.close()
-                else:
-                    q.put((tbl[0].strip(),tbl[2],tbl[1]))
-        f.close()
+        conn = get_state_conn()
+        state_store.reset_load_status(conn)
+        for tableName, tableid, row_count in state_store.tables_to_load(conn, 'pending'):
+            total_table.value = total_table.value + 1
+            if row_count == 0:
+                write_empty_table_loaded(conn, tableName, tableid)
+            else:
+                q.put((tableName,tableid,str(row_count)))
     else:
         logging.info("%s file does not exist."%extractedTables_out)
 
@@ -774,46 +878,19 @@ def display_clidelete_command():
 # It will compare the IQ table list with the list of loaded tables
 # If both list are equal then extraction of all tables done successfully
 def check_migration_status(f1,f2):
-    extracted_table_list = list()
-    iq_table_list = list()
-    with codecs.open(f1, "r", common.charset) as f:
-        for line in f.readlines():
-            line = line.rstrip('\n')
-            splits = line.split(',')
-            #tbl is list of [<owner>.<tablename>,rowcount,tableid,table_type]
-            #validate length of tbl list, should always be 4
-            len_ext_tbl = len(splits)
-            if len_ext_tbl == 4:
-                splitdot = splits[0].split('.')
-                extracted_table_list.append((splits[0]))
-                iq_table_list.append(splits[0])
-
     if not os.path.isfile(f2):
         str1 = "%s file does not exist. %sLoading of all tables failed."%(f2,newline)
         common.print_and_log(str1)
 
     else:
-        loaded_table_list = list()
-
-        with codecs.open(f2, "r" , common.charset) as f:
-            for line in f.readlines():
-                line = line.rstrip('\n')
-                splits = line.split(',')
-                #tbl is list of [<owner>.<tablename>,tableid,rowcount]
-                #validate length of tbl list, should always be 3
-                len_load_tbl = len(splits)
-                if len_load_tbl == 3:
-                    splitdot = splits[0].split('.')
-                    loaded_table_list.append((splits[0]))
-
-        failed_list = [item for item in extracted_table_list  if item not in loaded_table_list]
+        extracted_count, loaded_count = state_store.load_counts(get_state_conn())
+        fail = extracted_count - loaded_count
 
-        if len(failed_list) == 0:
+        if fail == 0:
             str1 = "Loading of all tables is successful."
             common.print_and_log(str1)
             display_clidelete_command()
         else:
-            fail = len(failed_list)
             str1 = "Total number of tables which are failed to load = %s"%(fail)
             common.print_and_log(str1)
             logging.info("Please check %s file for loading failures. %sRerun Load Utility to load remaining tables."%(loadFailure_err,newline))
@@ -844,7 +921,6 @@ def load_main():
     failed_table_q = multiprocessing.Queue()
     qSuccess = multiprocessing.Queue()
     qFail = multiprocessing.Queue()
-    file_write_lock = multiprocessing.Lock()
 
     if(resume_mode):
         failed_table_q,load_table_q = recover_table_list()
@@ -853,9 +929,14 @@ def load_main():
 
     process = []
 
+    # Status of tables is written by threads of this process, load processes only post it
+    get_state_conn()
+    status_lock = threading.Lock()
+    status_writers = start_load_status_writers(qSuccess, qFail, status_lock)
+
     #Start failed table processing
     for i in range(len(host_list)):
-        p = multiprocessing.Process(target=load_single, args=(failed_table_q,host_list[i],True,total_table,log_q,qSuccess,qFail,tables_count,fail_count,file_write_lock))
+        p = multiprocessing.Process(target=load_single, args=(failed_table_q,host_list[i],True,log_q,qSuccess,qFail))
         process.append(p)
         p.start()
     for p in process:
@@ -867,12 +948,193 @@ def load_main():
 
     #Start processing of tables which are yet to process
     for i in range(len(host_list)):
-        p = multiprocessing.Process(target=load_single, args=(load_table_q,host_list[i],False,total_table,log_q,qSuccess,qFail,tables_count,fail_count,file_write_lock))
+        p = multiprocessing.Process(target=load_single, args=(load_table_q,host_list[i],False,log_q,qSuccess,qFail))
         process.append(p)
         p.start()
     for p in process:
         p.join()
 
+    qSuccess.put(None)
+    qFail.put(None)
+    for writer in status_writers:
+        writer.join()
+
+    total_elap_sec = common.elap_time(start)
+    days, hours, minutes, seconds = common.calculate_time(total_elap_sec)
+
+    str1 = "Data load on data lake Relational Engine completed. "
+    common.print_and_log(str1)
+    str1 = "Total Data Load Time : %s%d days, %d hours, %d minutes and %d seconds" % ( newline, days[0], hours[0], minutes[0], seconds[0])
+    common.print_and_log(str1)
+    loaded_tables_count(HDLLoad_out)
+    check_migration_status(extractedTables_out, HDLLoad_out)
+
+# Function which runs in a thread of pipeline_main and uploads tables posted in upload_q to data lake Files
+# till None is posted. Upload of a table is verified and posted in uploaded_q as
+# (<owner>.<table name>, table id, row count, upload status, error)
+def upload_single(upload_q, uploaded_q):
+    while True:
+        entry = upload_q.get()
+        if entry is None:
+            return
+        tableName,tableid,row_count = entry
+        strt = datetime.datetime.now()
+        logging.info("Starting upload of table: %s [tableID:%s] to data lake Files"%(tableName,tableid))
+        env_vars = os.environ.copy()
+        env_vars["ENDPOINT"] = common.hdlfs_files_endpoint
+        env_vars["EXTRACT_PATH"] = common.extract_path
+        env_vars["DEST_FOLDER"] = common.hdlfs_directory
+        env_vars["CERT_PATH"] = common.hdlfs_cert_path
+        env_vars["KEY_PATH"] = common.hdlfs_key_path
+        env_vars["UPLOAD_DIR"] = "%s%s%s"%(data_path,path_sep,tableid)
+        env_vars["UPLOAD_LOG"] = "%s%sHDL_Conn_Logs%s%s_upload.log"%(reload_file_location,path_sep,path_sep,tableid)
+        try:
+            # Upload which failed with a transient error (HTTP 5xx, connection reset) is run again after a backoff wait,
+            # files already uploaded are skipped by copy_data_to_hdlfs.sh
+            attempt = 0
+            while True:
+                log_sizes = file_sizes([env_vars["UPLOAD_LOG"]])
+                subprocess.run(['bash', 'copy_data_to_hdlfs.sh'], env=env_vars, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                error = None
+                try:
+                    upload_verified = validate_upload_hdlfs(tableid)
+                except Exception as exp:
+                    upload_verified = False
+                    error = exp
+                if upload_verified or attempt == common.max_retries:
+                    break
+                if common.classify_error(error if error is not None else text_since([env_vars["UPLOAD_LOG"]], log_sizes)) != 'transient':
+                    break
+                attempt = attempt + 1
+                wait = common.retry_backoff(attempt)
+                logging.warning("Upload of table: %s [tableID:%s] failed with transient error, it will be uploaded again in %d seconds (retry %s of %s)"%(tableName,tableid,wait,attempt,common.max_retries))
+                sleep(wait)
+            if error is not None:
+                raise error
+            if upload_verified:
+                elap_sec = common.elap_time(strt)
+                days, hours, minutes, seconds = common.calculate_time(elap_sec)
+                logging.info("Time taken to upload table = %s [tableID:%s] is : %d days, %d hours, %d minutes and %d seconds" % (tableName,tableid, days[0], hours[0], minutes[0], seconds[0]))
+                uploaded_q.put((tableName,tableid,row_count,'verified',None))
+            else:
+                uploaded_q.put((tableName,tableid,row_count,'failed',"Data copied to data lake Files does not match extracted data. Please check file %s"%(env_vars["UPLOAD_LOG"])))
+        except Exception as exp:
+            logging.error("Unexpected error reported while uploading data: %s"%(str(exp)))
+            uploaded_q.put((tableName,tableid,row_count,'failed',str(exp)))
+
+# Function which returns True if migration utility is extracting data
+# Extraction which has not updated its heartbeat in state database for 10 heartbeat intervals is considered stopped
+def extraction_running(conn):
+    value, age = state_store.get_run_state(conn, 'extraction')
+    if value != 'running':
+        return False
+    if age > 10 * state_store.heartbeat_interval:
+        logging.info("Migration utility has not updated extraction state since %d seconds, it is considered stopped."%(age))
+        return False
+    return True
+
+# Function which loads data in pipeline mode
+# Each table extracted by migration utility goes through the stages upload, verification and load,
+# while other tables are still extracted. Tables are taken from state database, upload is done by
+# Pipeline_Upload_Conn threads and load by processes per host connection like in load_main.
+# Loading ends when extraction is finished (or stopped) and every extracted table is processed.
+def pipeline_main():
+    start = datetime.datetime.now()
+    hosts_list(common.coord_conn_num,common.coord_host,'Coordinator')
+    hosts_list(common.worker_conn_num,common.worker_host,'Worker')
+
+    str1 = "Data load on data lake Relational Engine started in pipeline mode."
+    common.print_and_log(str1)
+    print("%s"%(common.dividerline))
+    print("Tables are uploaded to data lake Files and loaded on data lake Relational Engine as they are extracted.%sFor details of tables loaded on data lake Relational Engine successfully, Please check file: %s%s"%(newline,newline,HDLLoad_out))
+    print("%s%s"%(newline,common.dividerline))
+    print("For Load progress, Please check file: %s%s"%(newline,load_schema_and_data_log))
+    print("%s"%(common.dividerline))
+
+    conn = get_state_conn()
+    if not resume_mode:
+        state_store.reset_load_status(conn)
+
+    qSuccess = multiprocessing.Queue()
+    qFail = multiprocessing.Queue()
+    upload_q = queue.Queue()
+    uploaded_q = queue.Queue()
+    load_q = multiprocessing.Queue()
+
+    status_lock = threading.Lock()
+    status_writers = start_load_status_writers(qSuccess, qFail, status_lock)
+
+    uploaders = []
+    for i in range(common.pipeline_upload_conn):
+        t = threading.Thread(target=upload_single, args=(upload_q, uploaded_q))
+        t.daemon = True
+        t.start()
+        uploaders.append(t)
+
+    # Tables failed in previous run are checked for already loaded data before load
+    process = []
+    for i in range(len(host_list)):
+        p = multiprocessing.Process(target=load_single, args=(load_q,host_list[i],resume_mode,None,qSuccess,qFail,True))
+        process.append(p)
+        p.start()
+
+    processed_tables = set()
+    uploading = 0
+    while True:
+        # State of extraction is read before tables, so tables extracted at its end are not missed
+        extraction_active = extraction_running(conn)
+        for tableName, tableid, row_count, upload_status in state_store.tables_to_pipeline(conn):
+            if tableName in processed_tables:
+                continue
+            processed_tables.add(tableName)
+            with status_lock:
+                total_table.value = total_table.value + 1
+                if row_count == 0:
+                    write_empty_table_loaded(conn, tableName, tableid)
+                    continue
+            if upload_status == 'verified':
+                load_q.put((tableName,tableid,str(row_count)))
+            else:
+                upload_q.put((tableName,tableid,row_count))
+                uploading += 1
+
+        if not extraction_active and uploading == 0:
+            break
+
+        try:
+            entry = uploaded_q.get(timeout=pipeline_poll_interval)
+        except queue.Empty:
+            entry = None
+        while entry is not None:
+            uploading -= 1
+            tableName,tableid,row_count,upload_status,error = entry
+            state_store.record_upload(conn, tableName, upload_status, error)
+            if upload_status == 'verified':
+                load_q.put((tableName,tableid,str(row_count)))
+            else:
+                qFail.put((tableName,tableid,error))
+            try:
+                entry = uploaded_q.get_nowait()
+            except queue.Empty:
+                entry = None
+
+    for t in uploaders:
+        upload_q.put(None)
+    for t in uploaders:
+        t.join()
+    for p in process:
+        load_q.put(None)
+    for p in process:
+        p.join()
+
+    qSuccess.put(None)
+    qFail.put(None)
+    for writer in status_writers:
+        writer.join()
+
+    if os.path.isfile(loadFailure_err_bkp):
+        os.remove(loadFailure_err_bkp)
+
     total_elap_sec = common.elap_time(start)
     days, hours, minutes, seconds = common.calculate_time(total_elap_sec)
 
@@ -922,7 +1184,9 @@ if __name__ == '__main__':
         validate_dir_and_files()
 
         # Loop 2: Data Load
-        if len(extractedTables_out) == 0 or not os.path.isfile(extractedTables_out):
+        if pipeline == 'y':
+            pipeline_main()
+        elif len(extractedTables_out) == 0 or not os.path.isfile(extractedTables_out):
             logging.info("%s" % (common.double_divider_line))
             logging.info("The Database has no IQ tables. No need of Loading.")
             logging.info("%s" % (common.double_divider_line))
@@ -954,7 +1218,9 @@ if __name__ == '__main__':
             common.print_and_log(str1)
 
         # Loop 2: Data Load
-        if len(extractedTables_out) == 0 or not os.path.isfile(extractedTables_out):
+        if pipeline == 'y':
+            pipeline_main()
+        elif len(extractedTables_out) == 0 or not os.path.isfile(extractedTables_out):
             logging.info("%s" % (common.double_divider_line))
             logging.info("The Database has no IQ tables. No need of Loading.")
             logging.info("%s" % (common.double_divider_line))
@@ -23,13 +23,18 @@ import re
 import logging
 from multiprocessing import Process, Manager
 from multiprocessing.managers import BaseManager, SyncManager
+from multiprocessing.connection import wait
 import json
 import shutil
 import codecs
 from logging.handlers import QueueHandler, QueueListener
 import fnmatch
-import heapq
 import math
+import heapq
+import hashlib
+import queue
+import threading
+import decimal
 argv = sys.argv[1:]
 n = len(sys.argv)
 
@@ -121,6 +126,7 @@ else:
     newline = "\n"
 sys.path.insert(0, '%s%s..%sCommon%s'%(path,path_sep,path_sep,path_sep))
 import common
+import state_store
 common.get_inputs(config_file,'Migration')
 common.host_validation(config_file,'Migration')
 common.mig_inputs(config_file,'Migration')
@@ -137,6 +143,20 @@ extractedTables_out = "%s%sExtractedTables.out"%(migrationpath,path_sep)
 global extractedFailures_err
 extractedFailures_err = "%s%sextractFailure.err"%(migrationpath,path_sep)
 
+# Rowid ranges and partitions extracted successfully for tables extracted in parts, used in resume mode
+global extractedRanges_out
+extractedRanges_out = "%s%sExtractedRanges.out"%(migrationpath,path_sep)
+
+# Metrics of every phase of extraction of every table, one JSON object per line
+global extractionMetrics_jsonl
+extractionMetrics_jsonl = "%s%sextraction_metrics.jsonl"%(migrationpath,path_sep)
+
+# Database with extraction status of every table, see state_store.py
+global state_db
+state_db = "%s%s%s"%(migrationpath,path_sep,state_store.state_file_name)
+global state_conn
+state_conn = None
+
 global migration_log
 migration_log = "%s%smigration.log"%(path,path_sep)
 
@@ -152,11 +172,80 @@ byteorder=sys.byteorder
 global nodes_count
 nodes_count = 1
 
+# Maximum value of Temp_Extract_Max_Parallel_Degree used for a table
+global max_parallel_degree
+max_parallel_degree = 64
+
+# Seconds between heartbeats of an extraction process, and seconds without heartbeat after which
+# the lease of the task of the process expires
+global lease_heartbeat_interval
+lease_heartbeat_interval = 30
+global lease_heartbeat_timeout
+lease_heartbeat_timeout = 300
+# Without Table_Extract_Timeout_Min, the lease of a table or part expires after the time to extract its size
+# at lease_min_bytes_per_sec, and not before lease_min_deadline seconds. Heartbeats are sent by a thread of the
+# process also while a statement hangs on IQ server, so such a statement is detected only by this deadline.
+global lease_min_bytes_per_sec
+lease_min_bytes_per_sec = 2 * 1024 * 1024
+global lease_min_deadline
+lease_min_deadline = 3600
+# Seconds given to an extraction process to leave its statement after its connection is dropped on IQ server,
+# before the process is terminated
+global lease_stop_grace
+lease_stop_grace = 120
+
+# Connection number of the session of extraction process on IQ server, sent with its heartbeat
+global session_connection
+session_connection = None
+
+# Seconds between checks of an extraction process paused by the throttle for its slot to be active again
+global throttle_poll_interval
+throttle_poll_interval = 5
+# Ratio of Throttle_Max_* limits below which all health values of a node must be for its slots to grow,
+# so that number of slots does not flap when a value is close to its limit
+global throttle_resume_ratio
+throttle_resume_ratio = 0.9
+
+# Domains of partition key columns whose partition bounds are numbers, bounds of other domains are quoted
+global numeric_domains
+numeric_domains = ('bit', 'tinyint', 'smallint', 'integer', 'bigint', 'unsigned smallint', 'unsigned int', 'unsigned bigint',
+                   'numeric', 'decimal', 'float', 'real', 'double')
+
+# Number of rows fetched at a time during packed extraction of a table with LOB columns
+global packed_fetch_rows
+packed_fetch_rows = 1000
+
+# Row delimiter of segment files of packed extraction. Load table statement reads them with escapes off,
+# so there is no escape for a newline inside a value. Rows are delimited by record separator and newline
+# instead, which lets LOB values with newlines be written as they are.
+global packed_row_delimiter
+packed_row_delimiter = "\x1e\n"
+
 global extract_list
 extract_list = []
 
 global connection_list
 connection_list = []
+# Weight of each node of connection_list from Role_Weights and Node_Weights, see connect_list
+global connection_weights
+connection_weights = []
+# Number of cores of each node of connection_list, None for a node whose cores could not be read, see connect_list
+global connection_cores
+connection_cores = []
+# Number of cores read from IQ server of each node keyed by node, so that each node is queried once per run
+global node_cores_read
+node_cores_read = {}
+
+# In-memory catalog metadata of IQ tables keyed by table_id, filled once by load_table_metadata_cache()
+global table_metadata
+table_metadata = {}
+
+global string_rtruncation
+string_rtruncation = None
+
+# Filter on SYS.SYSTABLE t, SYS.SYSUSER u and SYS.SYSIQTAB it to select the IQ tables to be unloaded
+global iq_tables_filter
+iq_tables_filter = "t.table_type not like '%GBL TEMP%' and t.server_type = 'IQ' AND it.is_rlv = 'F' and lower(user_name) != 'dbo' and lower(user_name) != 'hdladmin' AND lower(user_name) NOT LIKE '_sap\\_%' ESCAPE '\\'"
 
 lock = multiprocessing.Lock()
 tables_count = multiprocessing.Value(ctypes.c_int, 0)
@@ -164,6 +253,10 @@ fail_count = multiprocessing.Value(ctypes.c_int, 0)
 total_table = multiprocessing.Value(ctypes.c_int, 0)
 empty_table_count = multiprocessing.Value(ctypes.c_int, 0)
 
+# Number of extraction failures of each error class (transient/permanent) of current batch, counted by failure_status_writer
+global failure_classes
+failure_classes = {}
+
 
 # Read the json config file and get all values
 def get_inputs(config_file):
@@ -372,6 +465,12 @@ def version_verify(connectstr):
         else:
             compressed_data = 1
             logging.info("Extraction of data will be in compressed format with parallelization.")
+    for table_class in sorted(common.compression):
+        codec, level = common.compression[table_class]
+        if codec == 'none':
+            logging.info("Extracted data of %s tables will not be compressed"%(table_class))
+        else:
+            logging.info("Extracted data of %s tables will be compressed with %s level %s"%(table_class,codec,level))
     cursor.close()
     conn.close()
 
@@ -1441,10 +1540,79 @@ def schema_unload_and_modify(connectstr):
 
 # Step 3 : Data unload into shared directory location given
 
+# Function to fetch the column metadata of all IQ tables to be unloaded in one set based
+# catalog query and keep it in memory keyed by table_id.
+# Each cache entry holds the columns of a table in column_id order as tuples of
+# (column_name, domain_name, column_id, nulls, default) and the count of LOB columns.
+def load_table_metadata_cache(connectstr):
+    strt = datetime.datetime.now()
+    try:
+        conn = pyodbc.connect(connectstr, timeout=0)
+    except Exception as exp:
+        sys.exit("Exception: %s"%str(exp))
+    cursor = conn.cursor()
+
+    global string_rtruncation
+    cursor.execute("select setting from SYSOPTIONS where \"option\"='string_rtruncation';")
+    string_rtruncation = cursor.fetchone()[0]
+
+    cursor.execute("""SELECT c.table_id, c.column_id, c.column_name, d.domain_name, c.nulls, c."default" FROM SYS.SYSCOLUMN c
+                    JOIN SYS.SYSDOMAIN d ON (c.domain_id = d.domain_id) JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id)
+                    JOIN SYS.SYSUSER u ON (u.user_id = t.creator) JOIN SYS.SYSIQTAB it ON (t.table_id = it.table_id)
+                    WHERE %s ORDER BY c.table_id, c.column_id"""%(iq_tables_filter))
+    table_metadata.clear()
+    for row in cursor.fetchall():
+        add_column_to_metadata(table_metadata, str(row[0]), row[2], row[3], row[1], row[4], row[5])
+    cursor.close()
+    conn.close()
+
+    elap_sec = common.elap_time(strt)
+    logging.info("%s"%(common.dividerline))
+    logging.info("Catalog metadata of %s tables cached in %s seconds"%(len(table_metadata),elap_sec))
+
+# Function which adds one column to the metadata cache entry of its table
+def add_column_to_metadata(metadata_cache, tableid, column_name, domain_name, column_id, nulls, default):
+    if tableid not in metadata_cache:
+        metadata_cache[tableid] = {'columns': [], 'lob_count': 0}
+    metadata_cache[tableid]['columns'].append((column_name, domain_name, column_id, nulls, default))
+    if domain_name == 'long varchar' or domain_name == 'long binary':
+        metadata_cache[tableid]['lob_count'] += 1
+
+# Function which returns the cached metadata of a table
+# If the table is not in the cache (e.g. worker process started without the cache) then
+# metadata of that table alone is fetched from the server using the given connection
+def get_table_metadata(tablename, conn):
+    tableid = str(tablename[3])
+    if tableid not in table_metadata:
+        cursor = conn.cursor()
+        cursor.execute("""SELECT c.column_id, c.column_name, d.domain_name, c.nulls, c."default" FROM SYS.SYSCOLUMN c
+                        JOIN SYS.SYSDOMAIN d ON (c.domain_id = d.domain_id) WHERE c.table_id = %s ORDER BY c.column_id"""%(tableid))
+        for row in cursor.fetchall():
+            add_column_to_metadata(table_metadata, tableid, row[1], row[2], row[0], row[3], row[4])
+        cursor.close()
+    return table_metadata[tableid]
+
+# Function which checks whether a table can be extracted in parts (rowid ranges or partitions)
+# Tables with LOB columns can't be extracted in parts with LOB_Extract_Format File_Per_Value,
+# as their text and files of LOB values are extracted by two scans of the whole table
+def can_extract_in_parts(metadata):
+    return metadata['lob_count'] == 0 or common.lob_extract_format != 'file_per_value'
+
+# Function which checks whether table has an identity/autoincrement column
+def has_identity_column(metadata):
+    idtcol = [col[4] for col in metadata['columns']]
+    if 'Identity/Autoincrement' in idtcol or 'autoincrement' in idtcol:
+        return 1
+    return 0
+
+# Function which returns the quoted column list of a table used in select statement of extraction
+def quoted_column_string(metadata):
+    return ", ".join(['\"%s\"'%(col[0]) for col in metadata['columns']])
+
 # Function to read esinfo file or extractinfo and return a list of extracted file generated
 def getfilelist_fromesinfo(tableid,path_to_copy):
     filelst = list()
-    PATH = '%s%s%s%s%sextractinfo'%(datapath,path_sep,tableid,path_sep,tableid)
+    PATH = '%s%s%sextractinfo'%(path_to_copy,path_sep,tableid)
 
     if os.path.isfile(PATH) and os.access(PATH, os.R_OK):
         with codecs.open("%s%s%sextractinfo"%(path_to_copy,path_sep,tableid), "r", common.charset) as f:
@@ -1457,6 +1625,15 @@ def getfilelist_fromesinfo(tableid,path_to_copy):
                             filelst.append(words)
     return filelst
 
+# Function to read extractinfo of each part (rowid range or partition) of a table and return a list of extracted files
+# File names are relative to the directory of the table
+def getfilelist_fromparts(tableid,subdirs):
+    filelst = list()
+    for subdir in subdirs:
+        for name in getfilelist_fromesinfo(tableid, table_part_dir(tableid, subdir)):
+            filelst.append("%s/%s"%(subdir,name))
+    return filelst
+
 # Function which verify row count in HDL which is added in load statement table
 def rowCountVerifyInHDL(tablename,path_to_copy,cntstmt,f):
     rowcount = tablename[1]
@@ -1481,8 +1658,10 @@ def rowCountVerifyInHDL(tablename,path_to_copy,cntstmt,f):
 
 # Function which forms load table statements by reading esinfo/extractinfo
 # Form the load table statement and write it into a file
+# For a table extracted in parts (rowid ranges or partitions), subdirs are the directories of parts
+# and files of all parts are loaded
 # This function is not for 16.1 SP01 and 16.0 SP11 versions
-def form_load_table_stmt(tablename, conn, path_to_copy, binary):
+def form_load_table_stmt(tablename, conn, path_to_copy, binary, subdirs=None):
     global byteorder
     splits = tablename[0].split('.')
     tableid = tablename[3]
@@ -1493,18 +1672,8 @@ def form_load_table_stmt(tablename, conn, path_to_copy, binary):
         f1.write("set temporary option \"auto_commit\" = 'OFF';"+ newline)
         f1.write("set temporary option disable_ri_check= 'on';"+ newline)
         f1.write("BEGIN TRANSACTION;" + newline)
-        cursor3 = conn.cursor()
-        cursor3.execute("select setting from SYSOPTIONS where \"option\"='string_rtruncation';")
-        string_truncation = cursor3.fetchone()[0]
-        if string_truncation.lower() == "on":
-            cursor3.execute("set temporary option STRING_RTRUNCATION = 'off'")
-        cursor3.execute("select \"default\" from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-        idtcol = []
-        idtflag = 0
-        for idt in cursor3:
-            idtcol.append(idt[0])
-        if 'Identity/Autoincrement' in idtcol or 'autoincrement' in idtcol:
-            idtflag = 1
+        metadata = get_table_metadata(tablename, conn)
+        idtflag = has_identity_column(metadata)
         if owner.lower() == 'dba':
             command1 = "LOAD TABLE \"HDLADMIN\".\"%s\""%(table)
             f1.write("sp_iqlogtoiqmsg('HDL-Migration: " + command1 + "');" + newline + newline)
@@ -1517,11 +1686,8 @@ def form_load_table_stmt(tablename, conn, path_to_copy, binary):
             if idtflag == 1:
                 f1.write("set temporary option \"identity_insert\" = \"%s.%s\";"%(owner,table)+ newline + newline)
             cntstmt = "SELECT count(*) into cnt FROM  \"%s\".\"%s\""%(owner,table)
-        cursor3.execute("select column_name from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
         command2=""
-        collst = []
-        for col in cursor3:
-            collst.append(col[0])
+        collst = [col[0] for col in metadata['columns']]
         n = len(collst)
         if binary == 0:
             for i in range(n-1):
@@ -1533,14 +1699,16 @@ def form_load_table_stmt(tablename, conn, path_to_copy, binary):
             command2 = command2 + '\"%s\"'%(collst[n-1]) + " BINARY WITH NULL BYTE"
         command = " " + command1 + "( " + command2 + " )"
         f1.write(command)
-        cursor3.close()
 
         tab = "     "
         f1.write(newline + tab + "FROM" + " ")
         filelst = list()
         l = list()
 
-        l = getfilelist_fromesinfo(tableid,path_to_copy)
+        if subdirs is None:
+            l = getfilelist_fromesinfo(tableid,path_to_copy)
+        else:
+            l = getfilelist_fromparts(tableid,subdirs)
 
         obj_path = "hdlfs:///%s/Extracted_Data/%s/"%(common.hdlfs_directory,tableid)
         for lst in l:
@@ -1565,168 +1733,229 @@ def form_load_table_stmt(tablename, conn, path_to_copy, binary):
 
         rowCountVerifyInHDL(tablename,path_to_copy,cntstmt,f1)
 
-# Function to load iq_tables.list into a list
-def form_load_table_sequential(tablename, conn, path_to_copy, binary):
-    global byteorder
-    splits = tablename[0].split('.')
-    table = splits[1]
-    tableid = tablename[3]
-    owner = splits[0]
-    with codecs.open("%s%s%s.sql"%(path_to_copy,path_sep,tableid), "w", common.charset) as f1:
-        f1.write("set temporary option \"auto_commit\" = 'OFF';"+ newline + newline)
-        f1.write("set temporary option disable_ri_check= 'on';"+ newline)
-        f1.write("COMMIT;" + newline)
-        f1.write("BEGIN TRANSACTION;" + newline)
-        cursor3 = conn.cursor()
-        cursor3.execute("select \"default\" from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-        idtcol = []
-        idtflag = 0
-        for idt in cursor3:
-            idtcol.append(idt[0])
-        if 'Identity/Autoincrement' in idtcol or 'autoincrement' in idtcol:
-            idtflag = 1
-        if owner.lower() == 'dba':
-            command1 = "LOAD TABLE \"HDLADMIN\".\"%s\""%(table)
-            f1.write("sp_iqlogtoiqmsg('HDL-Migration: " + command1 + "');" + newline + newline)
-            if idtflag == 1:
-                f1.write("set temporary option \"identity_insert\" = \"HDLADMIN.%s\";"%(table)+ newline + newline)
-            cntstmt = "SELECT count(*) into cnt FROM  \"HDLADMIN\".\"%s\""%(table)
-        else:
-            command1 = "LOAD TABLE \"%s\".\"%s\""%(owner,table)
-            f1.write("sp_iqlogtoiqmsg('HDL-Migration: " + command1 + "');" + newline + newline)
-            if idtflag == 1:
-                f1.write("set temporary option \"identity_insert\" = \"%s.%s\";"%(owner,table)+ newline + newline)
-            cntstmt = "SELECT count(*) into cnt FROM  \"%s\".\"%s\""%(owner,table)
-        cursor3.execute("select column_name from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-        command2=""
-        collst = []
-        for col in cursor3:
-            collst.append(col[0])
-        n = len(collst)
-        if binary == 0:
-            for i in range(n-1):
-                command2 = command2 + '\"%s\"'%(collst[i]) + ", "
-            command2 = command2 + '\"%s\"'%(collst[n-1])
-        else:
-            for i in range(n-1):
-                command2 = command2 + '\"%s\"'%(collst[i]) + " BINARY WITH NULL BYTE, "
-            command2 = command2 + '\"%s\"'%(collst[n-1]) + " BINARY WITH NULL BYTE"
-        command = " " + command1 + "( " + command2 + " )"
-        f1.write(command)
-        cursor3.close()
-        tab = "     "
-        f1.write(newline + tab + "FROM" + " ")
-        fileext = ""
-        l = list()
-        filelst =  list()
-        if binary == 0:
-            fileext = 'txt'
-        else:
-            i = 1
-            while i < 9:
-                var = '%s_%s.inp'%(tableid,i)
-                l.append(var)
-                i = i + 1
-
-        obj_path = "hdlfs:///%s/Extracted_Data/%s/"%(common.hdlfs_directory,tableid)
-        for lst in l:
-            filelst.append("'"+obj_path+str(lst)+"'")
-
-        my_string = ','.join(map(str, filelst))
-        f1.write(my_string )
-
-        if binary == 0:
-            f1.write(newline + tab + "defaults off")
-            f1.write(newline + tab + "escapes off")
-            f1.write(newline + tab + "row delimited by \'\\" + "n" "'"+";")
-        else:
-            f1.write(newline + tab + "escapes off")
-            f1.write(newline + tab + "defaults off")
-            f1.write(newline + tab + "FORMAT BINARY")
-            f1.write(newline + tab + "CHECK CONSTRAINTS OFF")
-            if byteorder == "little":
-                f1.write(newline + tab + "BYTE ORDER LOW"+ ";")
-            else:
-                f1.write(newline + tab + "BYTE ORDER HIGH"+ ";")
-
-        rowCountVerifyInHDL(tablename,path_to_copy,cntstmt,f1)
-
 # This function returns a key to be used in sorting list
 # In this case we are returning 3rd element which is size of that table
 def sorting_list_key(e):
     return int(e[2])
 
-# Function which divides a list of tables into groups based on active nodes
-# of nearly equal size in order to balance load between nodes
-def divide_almost_equally(tablelist, num_chunks):
+# Function which sets the list of tables to be extracted, largest table first
+# Tables are not assigned to nodes here, connections of all nodes pull from the same scheduler queue
+def set_extract_list(tablelist):
     tablelist.sort(reverse=True,key=sorting_list_key)
-    TablesSizeHeap = [(0, idx) for idx in range(num_chunks)]
-    heapq.heapify(TablesSizeHeap)
-    table_sets = {}
-    for i in range(num_chunks):
-        table_sets[i] = []
-    l_idx = 0
-    while l_idx < len(tablelist):
-        set_sum, set_idx = heapq.heappop(TablesSizeHeap)
-        table_sets[set_idx].append(tablelist[l_idx])
-        set_sum += int(tablelist[l_idx][2])
-        heapq.heappush(TablesSizeHeap, (set_sum, set_idx))
-        l_idx += 1
-
-    for i in range(num_chunks):
-        extract_list.append(table_sets[i])
+    del extract_list[:]
+    extract_list.extend(tablelist)
 
 # Function to store table name and its size in Kbytes into a txt file
 # Also make different folders in Migration_Data for each table name
 # where all the data files and esinfo and its load table statements will be there
+# Sizes are always read from the IQ catalog (sp_iqtablesize) in bulk. With Table_Inventory_Mode = Exact the
+# row counts are exact count(*), with Catalog the catalog row counts are used unless Verify_Exact_Row_Counts is Yes
 def generate_iqtablesize_withrowscount(connectstr):
-    # write table_name and its size in a file
+    strt = datetime.datetime.now()
     try:
         conn = pyodbc.connect(connectstr, timeout=0)
     except Exception as exp:
         sys.exit("Exception: %s"%str(exp))
 
-    with codecs.open(iqtables_list, "w", common.charset) as f:
-        cursor = conn.cursor()
-        cursor.execute("SELECT table_name,user_name,t.table_id FROM SYS.SYSTABLE t JOIN SYS.SYSUSER u ON u.user_id = t.creator JOIN SYS.SYSIQTAB it ON (t.table_id = it.table_id) WHERE t.table_type not like '%GBL TEMP%' and t.server_type = 'IQ' AND it.is_rlv = 'F' and lower(user_name) != 'dbo' and lower(user_name) != 'hdladmin' AND lower(user_name) NOT LIKE '_sap\\_%' ESCAPE '\\'")
-        records = cursor.fetchall()
-        cursor.close()
-        i=0
-        for row in records:
-            i = i +1
-            count = 0
-            cursor1 = conn.cursor()
-            cursor1.execute("""select count(*) from "%s"."%s";"""%(row[1],row[0]) )
-            count = cursor1.fetchone()[0]
-            cursor1.close()
-            tablesize = 0
-            cursor1 = conn.cursor()
-            cursor1.execute("""select sum(width) from SYS.SYSCOLUMN  where table_id=%s;"""%(row[2]) )
-            tablewidth = cursor1.fetchone()[0]
-            tablesize = tablewidth * count
-            cursor1.close()
-            cursor1 = conn.cursor()
-            cursor1.execute("""select count(*)  from SYS.SYSFOREIGNKEY where foreign_table_id =%s;"""%(row[2]) )
-            foreignkey_flag = cursor1.fetchone()[0]
-            # Append newline to every record except the last record
-            if i  == len(records):
-                if foreignkey_flag == 0:
-                    data = row[1] + "." + row[0] + "," + str(count) +  "," + str(tablesize) + "," + str(row[2]) + ","
-                else:
-                    data = row[1] + "." + row[0] + "," + str(count) +  "," + str(tablesize) + "," + str(row[2]) + "," + "FOREIGN"
-            else:
-                if foreignkey_flag == 0:
-                    data = row[1] + "." + row[0] + "," + str(count) +  "," + str(tablesize) + "," + str(row[2]) + "," + newline
-                else:
-                    data = row[1] + "." + row[0] + "," + str(count) +  "," + str(tablesize) + "," + str(row[2]) + "," + "FOREIGN" + newline
-            f.write(data)
-            cursor1.close()
+    if common.inventory_mode == 'catalog':
+        inventory = catalog_table_inventory(conn)
+        logging.info("%s"%(common.dividerline))
+        logging.info("Catalog inventory of %s IQ tables completed in %s seconds"%(len(inventory),common.elap_time(strt)))
+        if common.verify_row_counts:
+            exact_row_counts(conn, inventory)
+    else:
+        inventory = exact_table_inventory(conn)
 
     conn.close()
 
+    # write table_name and its size in a file
+    write_iq_tables_list(inventory)
+
     # If doing batch wise extraction, then partition the iqtables list based on batch size provided
     original_iqtables_generate_batches()
 
+# Function which forms the inventory of IQ tables with one count(*) per table
+# and size as the space allocated to the table as reported by sp_iqtablesize
+# Row counts are collected in parallel over the MPX node connections
+# Each inventory entry is [<owner>.<tablename>, rowcount, size, tableid, FOREIGN or empty string]
+def exact_table_inventory(conn):
+    inventory = catalog_table_inventory(conn)
+    results = parallel_table_counts(inventory)
+    for i in range(len(inventory)):
+        inventory[i][1] = results[i]
+    return inventory
+
+# Function which forms the inventory of IQ tables from the IQ catalog in bulk queries
+# Row count is the catalog row count of SYSTABLE and size is the space allocated
+# to the table as reported by sp_iqtablesize (KBytes)
+def catalog_table_inventory(conn):
+    inventory = []
+    cursor = conn.cursor()
+    cursor.execute("""select foreign_table_id, count(*) from SYS.SYSFOREIGNKEY group by foreign_table_id;""")
+    foreign_tables = set()
+    for row in cursor.fetchall():
+        foreign_tables.add(row[0])
+
+    cursor.execute("""SELECT t.table_name, u.user_name, t.table_id, t."count", s.KBytes FROM SYS.SYSTABLE t
+                    JOIN SYS.SYSUSER u ON u.user_id = t.creator JOIN SYS.SYSIQTAB it ON (t.table_id = it.table_id)
+                    CROSS APPLY sp_iqtablesize(u.user_name + '.' + t.table_name) s WHERE %s"""%(iq_tables_filter))
+    for row in cursor.fetchall():
+        count = row[3]
+        if count is None:
+            count = 0
+        tablesize = 0
+        if row[4] is not None:
+            tablesize = int(row[4]) * 1024
+        if row[2] in foreign_tables:
+            inventory.append([row[1] + "." + row[0], count, tablesize, row[2], "FOREIGN"])
+        else:
+            inventory.append([row[1] + "." + row[0], count, tablesize, row[2], ""])
+    cursor.close()
+    return inventory
+
+# Function which replaces catalog row counts of inventory with exact row counts
+# Row counts are collected in parallel over the MPX node connections
+def exact_row_counts(conn, inventory):
+    strt = datetime.datetime.now()
+    mismatch_count = 0
+    results = parallel_table_counts(inventory)
+    for i in range(len(inventory)):
+        count = results[i]
+        if count != inventory[i][1]:
+            mismatch_count = mismatch_count + 1
+            inventory[i][1] = count
+    logging.info("%s"%(common.dividerline))
+    logging.info("Exact row count verification of %s IQ tables completed in %s seconds. Catalog row count corrected for %s tables."%(len(inventory),common.elap_time(strt),mismatch_count))
+
+# Function which is called by each inventory process
+# which takes queue and gets the table whose row count is to be collected
+# Results are put in qResult as (index, rowcount, None) or (index, None, error)
+def inventory_single(q, connstr_port, qResult):
+    try:
+        conn = pyodbc.connect(connstr_port[0], timeout=0)
+    except Exception as exp:
+        qResult.put((-1, None, "Connection to %s failed: %s"%(connstr_port[1],str(exp))))
+        return
+    cursor = conn.cursor()
+    while True:
+        # Tables are followed by one None per connection, a blocking get does not miss tables still in the feeder of q
+        entry = q.get()
+        if entry is None:
+            break
+        index, tablename = entry
+        try:
+            splits = tablename.split('.')
+            cursor.execute("""select count(*) from "%s"."%s";"""%(splits[0],splits[1]) )
+            count = cursor.fetchone()[0]
+            qResult.put((index, count, None))
+        except Exception as exp:
+            qResult.put((index, None, "Row count of table %s failed on %s: %s"%(tablename,connstr_port[1],str(exp))))
+    cursor.close()
+    conn.close()
+
+# Function which collects row counts of all the tables of inventory
+# by distributing the tables across all the connections of active MPX nodes
+# Returns list of rowcounts in the same order as inventory
+def parallel_table_counts(inventory):
+    results = [None] * len(inventory)
+    if len(inventory) == 0:
+        return results
+
+    connect_list(connectstr)
+    inventory_connections = []
+    for node_connect_list in connection_list:
+        inventory_connections.extend(node_connect_list)
+    inventory_connections = inventory_connections[:len(inventory)]
+
+    q = multiprocessing.Queue()
+    for i in range(len(inventory)):
+        q.put((i, inventory[i][0]))
+    for conn_info in inventory_connections:
+        q.put(None)
+    qResult = multiprocessing.Queue()
+
+    processes = []
+    for conn_info in inventory_connections:
+        p = multiprocessing.Process(target=inventory_single, args=(q, conn_info, qResult))
+        p.start()
+        processes.append(p)
+
+    errors = []
+    received = 0
+    while received < len(inventory):
+        try:
+            index, count, value = qResult.get(timeout=5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes) and qResult.empty():
+                break
+            continue
+        if index == -1:
+            # Remaining tables are picked by the connections of other nodes
+            logging.warning("%s"%(value))
+            continue
+        if count is None:
+            errors.append(value)
+        else:
+            results[index] = count
+        received = received + 1
+
+    for p in processes:
+        p.join()
+
+    if len(errors) != 0:
+        for error in errors:
+            logging.error("%s"%(error))
+        sys.exit("Error: Failed to collect row counts of IQ tables. Please check %s file and re-run the migration utility in resume mode."%(migration_log))
+    if received < len(inventory):
+        sys.exit("Error: Row count collection of IQ tables did not complete. Re-run the migration utility in resume mode.")
+    return results
+
+# Function which writes the inventory of IQ tables into iq_tables.list
+def write_iq_tables_list(inventory):
+    state_store.record_inventory(get_state_conn(), inventory)
+    with codecs.open(iqtables_list, "w", common.charset) as f:
+        i = 0
+        for entry in inventory:
+            i = i + 1
+            data = entry[0] + "," + str(entry[1]) +  "," + str(entry[2]) + "," + str(entry[3]) + "," + entry[4]
+            # Append newline to every record except the last record
+            if i != len(inventory):
+                data = data + newline
+            f.write(data)
+
+# Function which returns connection of this process to the state database
+# If the state database has no tables, for example when a run of an older version is resumed,
+# it is filled once from iq_tables.list, batch lists and ExtractedTables files
+def get_state_conn():
+    global state_conn
+    if state_conn is None:
+        state_conn = state_store.open_state(state_db)
+        if state_store.table_count(state_conn) == 0:
+            import_state_from_files(state_conn)
+    return state_conn
+
+# Function which fills the state database from list and out files of a run
+def import_state_from_files(conn):
+    original_iqtables_list = "%s%siq_tables.list"%(migrationpath,path_sep)
+    if not os.path.isfile(original_iqtables_list):
+        return
+    inventory = []
+    with codecs.open(original_iqtables_list, "r", common.charset) as f:
+        for line in f.readlines():
+            tbl = line.rstrip(newline).split(',')
+            if len(tbl) == 5:
+                inventory.append((tbl[0],tbl[1],tbl[2],tbl[3],tbl[4]))
+    state_store.record_inventory(conn, inventory)
+
+    for batch_file in fnmatch.filter(os.listdir(migrationpath), 'iq_tables_Batch_*.list'):
+        batch_num = int(batch_file[len('iq_tables_Batch_'):-len('.list')])
+        with codecs.open("%s%s%s"%(migrationpath,path_sep,batch_file), "r", common.charset) as f:
+            state_store.set_batch(conn, [line.split(',')[0] for line in f.readlines() if line.strip() != ""], batch_num)
+
+    for out_file in fnmatch.filter(os.listdir(migrationpath), 'ExtractedTables*.out'):
+        state_store.record_extracted(conn, state_store.read_extracted_file("%s%s%s"%(migrationpath,path_sep,out_file), common.charset))
+    logging.info("State database %s created from list files of previous run"%(state_db))
+
 # Function which generate batches form iqtables list based on batch_size in config file
 def original_iqtables_generate_batches():
     if batch != 0:
@@ -1750,38 +1979,101 @@ def generate_batches(tbl_list,str1):
     elif str1 == 'failed':
         cnt = count_batches_generated_failed() + 1
 
-    # sort the tbl_list in ascending order
-    tbl_list.sort(key=sorting_list_key)
     partition_batches_on_size(tbl_list,common.batch_size,cnt)
 
 # This function will generate batches based on batch_size sum provided
+# Tables are packed into batches first fit decreasing, then packed again largest first into the least filled
+# of that many batches so that batches have nearly equal size. If that does not fit, first fit batches are kept.
+# A table larger than batch_size (which can be extracted in parts) is split into rowid ranges of at most batch_size,
+# each range is packed like a table and extracted in its batch. The table is listed in the batch of its last range,
+# where its load table statement is formed. Other tables larger than batch_size are written in no_extraction.list.
 def partition_batches_on_size(table_list,batch_size,batch_cnt):
-    batch_table_list=[]
-    batch_file="%s%siq_tables_Batch_%s.list"%(migrationpath,path_sep,batch_cnt)
-
-    if len(table_list) == 0 or int(table_list[0][2]) > int(batch_size):
-        if len(table_list) != 0 :
-            with codecs.open(no_extraction_file,"w", common.charset) as f:
-                for row in table_list:
-                    data = row[0] + "," + str(row[1]) + "," + str(row[2]) +  "," + str(row[3]) + "," + row[4] +  newline
-                    f.write(data)
+    items = []
+    no_extraction = []
+    conn = None
+    for row in table_list:
+        size = int(row[2])
+        if size <= batch_size:
+            items.append((size, row, 0, 0))
+            continue
+        if conn is None:
+            try:
+                conn = pyodbc.connect(connectstr, timeout=0)
+            except Exception as exp:
+                sys.exit("Exception: %s"%str(exp))
+        if int(row[1]) == 0 or not can_extract_in_parts(get_table_metadata(row, conn)):
+            no_extraction.append(row)
+            continue
+        nparts = int(math.ceil(size / float(batch_size)))
+        logging.info("Table %s [tableID: %s] of size %s bytes will be extracted in %s batches of rowid ranges"%(row[0],row[3],size,nparts))
+        for k in range(nparts):
+            items.append((size // nparts, row, k + 1, nparts))
+    if conn is not None:
+        conn.close()
 
-        return
-    for i in table_list:
-        batch_size = batch_size - int(i[2])
-        if batch_size > 0:
-            batch_table_list.append(i)
+    if len(no_extraction) != 0:
+        with codecs.open(no_extraction_file,"w", common.charset) as f:
+            for row in no_extraction:
+                data = row[0] + "," + str(row[1]) + "," + str(row[2]) +  "," + str(row[3]) + "," + row[4] +  newline
+                f.write(data)
+
+    items.sort(reverse=True, key=lambda item: item[0])
+    batches = first_fit_batches(items, batch_size)
+    balanced = balanced_batches(items, len(batches), batch_size)
+    if balanced is not None:
+        batches = balanced
+
+    # Table split into rowid ranges is listed in batch of its last range
+    last_batch = {}
+    parts = []
+    for i in range(len(batches)):
+        for size, row, part, nparts in batches[i]:
+            if part != 0:
+                last_batch[row[0]] = max(last_batch.get(row[0], 0), batch_cnt + i)
+                parts.append((row[0], part, nparts, batch_cnt + i))
+
+    for i in range(len(batches)):
+        batch_table_list = []
+        for size, row, part, nparts in batches[i]:
+            if part == 0 or (last_batch[row[0]] == batch_cnt + i and row not in batch_table_list):
+                batch_table_list.append(row)
+        batch_file="%s%siq_tables_Batch_%s.list"%(migrationpath,path_sep,batch_cnt + i)
+        with codecs.open(batch_file, "w", common.charset) as f:
+            for row in batch_table_list:
+                data = row[0] + "," + str(row[1]) + "," + str(row[2]) +  "," + str(row[3]) + "," + row[4] +  newline
+                f.write(data)
+        state_store.set_batch(get_state_conn(), [row[0] for row in batch_table_list], batch_cnt + i)
+        logging.info("Batch = %s : %s tables and rowid ranges of size %s bytes"%(batch_cnt + i,len(batches[i]),sum(item[0] for item in batches[i])))
+    state_store.record_batch_parts(get_state_conn(), [row[0] for row in table_list], parts)
+
+# Function which packs (size, ...) items sorted largest first into batches of at most batch_size, first fit
+# Returns list of batches, each a list of items
+def first_fit_batches(items, batch_size):
+    batches = []
+    free = []
+    for item in items:
+        for i in range(len(batches)):
+            if item[0] <= free[i]:
+                batches[i].append(item)
+                free[i] = free[i] - item[0]
+                break
         else:
-            break
-
-    with codecs.open(batch_file, "w", common.charset) as f:
-        for row in batch_table_list:
-            data = row[0] + "," + str(row[1]) + "," + str(row[2]) +  "," + str(row[3]) + "," + row[4] +  newline
-            f.write(data)
-            table_list.remove(row)
-
-    batch_cnt = batch_cnt +1
-    partition_batches_on_size(table_list,common.batch_size,batch_cnt)
+            batches.append([item])
+            free.append(batch_size - item[0])
+    return batches
+
+# Function which packs (size, ...) items sorted largest first into count batches,
+# each item into the least filled batch. Returns None if an item does not fit in the least filled batch.
+def balanced_batches(items, count, batch_size):
+    batches = [[] for i in range(count)]
+    filled = [(0, i) for i in range(count)]
+    for item in items:
+        used, i = heapq.heappop(filled)
+        if used + item[0] > batch_size:
+            return None
+        batches[i].append(item)
+        heapq.heappush(filled, (used + item[0], i))
+    return batches
 
 # Function to verify the IQ tables count to be unloaded
 # with the lines count of iq_tables file generated
@@ -1794,8 +2086,8 @@ def verify_iq_table_file(connectstr):
         except Exception as exp:
             sys.exit("Exception: %s"%str(exp))
         cursor = conn.cursor()
-        cursor.execute("SELECT table_name,user_name,t.table_id FROM SYS.SYSTABLE t JOIN SYS.SYSUSER u ON u.user_id = t.creator JOIN SYS.SYSIQTAB it ON (t.table_id = it.table_id) WHERE t.table_type not like '%GBL TEMP%' and t.server_type = 'IQ' AND it.is_rlv = 'F' and lower(user_name) != 'dbo' and lower(user_name) != 'hdladmin' AND lower(user_name) NOT LIKE '_sap\\_%' ESCAPE '\\'")
-        count_iq_tables = len(cursor.fetchall())
+        cursor.execute("SELECT count(*) FROM SYS.SYSTABLE t JOIN SYS.SYSUSER u ON u.user_id = t.creator JOIN SYS.SYSIQTAB it ON (t.table_id = it.table_id) WHERE %s"%(iq_tables_filter))
+        count_iq_tables = cursor.fetchone()[0]
         cursor.close()
         conn.close()
 
@@ -1902,6 +2194,7 @@ def write_extractedTables_out(splits,batch):
             f.write(  splits[0]  + "," + str(splits[1]) + "," + str(splits[3]) + "," + str(splits[4]) + newline)
         else:
             f.write(  splits[0]  + "," + str(splits[1]) + "," + str(splits[3]) + ",BASE" + newline)
+    state_store.record_extracted(get_state_conn(), [(splits[0], splits[1], splits[3], splits[4] or "BASE")])
     logging.info( "Adding entry in %s file %sfor table : %s [tableID:%s]"%(extractedTables_out,newline,splits[0],splits[3]))
     logging.info("%s"%(common.dividerline))
 
@@ -1934,72 +2227,58 @@ def formlist_tobeunloaded(batch):
         str1 = "Number of Empty tables in database : %s %sNo need of extraction for empty tables."%(empty_table_count.value,newline)
         common.print_and_log(str1)
 
-    divide_almost_equally(table_tobe_unloaded, nodes_count)
+    table_tobe_unloaded.extend(batch_part_tables(batch, table_tobe_unloaded))
+    set_extract_list(table_tobe_unloaded)
 
 # call this function to form table list to be unloaded when the migration is in resume mode
+# Tables not yet extracted are read from state database
 def resume_formlist_tobeunloaded(batch):
-    # Get all the table names already unloaded into a list
-    table_already_unloaded = []
-
-    # Get all the table names into a list
-    original_iq_tablelist = []
-
     if batch !=0 :
-        global extractedTables_out
+        global extractedTables_out, iqtables_list
         extractedTables_out="%s%sExtractedTables_Batch_%s.out"%(migrationpath,path_sep,batch)
-
-    extract_file = codecs.open(extractedTables_out,'r', common.charset)
-    lines = extract_file.readlines()
-    for line in lines:
-        line = line.rstrip(newline)
-        splits = line.split(',')
-        if len(splits) == 4:
-            table_already_unloaded.append(splits[0])
-    extract_file.close()
-
-    if batch != 0:
-        global iqtables_list
         iqtables_list="%s%siq_tables_Batch_%s.list"%(migrationpath,path_sep,batch)
-    iqtable_file = codecs.open(iqtables_list,'r', common.charset)
-    lines = iqtable_file.readlines()
-    for line in lines:
-        line = line.rstrip(newline)
-        splits = line.split(',')
-        original_iq_tablelist.append(splits[0])
-    iqtable_file.close()
 
-    table_already_extracted_count = len(table_already_unloaded)
-    original_iq_tablelist_count = len(original_iq_tablelist)
+    conn = get_state_conn()
+    original_iq_tablelist_count, table_already_extracted_count = state_store.extract_counts(conn, batch)
 
     print("%s"%(common.dividerline))
     print("%s tables out of %s tables already successfully extracted by previous run of migration utility."%(table_already_extracted_count,original_iq_tablelist_count))
 
-    delta = [item for item in original_iq_tablelist  if item not in table_already_unloaded]
+    delta = state_store.tables_to_extract(conn, batch)
 
     table_tobe_unloaded = []
     if not delta:
         logging.info("All IQ tables are already processed for data extraction")
     else:
-        for i in delta:
+        for row in delta:
             total_table.value = total_table.value + 1
-            for line in lines:
-                stripped_line = line.rstrip(newline)
-                splits = stripped_line.split(',')
-                if i == splits[0].strip() and (splits[1] != '0'):
-                   if(splits[4]):
-                      table_tobe_unloaded.append((splits[0], splits[1], splits[2], splits[3], splits[4]))
-                   else:
-                      table_tobe_unloaded.append((splits[0], splits[1], splits[2], splits[3] ,"BASE"))
-                elif i == splits[0].strip():
-                   # Incresing the count for tables which extracted successfully
-                   tables_count.value = tables_count.value + 1
-                   write_extractedTables_out(splits,batch)
-                   empty_table_count.value += 1
+            splits = (row[0], str(row[1]), str(row[2]), row[3], row[4] or "BASE")
+            if row[1] != 0:
+                table_tobe_unloaded.append(splits)
+            else:
+                # Incresing the count for tables which extracted successfully
+                tables_count.value = tables_count.value + 1
+                write_extractedTables_out(splits,batch)
+                empty_table_count.value += 1
 
         if empty_table_count.value != 0:
             str1 = "Number of Empty tables in database : %s %sNo need of extraction for empty tables.%s"%(empty_table_count.value,newline,newline)
             common.print_and_log(str1)
-    divide_almost_equally(table_tobe_unloaded, nodes_count)
+    table_tobe_unloaded.extend(batch_part_tables(batch, table_tobe_unloaded))
+    set_extract_list(table_tobe_unloaded)
+
+# Function which returns entries of tables split into rowid ranges extracted in different batches,
+# which have a range in the batch and are not yet extracted. Tables already in tablelist are not returned.
+def batch_part_tables(batch, tablelist):
+    part_tables = []
+    if batch == 0:
+        return part_tables
+    names = set([entry[0] for entry in tablelist])
+    for row in state_store.batch_parts(get_state_conn(), batch):
+        if row[5] != 'extracted' and row[0] not in names:
+            names.add(row[0])
+            part_tables.append((row[0], str(row[1]), str(row[2]), str(row[3]), row[4] or "BASE"))
+    return part_tables
 
 # Check for existence of ExtractedTables.out file or not
 def get_unload_table_list(batch):
@@ -2015,38 +2294,35 @@ def get_unload_table_list(batch):
     else:
         formlist_tobeunloaded(batch)
 
-# Function which adds the entry of table in ExtractedTables.out on successfull extraction
-def updateUnloadStatus(qSuccess,batch,total_table,tables_count,fail_count,file_write_lock):
-    if batch != 0:
-        global extractedTables_out
-        extractedTables_out="%s%sExtractedTables_Batch_%s.out"%(migrationpath,path_sep,batch)
-
-    with file_write_lock:
-        with codecs.open(extractedTables_out, "a", common.charset) as f:
-            while True:
-                try:
-                    owner,tableinfo= qSuccess.get_nowait()
-                    splits = tableinfo[0].split('.')
-                    table = splits[1]
-                    tableid = tableinfo[3]
-                    if  tableinfo[4]:
-                        f.write(  tableinfo[0]  + "," + str(tableinfo[1]) + "," + str(tableid) + "," + str(tableinfo[4]) + newline)
-                    else:
-                        f.write(  tableinfo[0]  + "," + str(tableinfo[1]) + "," + str(tableid) + ",BASE" + newline)
-
-                    logging.info("Extraction of table %s [tableID: %s]  was successful"%(tableinfo[0],tableid))
-                    logging.info("%s"%(common.dividerline))
-                    logging.info("Adding entry in %s file %sfor table: %s [tableID: %s]"%(extractedTables_out,newline,tableinfo[0],tableid))
-                    f.flush()
-                    tables_count.value += 1
-                    progressBar(tables_count,fail_count,total_table)
-
-                    if total_table.value == tables_count.value + fail_count.value:
-                        break
-
-                except Exception as exp:
-                    break
+# Function which runs in a thread of extract_main and adds entries of successfully extracted tables,
+# posted by extraction processes in qSuccess, in ExtractedTables.out till None is posted
+# It is the only writer of the file and of tables_count, so processes do not wait on each other
+def unload_status_writer(qSuccess, status_lock):
+    conn = state_store.open_state(state_db)
+    f = None
+    while True:
+        entry = qSuccess.get()
+        if entry is None:
+            break
+        owner,tableinfo = entry
+        tableid = tableinfo[3]
+        if f is None:
+            f = codecs.open(extractedTables_out, "a", common.charset)
+        if  tableinfo[4]:
+            f.write(  tableinfo[0]  + "," + str(tableinfo[1]) + "," + str(tableid) + "," + str(tableinfo[4]) + newline)
+        else:
+            f.write(  tableinfo[0]  + "," + str(tableinfo[1]) + "," + str(tableid) + ",BASE" + newline)
+        f.flush()
+        state_store.record_extracted(conn, [(tableinfo[0], tableinfo[1], tableid, tableinfo[4] or "BASE")])
+        logging.info("Extraction of table %s [tableID: %s]  was successful"%(tableinfo[0],tableid))
+        logging.info("%s"%(common.dividerline))
+        logging.info("Adding entry in %s file %sfor table: %s [tableID: %s]"%(extractedTables_out,newline,tableinfo[0],tableid))
+        with status_lock:
+            tables_count.value += 1
+            progressBar(tables_count,fail_count,total_table)
+    if f is not None:
         f.close()
+    conn.close()
 
 # Function to display extraction progress
 def progressBar(current,fail_count,total_table):
@@ -2055,45 +2331,831 @@ def progressBar(current,fail_count,total_table):
         print("%s tables successfully extracted and %s tables failed out of total %s tables."%(current.value,fail_count.value,total_table.value))
         print("%s"%(common.dividerline))
 
-# Function which will table failed with exception in failure file
-def updateFailureStatus(qFail,batch,total_table,tables_count,fail_count,file_write_lock):
-    if batch != 0:
-        global extractedFailures_err
-        extractedFailures_err = "%s%sextractFailure_Batch_%s.err"%(migrationpath,path_sep,batch)
-    with file_write_lock:
-        with codecs.open(extractedFailures_err, "a", common.charset) as f:
-            while True:
-                try:
-                    owner,tableName,tableid,exp= qFail.get_nowait()
-                    f.write("%s Failed to extract "%(newline)+ owner + "." + tableName + " [tableID: "+ tableid+"]" + newline)
-                    f.write(str(exp))
-                    f.flush()
-                    logging.error("Adding entry in %s file %sfor table : %s.%s [tableID: %s]"%(extractedFailures_err,newline,owner,tableName,tableid))
-                    f.close()
-                    fail_count.value += 1
-                    progressBar(tables_count,fail_count,total_table)
-                    if total_table.value == tables_count.value + fail_count.value:
-                        break
-                except Exception as exp:
-                    break
+# Function which runs in a thread of extract_main and adds tables failed with exception,
+# posted by extraction processes in qFail, in failure file till None is posted
+# Error class of every failure is written with it and counted in failure_classes
+def failure_status_writer(qFail, status_lock):
+    conn = state_store.open_state(state_db)
+    f = None
+    while True:
+        entry = qFail.get()
+        if entry is None:
+            break
+        owner,tableName,tableid,exp = entry
+        error_class = common.classify_error(exp)
+        failure_classes[error_class] = failure_classes.get(error_class, 0) + 1
+        if f is None:
+            f = codecs.open(extractedFailures_err, "a", common.charset)
+        f.write("%s Failed to extract "%(newline)+ owner + "." + tableName + " [tableID: "+ tableid+"]" + newline)
+        if error_class == 'transient':
+            f.write("Error class: transient, not resolved by %s retries%s"%(common.max_retries,newline))
+        else:
+            f.write("Error class: permanent%s"%(newline))
+        f.write(str(exp))
+        f.flush()
+        state_store.record_extract_failure(conn, owner + "." + tableName, str(exp))
+        logging.error("Adding entry in %s file %sfor table : %s.%s [tableID: %s]"%(extractedFailures_err,newline,owner,tableName,tableid))
+        with status_lock:
+            fail_count.value += 1
+            progressBar(tables_count,fail_count,total_table)
+    if f is not None:
         f.close()
+    conn.close()
+
+# Function which runs in a thread of extract_main and appends metrics records posted by extraction processes
+# in qMetrics to extraction_metrics.jsonl, one JSON object per line, till None is posted
+def metrics_writer(qMetrics, batch):
+    f = None
+    while True:
+        record = qMetrics.get()
+        if record is None:
+            break
+        record['batch'] = batch
+        if f is None:
+            f = codecs.open(extractionMetrics_jsonl, "a", common.charset)
+        f.write(json.dumps(record) + newline)
+        f.flush()
+    if f is not None:
+        f.close()
+
+# Function which starts the status writer threads of extraction
+def start_status_writers(qSuccess, qFail, qMetrics, batch):
+    status_lock = threading.Lock()
+    writers = [threading.Thread(target=unload_status_writer, args=(qSuccess, status_lock)),
+               threading.Thread(target=failure_status_writer, args=(qFail, status_lock)),
+               threading.Thread(target=metrics_writer, args=(qMetrics, batch))]
+    for writer in writers:
+        writer.daemon = True
+        writer.start()
+    return writers
+
+# Function which stops the status writer threads once all posted entries are written
+def stop_status_writers(qSuccess, qFail, qMetrics, writers):
+    qSuccess.put(None)
+    qFail.put(None)
+    qMetrics.put(None)
+    for writer in writers:
+        writer.join()
+
+# Function which returns the task to be extracted again if extraction of a table or part of table failed
+# only with transient errors (see common.classify_error) and it was retried less than Max_Retries times.
+# Otherwise errors of a table are added in failure file and None is returned.
+# attempt is 0 for first extraction of the task, errors of a part are recorded by extract_table_part.
+def retry_or_fail_extraction(failures, task, attempt, qFail):
+    splits = task[0].split('.')
+    tableid = task[3]
+    task_name = "%s [tableID: %s]"%(task[0],tableid) if len(task) <= 5 else "%s of %s [tableID: %s]"%(task[7],task[0],tableid)
+    error_classes = [common.classify_error(exp) for exp in failures]
+    if 'permanent' not in error_classes and attempt < common.max_retries:
+        logging.warning("Extraction of %s failed with transient error: %s. It will be extracted again (retry %s of %s)"%(task_name,str(failures[-1]),attempt + 1,common.max_retries))
+        return task
+    if 'permanent' not in error_classes and common.max_retries != 0:
+        logging.error("Extraction of %s failed with transient error after %s retries"%(task_name,attempt))
+    if len(task) <= 5:
+        for exp in failures:
+            qFail.put((splits[0],splits[1],tableid,exp))
+    return None
+
+# Function which extracts one part (rowid range or partition) of a table into its own directory
+# Part task is (<table entry>, part number, number of parts, subdirectory, predicate on the table)
+# Process which finishes the last part of the table forms the load table statement with files of all parts
+# and adds the table in ExtractedTables.out or in failure file if any part failed
+# A part which failed with a transient error is not recorded, it is returned to be extracted again
+# Returns (session of extraction process or None if it is closed, part task to be extracted again or None)
+def extract_table_part(table_part, conn, connstr_port, q, thread_budget, qSuccess, qFail, range_status, range_lock, metrics, attempt):
+    splits = table_part[0].split('.')
+    owner = splits[0]
+    tableName = splits[1]
+    tableid = table_part[3]
+    part = table_part[5]
+    nparts = table_part[6]
+    subdir = table_part[7]
+    predicate = table_part[8]
+    budget_key = "%s/%s"%(tableid,subdir)
+    connectstr = connstr_port[0]
+    strt = datetime.datetime.now()
+    logging.info( "Starting extraction of table: %s.%s [tableID:%s] %s (%s of %s) by : %s"%(owner,tableName,tableid,subdir,part,nparts,connstr_port[1]))
+    logging.info("%s"%(common.dividerline))
+
+    part_error = None
+    folder = table_part_dir(tableid, subdir)
+    extract_strt = None
+    try:
+        if conn is None:
+            conn = open_extract_session(connectstr)
+        metadata = get_table_metadata(table_part, conn)
+        # Files of a previous attempt of this part are removed
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+        npath = folder
+        if platform.system() == "Windows" and npath.startswith("\\"):
+            npath = os.path.join("\\", npath)
+        count = metadata['lob_count']
+        parallel_degree = acquire_parallel_degree(thread_budget, q, budget_key, int(table_part[2]) // nparts)
+        conn, cursor = set_table_extract_options(conn, connectstr, table_extract_options(tableid, npath, count, parallel_degree))
+        select_query = """Select %s FROM "%s"."%s" WHERE %s;"""%(quoted_column_string(metadata),owner,tableName,predicate)
+        extract_strt = datetime.datetime.now()
+        try:
+            if count != 0:
+                extract_lob_single_scan(table_part, conn, cursor, folder, npath, subdir, predicate)
+            else:
+                cursor.execute(select_query).fetchall()
+        finally:
+            set_temporary_options(cursor, [("temp_extract_file_prefix", "''"), ("Temp_Extract_Binary", "'off'")])
+        cursor.close()
+        PATH = '%s%s%sextractinfo'%(folder,path_sep,tableid)
+        if not (os.path.isfile(PATH) and os.access(PATH, os.R_OK)):
+            raise Exception("Extract info file %s not generated"%(PATH))
+        post_metrics(metrics, table_part[:5], subdir, 'extract', extract_strt, folder, 'ok', extract_compression_ratio(count))
+        extract_strt = None
+        hashes = {}
+        if compress_after_extract(count):
+            hashes = compress_table_files(metrics, table_part[:5], subdir, tableid, folder, count)
+        manifest_strt = datetime.datetime.now()
+        write_manifest(tableid, folder, hashes)
+        post_metrics(metrics, table_part[:5], subdir, 'manifest', manifest_strt, folder, 'ok', None)
+    except Exception as exp:
+        if extract_strt is not None:
+            post_metrics(metrics, table_part[:5], subdir, 'extract', extract_strt, folder, 'failed', None)
+        part_error = exp
+        logging.error("Extraction of %s of table %s.%s [tableID: %s] failed: %s"%(subdir,owner,tableName,tableid,str(exp)))
+        # Session state is unknown after an error, open a new one for next table
+        close_extract_session(conn)
+        conn = None
+    release_parallel_degree(thread_budget, budget_key)
+    if part_error is not None and retry_or_fail_extraction([part_error], table_part, attempt, qFail) is not None:
+        return conn, table_part
+
+    with range_lock:
+        status = range_status[str(tableid)]
+        if part_error is None:
+            status['done'].append(part)
+            with codecs.open(extractedRanges_out, "a", common.charset) as f:
+                f.write("%s,%s,%s,%s,%s"%(tableid,part,nparts,subdir,predicate) + newline)
+        else:
+            status['failed'].append("%s: %s"%(subdir,str(part_error)))
+        range_status[str(tableid)] = status
+    table_finished = (len(status['done']) + len(status['failed']) == nparts)
+
+    elap_sec = common.elap_time(strt)
+    days, hours, minutes, seconds = common.calculate_time(elap_sec)
+    logging.info("Time taken to unload %s of table: %s [tableID: %s] is : %d days, %d hours, %d minutes and %d seconds\n" % (subdir, tableName, tableid,days[0], hours[0], minutes[0], seconds[0]))
+    logging.info("%s"%(common.dividerline))
+    if not table_finished:
+        return conn, None
+
+    complete_table_parts(table_part[:5], conn, status, qSuccess, qFail)
+    return conn, None
+
+# Function which completes a table extracted in parts once all its parts are done or failed
+# status is the range status of the table. The load table statement listing files of all parts is formed and
+# the table is added in ExtractedTables.out, or the table is added in failure file if any part failed.
+def complete_table_parts(table_withsize, conn, status, qSuccess, qFail):
+    splits = table_withsize[0].split('.')
+    owner = splits[0]
+    tableName = splits[1]
+    tableid = table_withsize[3]
+    if len(status['failed']) == 0:
+        try:
+            if get_table_metadata(table_withsize, conn)['lob_count'] != 0:
+                form_load_table_bfilesequential(table_withsize, conn, "%s%s%s"%(datapath,path_sep,tableid), 1, status['subdirs'])
+            else:
+                form_load_table_stmt(table_withsize, conn, "%s%s%s"%(datapath,path_sep,tableid), 1, status['subdirs'])
+            qSuccess.put((owner,table_withsize))
+        except Exception as exp:
+            qFail.put((owner,tableName,tableid,exp))
+    else:
+        qFail.put((owner,tableName,tableid,Exception("Extraction of parts of table failed. %s"%("; ".join(status['failed'])))))
+
+# Manager which serves the scheduler queues shared by extraction processes of all nodes
+class ExtractManager(SyncManager):
+    pass
+
+ExtractManager.register('PriorityQueue', queue.PriorityQueue)
+
+# Function which returns the next table to be extracted by an extraction process
+# q is the list of (node affinity queue, share queue of the node, share queues of other nodes) of the node
+# of the process, there is one share queue of all nodes without Role_Weights and Node_Weights
+# Tables with affinity to the node are taken first, then the largest table from share queue of the node,
+# then the largest table from share queues of other nodes, so that no node is idle while tables are left
+# Raises queue.Empty when there is no table left for the node
+def next_extract_table(q):
+    for sched_q in q:
+        try:
+            return sched_q.get_nowait()[2]
+        except queue.Empty:
+            continue
+    raise queue.Empty()
+
+# Function which returns node name (host:port) from connection info of a node
+def node_name(hostport):
+    return hostport.replace("host=", "", 1)
+
+# Function which returns value configured for a node in a per node config dictionary
+# Node can be given as host:port or only host, returns None if node is not configured
+def node_config_value(node_config, hostport):
+    node = node_name(hostport).lower()
+    for key in node_config:
+        if key.lower() == node or key.lower() == node.split(':')[0]:
+            return node_config[key]
+    return None
+
+# Function which returns the directory in which a part (rowid range or partition) of a table is extracted
+def table_part_dir(tableid, subdir):
+    return "%s%s%s%s%s"%(datapath,path_sep,tableid,path_sep,subdir)
+
+# Function which splits rowids of a table into nparts ranges of nearly equal number of rowids
+# Returns list of (subdirectory, predicate) of ranges
+def table_rowid_ranges(conn, tablename, nparts):
+    splits = tablename[0].split('.')
+    cursor = conn.cursor()
+    cursor.execute("""select min(rowid("%s")), max(rowid("%s")) from "%s"."%s";"""%(splits[1],splits[1],splits[0],splits[1]))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None or row[0] is None:
+        return []
+    min_rowid = int(row[0])
+    max_rowid = int(row[1])
+    step = (max_rowid - min_rowid + 1) // nparts
+    if step < 1:
+        return []
+    ranges = []
+    for k in range(nparts):
+        start = min_rowid + k * step
+        end = start + step - 1
+        if k == nparts - 1:
+            end = max_rowid
+        ranges.append(("range_%s"%(k + 1), """rowid("%s") BETWEEN %s AND %s"""%(splits[1],start,end)))
+    return ranges
+
+# Function which reads range partitions of all IQ tables from the catalog
+# Returns dictionary of table_id and list of (partition_id, partition key column, upper bound, domain of the column) ordered by position
+# Hash and hash-range partitioned tables are not included as their partitions can't be selected by a predicate
+def load_range_partitions(conn):
+    partitions = {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT t.table_id, p.partition_id, p.partition_name, c.column_name, p.position, p.partition_values, d.domain_name
+                        FROM SYS.SYSPARTITION p JOIN SYS.SYSPARTITIONSCHEME ps ON (ps.partitioned_object_id = p.partitioned_object_id)
+                        JOIN SYS.SYSPARTITIONKEY pk ON (pk.partitioned_object_id = p.partitioned_object_id)
+                        JOIN SYS.SYSTAB t ON (t.object_id = p.partitioned_object_id)
+                        JOIN SYS.SYSCOLUMN c ON (c.table_id = t.table_id AND c.column_id = pk.column_id)
+                        JOIN SYS.SYSDOMAIN d ON (c.domain_id = d.domain_id)
+                        WHERE ps.partition_method = 1 ORDER BY t.table_id, p.position""")
+        for row in cursor.fetchall():
+            tableid = str(row[0])
+            if tableid not in partitions:
+                partitions[tableid] = []
+            partitions[tableid].append((row[1], row[3], row[5], row[6]))
+    except Exception as exp:
+        logging.warning("Partitions of IQ tables could not be read, partitioned tables will be extracted as one unit: %s"%str(exp))
+    cursor.close()
+    return partitions
+
+# Function which returns upper bound of a range partition as a literal of the type of its partition key column
+# Bounds of numeric columns are used as they are, other bounds (char, date, time, timestamp) are quoted
+# with embedded quotes doubled. A bound which is stored quoted is unquoted first.
+def partition_bound_literal(value, domain):
+    if str(domain).lower() in numeric_domains:
+        return value
+    if len(value) >= 2 and value.startswith("'") and value.endswith("'"):
+        value = value[1:-1].replace("''", "'")
+    return "'%s'"%(value.replace("'", "''"))
+
+# Function which forms predicate of each range partition of a table from its upper bound
+# Upper bound of a partition is stored as "<= (value)" or "MAX" for the last partition
+# Rows with NULL partition key are stored in the first partition
+# Returns list of (subdirectory, predicate) of partitions
+def table_partition_predicates(partitions):
+    predicates = []
+    lower = None
+    for partition_id, column, upper, domain in partitions:
+        upper = str(upper).strip()
+        if upper.startswith("<="):
+            upper = upper[2:].strip()
+        if upper.startswith("(") and upper.endswith(")"):
+            upper = upper[1:-1].strip()
+        if upper.lower() != "max":
+            upper = partition_bound_literal(upper, domain)
+        conditions = []
+        if lower is not None:
+            conditions.append('"%s" > %s'%(column,lower))
+        if upper.lower() != "max":
+            conditions.append('"%s" <= %s'%(column,upper))
+        predicate = " AND ".join(conditions)
+        if lower is None:
+            predicate = '(%s OR "%s" IS NULL)'%(predicate,column)
+        predicates.append(("partition_%s"%(partition_id), predicate))
+        lower = upper
+    return predicates
+
+# Function which reads ExtractedRanges.out into a dictionary of tableid and
+# dictionary of part number and (number of parts, subdirectory, predicate)
+def load_extracted_ranges():
+    extracted_ranges = {}
+    if not os.path.isfile(extractedRanges_out):
+        return extracted_ranges
+    with codecs.open(extractedRanges_out, "r", common.charset) as f:
+        for line in f.readlines():
+            splits = line.rstrip(newline).split(',', 4)
+            if len(splits) != 5:
+                continue
+            if splits[0] not in extracted_ranges:
+                extracted_ranges[splits[0]] = {}
+            extracted_ranges[splits[0]][int(splits[1])] = (int(splits[2]), splits[3], splits[4])
+    return extracted_ranges
+
+# Function which forms the extraction tasks of the tables in extract_list
+# Tables which can be extracted in parts (see can_extract_in_parts) are extracted in parts, each part (<table entry>, part number, number of parts,
+# subdirectory, predicate) is a separate task
+#  - range partitioned tables are extracted as one part per partition
+#  - other tables of size greater than or equal to Split_Table_Size_GB are split into rowid ranges
+#  - in batch mode, tables larger than batch size are split into rowid ranges planned in different batches,
+#    only the ranges of the batch are extracted. Ranges of earlier batches which are not extracted
+#    are extracted again in the last batch of the table.
+# Progress of parts of a table is kept in range_status. A table whose parts were all extracted by a previous run
+# is completed here (see complete_table_parts) without extracting any part again.
+# Returns list of (size, task)
+def form_extract_tasks(range_status, total_connections, batch, qSuccess, qFail):
+    tasks = []
+    nparts = common.split_table_ranges
+    if nparts == 0:
+        nparts = total_connections
+    if len(extract_list) == 0:
+        return tasks
+    try:
+        conn = pyodbc.connect(connectstr, timeout=0)
+    except Exception as exp:
+        sys.exit("Exception: %s"%str(exp))
+    extracted_ranges = load_extracted_ranges()
+    range_partitions = load_range_partitions(conn)
+
+    for item in extract_list:
+        tableid = str(item[3])
+        batch_parts = []
+        if batch != 0:
+            batch_parts = state_store.table_batch_parts(get_state_conn(), item[0])
+        is_partitioned = len(range_partitions.get(tableid, [])) > 1 and not batch_parts
+        is_large = common.split_table_size != 0 and int(item[2]) >= common.split_table_size and nparts > 1
+        if not (batch_parts or is_partitioned or is_large) or not can_extract_in_parts(get_table_metadata(item, conn)):
+            tasks.append((int(item[2]), item))
+            continue
+        if batch_parts:
+            parts = table_rowid_ranges(conn, item, batch_parts[0][1])
+        elif is_partitioned:
+            parts = table_partition_predicates(range_partitions[tableid])
+        else:
+            parts = table_rowid_ranges(conn, item, nparts)
+        if len(parts) < 2:
+            tasks.append((int(item[2]), item))
+            continue
+
+        done = []
+        previous = {}
+        if resume == True or batch_parts:
+            previous = extracted_ranges.get(tableid, {})
+        for k in range(len(parts)):
+            if previous.get(k + 1) == (len(parts), parts[k][0], parts[k][1]):
+                done.append(k + 1)
+        other_batch_parts = []
+        if batch_parts and batch != max([part_batch for part, part_count, part_batch, upload_status in batch_parts]):
+            other_batch_parts = [part for part, part_count, part_batch, upload_status in batch_parts if part_batch != batch]
+        elif len(done) == len(parts):
+            logging.info("All %s parts of table %s [tableID: %s] already extracted by previous run of migration utility"%(len(parts),item[0],tableid))
+            complete_table_parts(tuple(item), conn, {'failed': [], 'subdirs': [part[0] for part in parts]}, qSuccess, qFail)
+            continue
+        range_status[tableid] = {'nparts': len(parts), 'done': done, 'failed': [], 'subdirs': [part[0] for part in parts]}
+
+        if batch_parts:
+            logging.info("Table %s [tableID: %s] is extracted in %s parts of rowid ranges in different batches"%(item[0],tableid,len(parts)))
+        elif is_partitioned:
+            logging.info("Table %s [tableID: %s] will be extracted in %s parts, one for each partition"%(item[0],tableid,len(parts)))
+        else:
+            logging.info("Table %s [tableID: %s] will be extracted in %s parts of rowid ranges"%(item[0],tableid,len(parts)))
+        if len(done) != 0:
+            logging.info("%s parts of table %s [tableID: %s] already extracted by previous run of migration utility"%(len(done),item[0],tableid))
+        for k in range(len(parts)):
+            if (k + 1) in done or (k + 1) in other_batch_parts:
+                continue
+            tasks.append((int(item[2]) // len(parts), tuple(item) + (k + 1, len(parts), parts[k][0], parts[k][1])))
+    conn.close()
+    return tasks
+
+# Function which puts the tables to be extracted into scheduler queues
+# Tables are ordered largest first, tables with node affinity go in the queue of that node
+# Without Role_Weights and Node_Weights other tables go in one share queue of all nodes. With weights every node
+# has a share queue, and tables are put in the queue of the node which has the lowest bytes per weight after it,
+# so that every node gets a share of bytes in proportion to its weight.
+# Returns (share queues, affinity queues of nodes)
+def fill_scheduler_queues(manager, node_names, range_status, batch, qSuccess, qFail):
+    node_queues = []
+    for i in range(nodes_count):
+        node_queues.append(manager.PriorityQueue())
+    weighted = bool(common.role_weights or common.node_weights)
+    if weighted:
+        share_queues = [manager.PriorityQueue() for i in range(nodes_count)]
+    else:
+        share_queues = [manager.PriorityQueue()]
+
+    total_connections = 0
+    for node_connect_list in connection_list:
+        total_connections = total_connections + len(node_connect_list)
+
+    seq = 0
+    assigned = [0] * nodes_count
+    shared = []
+    for size, item in form_extract_tasks(range_status, total_connections, batch, qSuccess, qFail):
+        entry = (-size, seq, item)
+        seq = seq + 1
+        node = common.node_affinity.get(item[0])
+        if node is None:
+            shared.append(entry)
+            continue
+        idx = -1
+        for i in range(nodes_count):
+            if node_config_value({node: 1}, node_names[i]) is not None:
+                idx = i
+                break
+        if idx == -1:
+            logging.warning("Node %s given in Node_Affinity for table %s is not an active node. Table will be extracted by any node."%(node,item[0]))
+            shared.append(entry)
+        else:
+            node_queues[idx].put(entry)
+            assigned[idx] = assigned[idx] + size
+
+    for entry in sorted(shared):
+        if not weighted:
+            share_queues[0].put(entry)
+            continue
+        size = -entry[0]
+        idx = min(range(nodes_count), key=lambda i: (assigned[i] + size) / float(connection_weights[i]))
+        share_queues[idx].put(entry)
+        assigned[idx] = assigned[idx] + size
+
+    if weighted:
+        total = max(sum(assigned), 1)
+        for i in range(nodes_count):
+            logging.info("Share of data of node %s with weight %s: %.1f%%"%(node_name(node_names[i]),connection_weights[i],assigned[i] * 100.0 / total))
+    return share_queues, node_queues
+
+# Function which returns number of cores (logical processors) used by IQ server of a node
+def read_node_cores(connectstr):
+    conn = pyodbc.connect(connectstr, timeout=0)
+    cursor = conn.cursor()
+    cursor.execute("select property('NumLogicalProcessorsUsed')")
+    cores = int(cursor.fetchone()[0])
+    cursor.close()
+    conn.close()
+    return cores
+
+# Function which returns number of cores used by IQ server of each node of node_connect_str
+# None is returned for a node if it could not be read. A node is queried only the first time.
+def node_core_counts(node_connect_str):
+    node_cores = []
+    for connstr, hostport in node_connect_str:
+        if hostport not in node_cores_read:
+            cores = None
+            try:
+                cores = read_node_cores(connstr)
+                logging.info("Number of cores shared by extractions on node %s: %s"%(node_name(hostport),cores))
+            except Exception as exp:
+                logging.warning("Number of cores of node %s could not be read, Temp_Extract_Max_Parallel_Degree %s will be used for its extractions: %s"%(node_name(hostport),max_parallel_degree,str(exp)))
+            node_cores_read[hostport] = cores
+        node_cores.append(node_cores_read[hostport])
+    return node_cores
+
+# Function which registers an extraction as active on the node of extraction process
+# and returns Temp_Extract_Max_Parallel_Degree for it
+# thread_budget is (active extractions of all nodes, lock, node, cores of node, connections of node,
+# number of active slots of all nodes set by extraction_throttle)
+# Cores of a node are shared among its active extractions in proportion to their estimated size.
+# Connections of the node which are yet to start an extraction are given a share equal to this extraction,
+# as long as there are tables left in queue. So degree grows as extractions finish towards the end of migration.
+def acquire_parallel_degree(thread_budget, q, key, size):
+    active, budget_lock, node, cores, node_conn, node_slots = thread_budget
+    if cores is None:
+        return max_parallel_degree
+    # Connections paused by the throttle do not start an extraction
+    node_conn = min(node_conn, node_slots.get(node, node_conn))
+    size = max(size, 1)
+    pending = 0
+    for sched_q in q:
+        pending = pending + sched_q.qsize()
+    with budget_lock:
+        node_active = active.get(node, {})
+        node_active[key] = size
+        active[node] = node_active
+        total_size = sum(node_active.values())
+        idle_conn = min(node_conn - len(node_active), pending)
+    if idle_conn > 0:
+        total_size = total_size + idle_conn * size
+    parallel_degree = int(round(float(cores) * size / total_size))
+    return max(1, min(max_parallel_degree, parallel_degree))
+
+# Function which removes an extraction from active extractions of its node
+def release_parallel_degree(thread_budget, key):
+    active, budget_lock, node, cores, node_conn, node_slots = thread_budget
+    if cores is None:
+        return
+    with budget_lock:
+        node_active = active.get(node, {})
+        if key in node_active:
+            del node_active[key]
+            active[node] = node_active
+
+# Function which sets the given list of (option, value) temporary options
+# in a single batch to save a round trip per option
+def set_temporary_options(cursor, options):
+    if len(options) == 0:
+        return
+    stmt = "BEGIN "
+    for option, value in options:
+        stmt = stmt + "SET TEMPORARY OPTION %s = %s; "%(option,value)
+    stmt = stmt + "END"
+    cursor.execute(stmt)
+
+# Function which opens the session used by an extraction process for all its tables
+# and applies the extract options which are same for every table
+# Connection number of the session is kept for heartbeats of the process
+def open_extract_session(connectstr):
+    global session_connection
+    conn = pyodbc.connect(connectstr, timeout=0)
+    options = []
+    if string_rtruncation is None or string_rtruncation.lower() == "on":
+        options.append(("STRING_RTRUNCATION", "'off'"))
+    cursor = conn.cursor()
+    set_temporary_options(cursor, options)
+    cursor.execute("select connection_property('Number')")
+    session_connection = int(cursor.fetchone()[0])
+    cursor.close()
+    return conn
+
+# Function which closes the session of an extraction process
+def close_extract_session(conn):
+    global session_connection
+    session_connection = None
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+# Function which sets the extract options of a table on the session of extraction process
+# If the session is not opened yet or is broken, a new session is opened and options are set again
+# Returns the session and its cursor
+def set_table_extract_options(conn, connectstr, options):
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            set_temporary_options(cursor, options)
+            return conn, cursor
+        except pyodbc.Error as exp:
+            logging.warning("Reconnecting extraction session as it is no longer usable: %s"%str(exp))
+            close_extract_session(conn)
+    conn = open_extract_session(connectstr)
+    cursor = conn.cursor()
+    set_temporary_options(cursor, options)
+    return conn, cursor
+
+# Function which returns (codec, level) of Compression of a table from its number of LOB columns
+def table_compression(lob_count):
+    if lob_count != 0:
+        return common.compression['lob']
+    return common.compression['binary']
+
+# Function which returns True if data files of a table are compressed after extraction
+# IQ compresses (gzip) only binary extraction, and not on 16.1 SP01
+def compress_after_extract(lob_count):
+    codec, level = table_compression(lob_count)
+    if codec == 'none':
+        return False
+    return lob_count != 0 or compressed_data == 0 or codec != 'gzip'
+
+# Function which compresses the data files listed in extractinfo of a table in a directory
+# Each file is replaced by its compressed file and names in extractinfo are changed to compressed files,
+# so load table statement formed from extractinfo loads the compressed files
+# Compressed files are hashed while they are written, returns dictionary of file name and (size, sha256)
+def compress_extracted_files(tableid, directory, codec, level):
+    extension, default_level, max_level, open_function = common.compression_codecs[codec]
+    PATH = '%s%s%sextractinfo'%(directory,path_sep,tableid)
+    hashes = {}
+    with codecs.open(PATH, "r", common.charset) as f:
+        extractinfo = f.read()
+    for name in getfilelist_fromesinfo(tableid, directory):
+        if name.endswith('.%s'%(extension)):
+            continue
+        source = os.path.join(directory, name)
+        target = "%s.%s"%(source,extension)
+        with open(source, 'rb') as fin:
+            with open(target + '.tmp', 'wb') as fraw:
+                fhash = HashingWriter(fraw)
+                with open_function(fhash, 'wb', compresslevel=level) as fout:
+                    shutil.copyfileobj(fin, fout, 1024 * 1024)
+        os.replace(target + '.tmp', target)
+        os.remove(source)
+        hashes["%s.%s"%(name,extension)] = (fhash.size, fhash.sha256.hexdigest())
+        extractinfo = re.sub(r"(?<![\w.])%s(?![\w.])"%(re.escape(name)), "%s.%s"%(name,extension), extractinfo)
+    with codecs.open(PATH + '.tmp', "w", common.charset) as f:
+        f.write(extractinfo)
+    os.replace(PATH + '.tmp', PATH)
+    return hashes
+
+# File object which computes size and sha256 of the data written through it to a file
+class HashingWriter(object):
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size = self.size + len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+# Function which writes the manifest of extracted data files of a table or part of table
+# Manifest (<tableid>manifest next to <tableid>extractinfo) has a line <file name>,<size>,<sha256> for each file
+# of extractinfo and each file of LOB values (<tableid>_row<rowid>.<column id>) in the directory.
+# Files in hashes (file name and (size, sha256)) were hashed while written, other files are read once.
+# Manifest is read by copy_data_to_hdlfs.sh and by load utility to verify upload of the files.
+def write_manifest(tableid, directory, hashes):
+    lines = []
+    names = getfilelist_fromesinfo(tableid, directory)
+    names = names + sorted([name for name in os.listdir(directory) if fnmatch.fnmatch(name, "%s_row*"%(tableid)) and name not in names])
+    for name in names:
+        if name in hashes:
+            size, sha256 = hashes[name]
+        else:
+            sha256 = hashlib.sha256()
+            size = 0
+            with open(os.path.join(directory, name), 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha256.update(chunk)
+                    size = size + len(chunk)
+            sha256 = sha256.hexdigest()
+        lines.append("%s,%s,%s"%(name,size,sha256))
+    PATH = '%s%s%smanifest'%(directory,path_sep,tableid)
+    with codecs.open(PATH + '.tmp', "w", common.charset) as f:
+        for line in lines:
+            f.write(line + newline)
+    os.replace(PATH + '.tmp', PATH)
+
+# Function which writes the manifest of a table extracted by an extraction process and posts the table as extracted
+# It runs while the process still holds the table as its lease, so a table is never lost between its extraction
+# and its manifest if the process dies or is stopped.
+def post_extracted_table(directory, hashes, owner, table_withsize, qSuccess, qFail, metrics):
+    tableid = table_withsize[3]
+    strt = datetime.datetime.now()
+    try:
+        write_manifest(tableid, directory, hashes)
+        post_metrics(metrics, table_withsize, None, 'manifest', strt, directory, 'ok', None)
+        qSuccess.put((owner,table_withsize))
+    except Exception as exp:
+        post_metrics(metrics, table_withsize, None, 'manifest', strt, directory, 'failed', None)
+        logging.error("Manifest of table %s [tableID: %s] could not be written: %s"%(table_withsize[0],tableid,str(exp)))
+        qFail.put((owner,table_withsize[0].split('.')[1],tableid,exp))
+
+# Function which returns (number of files, bytes) of data files in directory of an extracted table or part of table
+def data_files_size(directory):
+    files = 0
+    size = 0
+    if not os.path.isdir(directory):
+        return files, size
+    for f in os.listdir(directory):
+        path = os.path.join(directory, f)
+        if f.endswith('.sql') or f.endswith('extractinfo') or f.endswith('manifest') or f.endswith('.tmp') or not os.path.isfile(path):
+            continue
+        files = files + 1
+        size = size + os.path.getsize(path)
+    return files, size
+
+# Function which posts metrics of a phase (extract, compress or manifest) of a table or part of table
+# metrics is (metrics queue, extraction process id as <host>:<port>#<connection number>)
+# Files and bytes are of the data files in directory after the phase. compression_ratio is ratio of
+# uncompressed bytes to bytes written, None if it is not known (data compressed by IQ).
+# Records are written in extraction_metrics.jsonl by a thread of extract_main.
+def post_metrics(metrics, table_withsize, part, phase, strt, directory, status, compression_ratio):
+    qMetrics, worker_id = metrics
+    wall_time = common.elap_time(strt)
+    files, size = data_files_size(directory)
+    rows = None
+    # Row count of a part of table is not known without counting it
+    if part is None:
+        rows = int(table_withsize[1])
+    record = {'time': datetime.datetime.now().isoformat(), 'table': table_withsize[0], 'table_id': str(table_withsize[3]),
+              'part': part, 'phase': phase, 'status': status, 'node': worker_id.rsplit('#', 1)[0], 'connection': worker_id,
+              'rows': rows, 'files': files, 'bytes': size, 'compression_ratio': compression_ratio,
+              'wall_time_sec': round(wall_time, 3), 'bytes_per_sec': int(size / wall_time) if wall_time > 0 else None}
+    try:
+        qMetrics.put(record)
+    except Exception as exp:
+        logging.warning("Metrics of table %s [tableID: %s] could not be posted: %s"%(table_withsize[0],table_withsize[3],str(exp)))
+
+# Function which returns compression ratio of data files written by IQ for post_metrics
+# Files are not compressed by IQ for LOB tables, on 16.1 SP01 and if Binary table class is not compressed with gzip
+def extract_compression_ratio(lob_count):
+    codec, level = table_compression(lob_count)
+    if lob_count == 0 and compressed_data == 1 and codec == 'gzip':
+        return None
+    return 1.0
+
+# Function which runs compression stage of a table or part of table and posts its metrics
+# Returns dictionary of compressed file name and (size, sha256)
+def compress_table_files(metrics, table_withsize, part, tableid, directory, lob_count):
+    strt = datetime.datetime.now()
+    files, size = data_files_size(directory)
+    try:
+        hashes = compress_extracted_files(tableid, directory, *table_compression(lob_count))
+    except Exception:
+        post_metrics(metrics, table_withsize, part, 'compress', strt, directory, 'failed', None)
+        raise
+    compressed_files, compressed_size = data_files_size(directory)
+    ratio = None
+    if compressed_size > 0:
+        ratio = round(size / float(compressed_size), 3)
+    post_metrics(metrics, table_withsize, part, 'compress', strt, directory, 'ok', ratio)
+    return hashes
+
+# Function which returns the extract options of a table
+# LOB tables are extracted as text with quotes and others in binary format
+# LOB tables in packed format are not extracted by IQ, see extract_lob_packed()
+# Binary format is compressed by IQ if gzip is the codec of Binary table class in Compression
+def table_extract_options(tableid, directory, lob_count, parallel_degree):
+    # Rows of LOB tables in packed format are fetched by the session, so IQ must not extract them
+    if lob_count != 0 and common.lob_extract_format == 'packed':
+        return [("temp_extract_file_prefix", "''")]
+    options = [("temp_extract_directory", "'%s'"%(directory)), ("temp_extract_file_prefix", "'%s'"%(tableid)),
+               ("Temp_Extract_Max_Parallel_Degree", "%s"%(parallel_degree))]
+    if lob_count != 0:
+        options.append(("Temp_Extract_File_Extension", "'txt'"))
+        options.append(("Temp_Extract_Binary", "'off'"))
+        options.append(("Temp_Extract_Compress", "'off'"))
+        options.append(("Temp_Extract_Quotes", "'on'"))
+        options.append(("Temp_Extract_Escape_Quotes", "'on'"))
+        options.append(("Temp_Extract_Row_Delimiter", "'\n'"))
+    else:
+        codec, level = table_compression(lob_count)
+        if compressed_data == 1 and codec == 'gzip':
+            options.append(("Temp_Extract_File_Extension", "'gz'"))
+            options.append(("Temp_Extract_Compress", "'on'"))
+            options.append(("TEMP_EXTRACT_GZ_COMPRESSION_LEVEL", "'%s'"%(level)))
+        elif compressed_data == 1:
+            options.append(("Temp_Extract_File_Extension", "'inp'"))
+            options.append(("Temp_Extract_Compress", "'off'"))
+        else:
+            options.append(("Temp_Extract_File_Extension", "'inp'"))
+        options.append(("Temp_Extract_Binary", "'on'"))
+        options.append(("Temp_Extract_Quotes", "'off'"))
+        options.append(("Temp_Extract_Escape_Quotes", "'off'"))
+    return options
 
 # Function to extract data using temporary options
 # which takes queue and get tablename to be extracted from that queue
 # and connection string from a list
+# Each process keeps one session for all its tables and only per table options are changed
 # This function is not for 16.1 SP01 and 16.0 SP11 versions
-def extract_single(q, connstr_port,total_table,batch,log_q,qSuccess,qFail,tables_count,fail_count,file_write_lock):
+def extract_single(q, connstr_port,log_q,qSuccess,qFail,range_status,range_lock,thread_budget,worker_status,qMetrics,slot):
     global compressed_data
     if log_q:
         qh = QueueHandler(log_q)
         logger = logging.getLogger()
         logger.setLevel(logging.INFO)
         logger.addHandler(qh)
+    conn = None
+    tasks_done = 0
+    metrics = (qMetrics, worker_status[1])
+    heartbeat_stop = threading.Event()
+    threading.Thread(target=lease_heartbeat, args=(worker_status, heartbeat_stop), daemon=True).start()
+    # Task which failed with a transient error is extracted again by the same process after a backoff wait
+    retry_task = None
+    attempt = 0
     while True:
         tableName = ""
+        table_withsize = None
         count = 0
+        hashes = {}
+        failures = []
         try:
-            table_withsize = q.get_nowait()
+            if retry_task is not None:
+                table_withsize = retry_task
+                retry_task = None
+                attempt = attempt + 1
+                report_worker_state(worker_status, 'retry_wait', table_withsize, tasks_done)
+                time.sleep(common.retry_backoff(attempt))
+            else:
+                conn = wait_for_slot(thread_budget, slot, q, conn, worker_status, tasks_done)
+                table_withsize = next_extract_table(q)
+                attempt = 0
+                tasks_done = tasks_done + 1
+            report_worker_state(worker_status, 'extracting', table_withsize, tasks_done - 1)
+            # Task of a part (rowid range or partition) of a table
+            if len(table_withsize) > 5:
+                conn, retry_task = extract_table_part(table_withsize, conn, connstr_port, q, thread_budget, qSuccess, qFail, range_status, range_lock, metrics, attempt)
+                continue
             splits = table_withsize[0].split('.')
             tableName = splits[1]
             owner = splits[0]
@@ -2101,56 +3163,84 @@ def extract_single(q, connstr_port,total_table,batch,log_q,qSuccess,qFail,tables
             connectstr = connstr_port[0]
             hostport = connstr_port[1]
             is_table_failed = False
+            is_table_extracted = False
             try:
-                conn = pyodbc.connect(connectstr, timeout=0)
-                cursor = conn.cursor()
                 strt = datetime.datetime.now()
                 logging.info( "Starting extraction of table: %s.%s [tableID:%s] by : %s"%(owner,tableName,tableid,hostport))
                 logging.info("%s"%(common.dividerline))
 
-                cursor.execute("select setting from SYSOPTIONS where \"option\"='string_rtruncation';")
-                string_truncation = cursor.fetchone()[0]
-                if string_truncation.lower() == "on":
-                    cursor.execute("set temporary option STRING_RTRUNCATION = 'off'")
-                cursor.execute("""select count(*) from SYS.SYSDOMAIN d JOIN SYS.SYSCOLUMN c ON
-                            (c.domain_id = d.domain_id) JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id )
-                                     JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where t.table_name='%s'
-                     and u.user_name='%s'and (d.domain_name='long varchar' or d.domain_name='long binary');"""%(tableName, owner))
-                count = cursor.fetchone()[0]
+                if conn is None:
+                    conn = open_extract_session(connectstr)
+                metadata = get_table_metadata(table_withsize, conn)
+                count = metadata['lob_count']
                 # make the directory corresponding to each table with directory name as owner.tablename
                 # in the datapath directory
                 folder = "%s%s%s"%(datapath,path_sep,tableid)
+                # Files of the failed attempt are removed before the table is extracted again
+                if attempt != 0 and os.path.isdir(folder):
+                    shutil.rmtree(folder)
                 if not os.path.isdir(folder):
                     os.mkdir(folder)
 
                 npath = folder
+                parallel_degree = acquire_parallel_degree(thread_budget, q, tableid, int(table_withsize[2]))
                 if platform.system() == "Windows" and npath.startswith("\\"):
                     npath1 = os.path.join("\\", npath)
-                    cursor.execute("set temporary option temp_extract_directory = '%s'"%(npath1))
+                    conn, cursor = set_table_extract_options(conn, connectstr, table_extract_options(tableid, npath1, count, parallel_degree))
                 else:
-                    cursor.execute("set temporary option temp_extract_directory = '%s'"%(npath))
+                    conn, cursor = set_table_extract_options(conn, connectstr, table_extract_options(tableid, npath, count, parallel_degree))
             except Exception as exp:
                 is_table_failed = True
-                qFail.put((owner,tableName,tableid,exp))
+                failures.append(exp)
+
+            # Table can't be extracted without its extract options, so record the failure
+            # and open a new session for next table
+            if is_table_failed:
+                release_parallel_degree(thread_budget, tableid)
+                close_extract_session(conn)
+                conn = None
+                retry_task = retry_or_fail_extraction(failures, table_withsize, attempt, qFail)
+                continue
+
+            extract_strt = datetime.datetime.now()
+            if count != 0 and common.lob_extract_format != 'file_per_value':
+                try:
+                    if platform.system() == "Windows" and npath.startswith("\\"):
+                        extract_lob_single_scan(table_withsize, conn, cursor, npath, npath1)
+                    else:
+                        extract_lob_single_scan(table_withsize, conn, cursor, npath, npath)
+                    is_table_extracted = True
+                except Exception as exp:
+                    is_table_failed = True
+                    failures.append(exp)
+                post_metrics(metrics, table_withsize, None, 'extract', extract_strt, npath, 'ok' if is_table_extracted else 'failed', extract_compression_ratio(count))
 
-            if count != 0:
+                if is_table_extracted and compress_after_extract(count):
+                    try:
+                        hashes = compress_table_files(metrics, table_withsize, None, tableid, npath, count)
+                    except Exception as exp:
+                        is_table_extracted = False
+                        is_table_failed = True
+                        failures.append(exp)
+
+                try:
+                    form_load_table_bfilesequential(table_withsize, conn, npath,1)
+                except Exception as exp:
+                    is_table_failed = True
+                    failures.append(exp)
+
+            elif count != 0:
                 if platform.system() == "Windows" and npath.startswith("\\"):
                     text =  form_select_for_lobbfile(table_withsize,conn,npath1)
                 else:
                     text =  form_select_for_lobbfile(table_withsize,conn,npath)
                 # If the table has LOB datatypes either long varchar or long binary
                 # then extraction of table should be done using BFILE() method
-                cursor.execute("SET TEMPORARY OPTION temp_extract_file_prefix ='%s'"%(tableid))
-                cursor.execute("set temporary option Temp_Extract_File_Extension = 'txt'")
-                cursor.execute("set temporary option Temp_Extract_Max_Parallel_Degree = 64")
-                cursor.execute("set temporary option Temp_Extract_Quotes = 'on'")
-                cursor.execute("set temporary option Temp_Extract_Escape_Quotes = 'on'")
-                cursor.execute("set temporary option Temp_Extract_Row_Delimiter = '\n'")
                 try:
                     cursor.execute(text).fetchall()
                 except Exception as exp:
                     is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
+                    failures.append(exp)
 
                 cursor.execute("SET TEMPORARY OPTION temp_extract_file_prefix =''")
 
@@ -2160,99 +3250,107 @@ def extract_single(q, connstr_port,total_table,batch,log_q,qSuccess,qFail,tables
                     text1 = bfile_select_stmt(table_withsize,conn,npath)
                 try:
                     cursor.execute(text1).fetchall()
-                    qSuccess.put((owner,table_withsize))
+                    is_table_extracted = True
                 except Exception as exp:
                     is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
+                    failures.append(exp)
+                post_metrics(metrics, table_withsize, None, 'extract', extract_strt, npath, 'ok' if is_table_extracted else 'failed', extract_compression_ratio(count))
+
+                # Text files are compressed, files of LOB values are read by LOAD TABLE as they are
+                if is_table_extracted and compress_after_extract(count):
+                    try:
+                        hashes = compress_table_files(metrics, table_withsize, None, tableid, npath, count)
+                    except Exception as exp:
+                        is_table_extracted = False
+                        is_table_failed = True
+                        failures.append(exp)
 
                 try:
                     form_load_table_bfilesequential(table_withsize, conn, npath,1)
                 except Exception as exp:
                     is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
+                    failures.append(exp)
 
             else:
-                cursor.execute("SET TEMPORARY OPTION temp_extract_file_prefix ='%s'"%(tableid))
-                if compressed_data == 1:
-                    cursor.execute("set temporary option Temp_Extract_File_Extension = 'gz'")
-                    cursor.execute("set temporary option Temp_Extract_Compress = 'on'")
-                    cursor.execute("set temporary option TEMP_EXTRACT_GZ_COMPRESSION_LEVEL = '1'")
-                else:
-                    cursor.execute("set temporary option Temp_Extract_File_Extension = 'inp'")
-
-                cursor.execute("set temporary option Temp_Extract_Max_Parallel_Degree = 64")
-                cursor.execute("SET TEMPORARY OPTION Temp_Extract_Binary = 'on'")
-                cursor.execute("select column_name from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(tableName, owner ))
-                collst = []
-                for col in cursor:
-                    collst.append(col[0])
-                column_string = ""
-                n = len(collst)
-                for i in range(n-1):
-                    column_string = column_string + '\"%s\"'%(collst[i]) + ", "
-                column_string = column_string + '\"%s\"'%(collst[n-1])
+                column_string = quoted_column_string(metadata)
 
                 select_query = """Select %s FROM "%s"."%s";"""%(column_string,owner,tableName)
                 try:
                     cursor.execute(select_query).fetchall()
-                    qSuccess.put((owner,table_withsize))
+                    is_table_extracted = True
                 except Exception as exp:
                     is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
+                    failures.append(exp)
+                post_metrics(metrics, table_withsize, None, 'extract', extract_strt, npath, 'ok' if is_table_extracted else 'failed', extract_compression_ratio(count))
 
-                cursor.execute("SET TEMPORARY OPTION Temp_Extract_Binary = 'off'")
+                set_temporary_options(cursor, [("temp_extract_file_prefix", "''"), ("Temp_Extract_Binary", "'off'")])
+                if is_table_extracted and compress_after_extract(count):
+                    try:
+                        hashes = compress_table_files(metrics, table_withsize, None, tableid, npath, count)
+                    except Exception as exp:
+                        is_table_extracted = False
+                        is_table_failed = True
+                        failures.append(exp)
                 try:
                     form_load_table_stmt(table_withsize, conn, npath, 1)
                 except Exception as exp:
                     is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
-
-            cursor.execute("SET TEMPORARY OPTION temp_extract_file_prefix = ''")
-            if compressed_data == 1:
-                cursor.execute("set temporary option Temp_Extract_Compress = 'off'")
+                    failures.append(exp)
 
-            lock.acquire()
-            try:
-                PATH = '%s%s%s%s%sextractinfo'%(datapath,path_sep,tableid,path_sep,tableid)
-                if (os.path.isfile(PATH) and os.access(PATH, os.R_OK)):
-                    updateUnloadStatus(qSuccess,batch,total_table,tables_count,fail_count,file_write_lock)
-                if is_table_failed:
-                    updateFailureStatus(qFail,batch,total_table,tables_count,fail_count,file_write_lock)
-
-            finally:
-                lock.release() #release lock
+            release_parallel_degree(thread_budget, tableid)
+            cursor.close()
+            if failures:
+                # Session may be broken by the error, open a new one for next attempt or next table
+                close_extract_session(conn)
+                conn = None
+                retry_task = retry_or_fail_extraction(failures, table_withsize, attempt, qFail)
+            PATH = '%s%s%s%s%sextractinfo'%(datapath,path_sep,tableid,path_sep,tableid)
+            if retry_task is None and is_table_extracted and os.path.isfile(PATH) and os.access(PATH, os.R_OK):
+                post_extracted_table(npath, hashes, owner, table_withsize, qSuccess, qFail, metrics)
 
             elap_sec = common.elap_time(strt)
             days, hours, minutes, seconds = common.calculate_time(elap_sec)
 
             logging.info("Time taken to unload table: %s [tableID: %s] is : %d days, %d hours, %d minutes and %d seconds\n" % (tableName, tableid,days[0], hours[0], minutes[0], seconds[0]))
             logging.info("%s"%(common.dividerline))
-            cursor.close()
-            conn.close()
         except Exception as exp:
             #TODO : Need to fix of NUll entries in the queue
             # Also add try/catch blocks all where needed
             #logging.info("Exception occurred while extracting table: %s"%(tableName))
             if str(exp) != "":
                 logging.error("Unexpected error in extract_single() reported while extracting data: %s"%str(exp))
-                qFail.put((owner,tableName,tableid,exp))
-                updateFailureStatus(qFail,batch,total_table,tables_count,fail_count,file_write_lock)
+                # Session state is unknown after an unexpected error, open a new one for next table
+                close_extract_session(conn)
+                conn = None
+                # Error before a task was taken (for example while waiting for a slot), no table is lost.
+                # Process exits with the error and is restarted by extract_main
+                if table_withsize is None:
+                    heartbeat_stop.set()
+                    raise
+                failures.append(exp)
+                if len(table_withsize) > 5:
+                    release_parallel_degree(thread_budget, "%s/%s"%(table_withsize[3],table_withsize[7]))
+                    retry_task = retry_or_fail_extraction(failures, table_withsize, attempt, qFail)
+                    # Failed part is recorded in range status so that the table is failed once all its parts are done
+                    if retry_task is None:
+                        fail_lost_task(table_withsize, exp, qFail, range_status, range_lock)
+                else:
+                    release_parallel_degree(thread_budget, table_withsize[3])
+                    retry_task = retry_or_fail_extraction(failures, table_withsize, attempt, qFail)
             else:
+                close_extract_session(conn)
+                heartbeat_stop.set()
+                report_worker_state(worker_status, 'finished', None, tasks_done)
                 return
 
 # For version 16.0 SP11 if a table has LOB datatypes then extraction should be done using BFILE() method
 # Function which form select query during bfile extraction
 def form_select_for_lobbfile(tablename,conn,path_to_copy):
-    cursor3 = conn.cursor()
     splits = tablename[0].split('.')
     table = splits[1]
     owner = splits[0]
     tableid = tablename[3]
-    cursor3.execute("select c.column_name,d.domain_name,c.column_id  from SYS.SYSDOMAIN d JOIN SYS.SYSCOLUMN c ON (c.domain_id = d.domain_id) JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-
-    column_domain_list = []
-    for i in cursor3:
-        column_domain_list.append(i)
+    column_domain_list = get_table_metadata(tablename, conn)['columns']
     obj_path = "hdlfs:///%s/Extracted_Data/%s/"%(common.hdlfs_directory,tableid)
 
     cmd = "SELECT "
@@ -2267,22 +3365,16 @@ def form_select_for_lobbfile(tablename,conn,path_to_copy):
 
     command1 = " FROM \"%s\".\"%s\""%(owner,table)
     cmd = cmd + my_string + command1 + ";"
-    cursor3.close()
     return cmd
 
 # For version 16.0 SP11 if a table has LOB datatypes then extraction should be done using BFILE() method
 # Function which form select query during bfile extraction
 def bfile_select_stmt(tablename,conn,path_to_copy):
-    cursor3 = conn.cursor()
     splits = tablename[0].split('.')
     table = splits[1]
     owner = splits[0]
     tableid = tablename[3]
-    cursor3.execute("select c.column_name,d.domain_name,c.column_id from SYS.SYSDOMAIN d JOIN SYS.SYSCOLUMN c ON (c.domain_id = d.domain_id) JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-
-    column_domain_list = []
-    for i in cursor3:
-        column_domain_list.append(i)
+    column_domain_list = get_table_metadata(tablename, conn)['columns']
     cmd = "SELECT "
     filelst = []
     for i in column_domain_list:
@@ -2292,12 +3384,118 @@ def bfile_select_stmt(tablename,conn,path_to_copy):
     my_string = " ,".join(filelst)
     command1 = " FROM \"%s\".\"%s\""%(owner,table)
     cmd = cmd + my_string + command1 + ";"
-    cursor3.close()
     return cmd
 
+# Function which forms select query of single scan extraction of a table with LOB columns (LOB_Extract_Format Single_Scan)
+# The query is run with text extract options. BFILE() of each LOB column writes the value into file
+# <tableid>_row<rowid>.<column id> in path_to_copy while the row is extracted, so text and files of LOB values
+# are written by one scan instead of form_select_for_lobbfile and bfile_select_stmt.
+# Path of the file on data lake Files is extracted in place of the value. BFILE() returns NULL only for NULL
+# values, so a value whose file is not written refers to a missing file and fails LOAD TABLE instead of loading NULL.
+# subdir and predicate are of a part (rowid range or partition) of the table, None for the whole table
+def form_select_single_scan(tablename, conn, path_to_copy, subdir, predicate):
+    splits = tablename[0].split('.')
+    table = splits[1]
+    owner = splits[0]
+    tableid = tablename[3]
+    obj_path = "hdlfs:///%s/Extracted_Data/%s/"%(common.hdlfs_directory,tableid)
+    if subdir is not None:
+        obj_path = obj_path + subdir + "/"
+    filelst = []
+    for i in get_table_metadata(tablename, conn)['columns']:
+        if i[1] == 'long varchar' or i[1] == 'long binary':
+            file_name = "'%s_row' + string(rowid(\"%s\")) + '.%s'"%(tableid,table,i[2])
+            filelst.append("CASE WHEN BFILE('%s/' + %s, \"%s\") IS NOT NULL THEN '%s' + %s ELSE NULL END"%(path_to_copy,file_name,i[0],obj_path,file_name))
+        else:
+            filelst.append('\"%s\"'%(i[0]))
+    cmd = "SELECT " + " ,".join(filelst) + " FROM \"%s\".\"%s\""%(owner,table)
+    if predicate is not None:
+        cmd = cmd + " WHERE %s"%(predicate)
+    return cmd + ";"
+
+# Function which extracts a table or part of table with LOB columns in one scan, either in
+# Single_Scan format (see form_select_single_scan) or in Packed format (see extract_lob_packed)
+# server_path is the directory of extracted files as given to IQ server
+def extract_lob_single_scan(table_withsize, conn, cursor, directory, server_path, subdir=None, predicate=None):
+    if common.lob_extract_format == 'packed':
+        extract_lob_packed(table_withsize, conn, cursor, directory, predicate)
+        return
+    try:
+        cursor.execute(form_select_single_scan(table_withsize, conn, server_path, subdir, predicate)).fetchall()
+    finally:
+        cursor.execute("SET TEMPORARY OPTION temp_extract_file_prefix =''")
+
+# Function which returns a value fetched from IQ as field of a row in packed format
+# Fields are read by load table statement with quotes on and escapes off: strings and dates are quoted
+# with embedded quotes doubled, binary values are written in hexadecimal and NULL is written as NULL
+# A string containing the row delimiter can't be read back, so extraction of its table fails
+def packed_value(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, decimal.Decimal):
+        return format(value, 'f')
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return '"%s"'%(value.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return '"%s"'%(value.isoformat())
+    value = str(value)
+    if packed_row_delimiter in value:
+        raise Exception("Value contains row delimiter of packed format (record separator followed by newline), table can't be extracted with LOB_Extract_Format Packed")
+    return '"%s"'%(value.replace('"', '""'))
+
+# Function which extracts a table with LOB columns in packed format (LOB_Extract_Format Packed)
+# Rows are fetched over the extraction session and written with LOB values inline into segment files
+# <tableid>_<n>.txt of at most LOB_Segment_Size_MB, a row is never split between segment files.
+# No file is written per LOB value. extractinfo is written as by IQ, so load table statement,
+# compression and manifest read the segment files as text files of other LOB tables.
+# predicate selects the rows of a part (rowid range or partition) of the table, None for all rows
+# Returns number of extracted rows
+def extract_lob_packed(table_withsize, conn, cursor, directory, predicate=None):
+    splits = table_withsize[0].split('.')
+    tableid = table_withsize[3]
+    metadata = get_table_metadata(table_withsize, conn)
+    select_query = 'SELECT %s FROM "%s"."%s"'%(quoted_column_string(metadata),splits[0],splits[1])
+    if predicate is not None:
+        select_query = select_query + " WHERE %s"%(predicate)
+    cursor.execute(select_query + ";")
+    names = []
+    rows = 0
+    size = 0
+    f = None
+    try:
+        while True:
+            fetched = cursor.fetchmany(packed_fetch_rows)
+            if not fetched:
+                break
+            for row in fetched:
+                line = (",".join([packed_value(value) for value in row]) + packed_row_delimiter).encode(common.charset)
+                if f is None or (size > 0 and size + len(line) > common.lob_segment_size):
+                    if f is not None:
+                        f.close()
+                    names.append("%s_%d.txt"%(tableid,len(names) + 1))
+                    f = open(os.path.join(directory, names[-1]), "wb")
+                    size = 0
+                f.write(line)
+                size = size + len(line)
+                rows = rows + 1
+    finally:
+        if f is not None:
+            f.close()
+    with codecs.open(os.path.join(directory, "%sextractinfo"%(tableid)), "w", common.charset) as f:
+        f.write("rows: %d%sfiles: %s%s"%(rows,newline,",".join(["'%s'"%(name) for name in names]),newline))
+    return rows
+
 # For version 16.0 SP11 if a table has LOB datatypes then extraction should be done using BFILE() method
 # Function which form load table statement for tables having LOB datatypes
-def form_load_table_bfilesequential(tablename, conn, path_to_copy,parl):
+# With LOB_Extract_Format Packed, LOB values are inline in the text files instead of secondary files
+# subdirs are the subdirectories of parts of a table extracted in parts, None if it is not
+def form_load_table_bfilesequential(tablename, conn, path_to_copy,parl,subdirs=None):
     splits = tablename[0].split('.')
     table = splits[1]
     owner = splits[0]
@@ -2308,18 +3506,8 @@ def form_load_table_bfilesequential(tablename, conn, path_to_copy,parl):
         f1.write("COMMIT;" + newline)
         f1.write("BEGIN TRANSACTION;" + newline)
 
-        cursor3 = conn.cursor()
-        cursor3.execute("select setting from SYSOPTIONS where \"option\"='string_rtruncation';")
-        string_truncation = cursor3.fetchone()[0]
-        if string_truncation.lower() == "on":
-            cursor3.execute("set temporary option STRING_RTRUNCATION = 'off'")
-        cursor3.execute("select \"default\" from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-        idtcol = []
-        idtflag = 0
-        for idt in cursor3:
-            idtcol.append(idt[0])
-        if 'Identity/Autoincrement' in idtcol or 'autoincrement' in idtcol:
-            idtflag = 1
+        metadata = get_table_metadata(tablename, conn)
+        idtflag = has_identity_column(metadata)
         if owner.lower() == 'dba':
             command1 = "LOAD TABLE \"HDLADMIN\".\"%s\""%(table)
             f1.write("sp_iqlogtoiqmsg('HDL-Migration: " + command1 + "');" + newline + newline)
@@ -2332,19 +3520,16 @@ def form_load_table_bfilesequential(tablename, conn, path_to_copy,parl):
             if idtflag == 1:
                 f1.write("set temporary option \"identity_insert\" = \"%s.%s\";"%(owner,table)+ newline + newline)
             cntstmt = "SELECT count(*) into cnt FROM  \"%s\".\"%s\""%(owner,table)
-        cursor3.execute("select c.column_name,d.domain_name,c.nulls  from SYS.SYSDOMAIN d JOIN SYS.SYSCOLUMN c ON (c.domain_id = d.domain_id) JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(table, owner ))
-        l = []
-        for i in cursor3:
-            l.append(i)
-
         command2 = ""
         filelst = []
-        for i in l:
-            if i[1] == 'long varchar' :
+        for i in metadata['columns']:
+            if (i[1] == 'long varchar' or i[1] == 'long binary') and common.lob_extract_format == 'packed':
+                filelst.append( i[0] + " NULL('NULL')")
+            elif i[1] == 'long varchar' :
                 filelst.append( i[0] + " ASCII FILE (',') NULL('NULL')")
             elif i[1] == 'long binary':
                 filelst.append( i[0] + " BINARY FILE (',') NULL('NULL')")
-            elif i[2] == 'Y':
+            elif i[3] == 'Y':
                 filelst.append( i[0] + " NULL('NULL')")
             else:
                 filelst.append( i[0] )
@@ -2352,20 +3537,14 @@ def form_load_table_bfilesequential(tablename, conn, path_to_copy,parl):
         command2 = ','.join(map(str, filelst))
         command = " " + command1 + "( " + command2 + " )"
         f1.write(command)
-        cursor3.close()
         tab = "     "
         f1.write(newline + tab + "FROM" + " ")
         filelst = list()
         l = list()
-        if parl == 1:
-
-            l = getfilelist_fromesinfo(tableid,path_to_copy)
+        if subdirs is not None:
+            l = getfilelist_fromparts(tableid,subdirs)
         else:
-            i = 1
-            while i < 9:
-                var = '%s_%s.txt'%(tableid,i)
-                l.append(var)
-                i = i + 1
+            l = getfilelist_fromesinfo(tableid,path_to_copy)
 
         obj_path = "hdlfs:///%s/Extracted_Data/%s/"%(common.hdlfs_directory,tableid)
         for lst in l:
@@ -2375,185 +3554,48 @@ def form_load_table_bfilesequential(tablename, conn, path_to_copy,parl):
         f1.write(my_string )
 
         f1.write(newline + tab + "escapes off quotes on")
-        f1.write(newline + tab + "row delimited by \'\\" + "n" "'"+";")
+        if common.lob_extract_format == 'packed':
+            f1.write(newline + tab + "row delimited by '\\x1e\\n'"+";")
+        else:
+            f1.write(newline + tab + "row delimited by \'\\" + "n" "'"+";")
 
         rowCountVerifyInHDL(tablename,path_to_copy,cntstmt,f1)
 
-def size_query(ext,tableid):
-    size_const = 3990000000
-
-    l1 = []
-    l2 = []
-
-    i = 1
-    while i < 9:
-        l1.append ("SET TEMPORARY OPTION Temp_Extract_Name%s ='%s_%s.%s';"%(i,tableid,i,ext))
-        l1.append ("SET TEMPORARY OPTION Temp_Extract_Size%s = %s;"%(i,size_const))
-        l2.append ("SET TEMPORARY OPTION Temp_Extract_Name%s ='';"%(i))
-        l2.append ("SET TEMPORARY OPTION Temp_Extract_Size%s = 0;"%(i))
-        i = i + 1
-
-    return l1,l2
-
-# Function to extract data using temporary options
-# which takes queue and get tablename to be extracted from that queue
-# and connection string from a list
-# This function is for 16.1 SP01 and 16.0 SP11 versions
-# The implementation is different since parallel extraction is not in above versions.
-def extract_single_sequential(q, connstr_port,total_table,batch,log_q,qSuccess,qFail,tables_count,fail_count):
-    if log_q:
-        qh = QueueHandler(log_q)
-        logger = logging.getLogger()
-        logger.setLevel(logging.INFO)
-        logger.addHandler(qh)
-    while True:
-        try:
-            table_withsize = q.get_nowait()
-            connectstr = connstr_port[0]
-            hostport = connstr_port[1]
-            splits = table_withsize[0].split('.')
-            tableName = splits[1]
-            owner = splits[0]
-            tableid = table_withsize[3]
-            conn = pyodbc.connect(connectstr, timeout=0)
-            cursor = conn.cursor()
-            strt = datetime.datetime.now()
-            logging.info( "Starting extraction of table: %s.%s [tableID:%s] by : %s"%(owner,tableName,tableid,hostport))
-            logging.info("%s"%(common.dividerline))
-
-            cursor.execute("""select count(*) from SYS.SYSDOMAIN d JOIN SYS.SYSCOLUMN c ON
-                            (c.domain_id = d.domain_id) JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id )
-                                     JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where t.table_name='%s'
-                     and u.user_name='%s'and (d.domain_name='long varchar' or d.domain_name='long binary');"""%(tableName, owner))
-
-            count = cursor.fetchone()[0]
-            cursor.execute("select @@version;")
-            version = cursor.fetchone()[0]
-            # make the directory corresponding to each table with directory name as owner.tablename
-            # in the Extract_Path/Migration_Data/Extracted_Data directory
-            folder = "%s%s%s"%(datapath,path_sep,tableid)
-            if not os.path.isdir(folder):
-                os.mkdir(folder)
-
-            npath = folder
-            if platform.system() == "Windows" and npath.startswith("\\"):
-                npath1 = os.path.join("\\", npath)
-                cursor.execute("set temporary option temp_extract_directory = '%s'"%(npath1))
-            else:
-                cursor.execute("set temporary option temp_extract_directory = '%s'"%(npath))
-            is_table_failed = False
-            if count != 0:
-                if 'SAP IQ/16.0.' in version:
-                    if platform.system() == "Windows" and npath.startswith("\\"):
-                        text =  form_select_for_lobbfile(table_withsize,conn,npath1)
-                    else:
-                        text =  form_select_for_lobbfile(table_withsize,conn,npath)
-                    # If the table has LOB datatypes either long varchar or long binary on 16.0 SP11
-                    # then extraction of table should be done using BFILE() method
-                    l1 ,l2 = size_query('txt',tableid)
-                    for i in l1:
-                        cursor.execute(i)
-
-                    cursor.execute("set temporary option Temp_Extract_Quotes = 'on'")
-                    cursor.execute("set temporary option Temp_Extract_Escape_Quotes = 'on'")
-                    cursor.execute("set temporary option Temp_Extract_Row_Delimiter = '\n'")
-                    try:
-                        cursor.execute(text).fetchall()
-                    except Exception as exp:
-                        is_table_failed = True
-                        qFail.put((owner,tableName,tableid,exp))
-
-                    for i in l2:
-                        cursor.execute(i)
-                    if platform.system() == "Windows" and npath.startswith("\\"):
-                        text1 = bfile_select_stmt(table_withsize,conn,npath1)
-                    else:
-                        text1 = bfile_select_stmt(table_withsize,conn,npath)
-                    try:
-                        cursor.execute(text1).fetchall()
-                        qSuccess.put((owner,table_withsize))
-                    except Exception as exp:
-                        is_table_failed = True
-                        qFail.put((owner,tableName,tableid,exp))
-
-                try:
-                    form_load_table_bfilesequential(table_withsize, conn, npath,0 )
-                except Exception as exp:
-                    is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
-
-            else:
-                l1 ,l2 = size_query('inp',tableid)
-                for i in l1:
-                    cursor.execute(i)
-
-                cursor.execute("SET TEMPORARY OPTION Temp_Extract_Binary = 'on'")
-                cursor.execute("select column_name from SYS.SYSCOLUMN c JOIN SYS.SYSTABLE t ON (c.table_id = t.table_id ) JOIN SYS.SYSUSER u ON (u.user_id = t.creator) where  t.table_name='%s' and u.user_name='%s'"%(tableName, owner ))
-                collst = []
-                for col in cursor:
-                    collst.append(col[0])
-                column_string = ""
-                n = len(collst)
-                for i in range(n-1):
-                    column_string = column_string + '\"%s\"'%(collst[i]) + ", "
-                column_string = column_string + '\"%s\"'%(collst[n-1])
-
-                select_query = """Select %s FROM "%s"."%s";"""%(column_string,owner,tableName)
-                try:
-                    cursor.execute(select_query).fetchall()
-                    qSuccess.put((owner,table_withsize))
-                except Exception as exp:
-                    is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
-
-                for i in l2:
-                    cursor.execute(i)
-
-                cursor.execute("SET TEMPORARY OPTION Temp_Extract_Binary = 'off'")
-                try:
-                    form_load_table_sequential(table_withsize, conn, npath, 1)
-                except Exception as exp:
-                    is_table_failed = True
-                    qFail.put((owner,tableName,tableid,exp))
-
-            lock.acquire()
-            try:
-                PATH = '%s%s%s%s%s_1.inp'%(datapath,path_sep,tableid,path_sep,tableid)
-                PATH1 = '%s%s%s%s%s_1.txt'%(datapath,path_sep,tableid,path_sep,tableid)
-
-                if (((os.path.isfile(PATH)) or (os.path.isfile(PATH1))) and is_table_failed == False):
-                    updateUnloadStatus(qSuccess,batch,total_table,tables_count,fail_count,file_write_lock)
-                if is_table_failed :
-                    updateFailureStatus(qFail,batch,total_table,tables_count,fail_count,file_write_lock)
-            finally:
-                lock.release() #release lock
-
-            elap_sec = common.elap_time(strt)
-            days, hours, minutes, seconds = common.calculate_time(elap_sec)
-
-            logging.info("Time taken to unload table: %s [tableID:%s] is : \n%d days, %d hours, %d minutes and %d seconds" % (table_withsize[0], tableid, days[0], hours[0], minutes[0], seconds[0]))
-            logging.info("%s\n"%(common.dividerline))
-            cursor.close()
-            conn.close()
-        except Exception as exp:
-            if str(exp) != "":
-                logging.error("Unexpected error reported in extract_single_sequential() while extracting data: \n%s"%str(exp))
-                updateFailureStatus(qFail,batch,total_table,tables_count,fail_count,file_write_lock)
-            else:
-                return
+# Function which returns weight of each node of node_connect_str, which is weight of its role in Role_Weights
+# times its weight in Node_Weights (1 for a role or node not given). With Node_Weights Cores, weight of a node
+# is number of logical processors of its IQ server (node_cores), a node whose processors can't be read gets the average of others.
+def node_weights(node_connect_str, node_roles, node_cores):
+    weights = []
+    for i in range(len(node_connect_str)):
+        weights.append(common.role_weights.get(node_roles[i], 1))
+    if common.node_weights == 'cores':
+        known = [count for count in node_cores if count]
+        average = float(sum(known)) / len(known) if known else 1
+        for i in range(len(node_connect_str)):
+            weights[i] = weights[i] * (node_cores[i] or average)
+    else:
+        for i in range(len(node_connect_str)):
+            weight = node_config_value(common.node_weights, node_connect_str[i][1])
+            if weight is not None:
+                weights[i] = weights[i] * weight
+    return weights
 
 # Function to form connect strings for each node based on
-# value of Client_Num_Conn provided in json config file
+# value of Client_Num_Conn provided in json config file and weights of nodes
 def connect_list(connectstr):
+    # connection_list is rebuilt on every call as it is used for both inventory and extraction
+    del connection_list[:]
     connection_sets = {}
     for i in range(nodes_count):
         connection_sets[i] = []
 
     node_connect_str = []
+    node_roles = []
     conn = pyodbc.connect(connectstr, timeout=0)
     cursor = conn.cursor()
     coord = "host=" + str(common.hostname) + ":" +  str(common.port)
     node_connect_str.append((connectstr,coord))
+    node_roles.append('coordinator')
 
     cursor.execute("select connection_info from sp_iqmpxinfo() where (role= 'reader' and status='included' and inc_state='active');")
     connrecords = cursor.fetchall()
@@ -2564,6 +3606,7 @@ def connect_list(connectstr):
         full_host = i[0].replace(f"host={common.hostname.split('.')[0]}:", f"host={common.hostname}:")
         connvarstr = 'DRIVER={%s};%s;UID=%s;PWD=%s;ENC=%s' % (common.driver, full_host, common.userid, common.password, common.enc_string)
         node_connect_str.append((connvarstr, full_host))
+        node_roles.append('reader')
 
     cursor.execute("select connection_info from sp_iqmpxinfo() where (role= 'writer' and status='included' and inc_state='active');")
     connrecords = cursor.fetchall()
@@ -2574,10 +3617,26 @@ def connect_list(connectstr):
         full_host = i[0].replace(f"host={common.hostname.split('.')[0]}:", f"host={common.hostname}:")
         connvarstr = 'DRIVER={%s};%s;UID=%s;PWD=%s;ENC=%s' % (common.driver, full_host, common.userid, common.password, common.enc_string)
         node_connect_str.append((connvarstr, full_host))
-
+        node_roles.append('writer')
+
+    # Cores of nodes are read once and used for both weights of nodes and parallel degree of their extractions
+    del connection_cores[:]
+    connection_cores.extend(node_core_counts(node_connect_str))
+    del connection_weights[:]
+    connection_weights.extend(node_weights(node_connect_str, node_roles, connection_cores))
+    max_weight = max(connection_weights)
     for i in range(len(node_connect_str)):
         total_connection_per_node = []
-        for j in range(int(common.conn_num)):
+        node_conn_num = int(common.conn_num)
+        # Node with the highest weight uses Client_Num_Conn connections, other nodes in proportion to their weight
+        if common.role_weights or common.node_weights:
+            node_conn_num = max(1, int(round(node_conn_num * connection_weights[i] / max_weight)))
+            logging.info("Node %s (%s) with weight %s uses %s connections"%(node_name(node_connect_str[i][1]),node_roles[i],connection_weights[i],node_conn_num))
+        # Node_Max_Conn caps the number of concurrent connections on a node
+        node_max_conn = node_config_value(common.node_max_conn, node_connect_str[i][1])
+        if node_max_conn is not None and node_max_conn < node_conn_num:
+            node_conn_num = node_max_conn
+        for j in range(node_conn_num):
             total_connection_per_node.append(node_connect_str[i])
         connection_sets[i] = total_connection_per_node
 
@@ -2645,14 +3704,9 @@ def extracted_tables_count(f):
 # If both lists are equal then extraction of all tables done successfully
 # f1 :iqtables_list, f2 : extractedTables_out and f3 : extractedFailures_err
 def check_migration_status(f1,f2,f3,batch):
-    iqtableslist = list()
-    with codecs.open(f1, "r", common.charset) as f:
-        for line in f.readlines():
-            line = line.rstrip(newline)
-            splits = line.split(',')
-            iqtableslist.append((splits[0]))
+    total_count, succ_count = state_store.extract_counts(get_state_conn(), batch)
 
-    if len(iqtableslist) == 0:
+    if total_count == 0:
         logging.info("%s"%(common.double_divider_line))
         logging.info("The Database has no IQ tables. No need of Extraction")
         logging.info("%s"%(common.double_divider_line))
@@ -2663,18 +3717,9 @@ def check_migration_status(f1,f2,f3,batch):
         logging.info("================================================================================")
 
     else:
-        extractedtablelist = list()
-
-        with codecs.open(f2, "r", common.charset) as f:
-            for line in f.readlines():
-                line = line.rstrip(newline)
-                splits = line.split(',')
-                if len(splits) == 4:
-                    extractedtablelist.append((splits[0]))
+        fail_count = total_count - succ_count
 
-        failed_list = [item for item in iqtableslist  if item not in extractedtablelist]
-
-        if len(failed_list) == 0:
+        if fail_count == 0:
             logging.info("%s"%(common.double_divider_line))
             if batch == 0:
                 logging.info("Extraction of all tables is successful")
@@ -2683,8 +3728,6 @@ def check_migration_status(f1,f2,f3,batch):
             logging.info("%s"%(common.double_divider_line))
             display_clicopy_command(batch)
         else:
-            fail_count = len(failed_list)
-            succ_count = len(extractedtablelist)
             str1 = "Extraction of %s tables failed."%fail_count
             common.print_and_log(str1)
             str1 = "Extraction of %s tables successful."%succ_count
@@ -2707,6 +3750,222 @@ def get_byteorder():
         stdin, stdout, stderr = client.exec_command('python -c "import sys;print sys.byteorder"',get_pty=True)
         byteorder=stdout.readline()
 
+# Function which records state of an extraction process in the state dictionary shared with extract_main
+# worker_status is (state dictionary, process id of the form <host>:<port>#<n>, heartbeat dictionary)
+# State is 'extracting' with the task being extracted, 'retry_wait' with the task waiting to be extracted again
+# after a transient error (its lease does not expire while waiting), 'throttled' while its slot is paused
+# or 'finished' once no table is left for the node
+# The task being extracted is the lease of the process, started is the time the lease was taken
+def report_worker_state(worker_status, state, task, tasks_done):
+    worker_state, worker_id = worker_status[0], worker_status[1]
+    worker_state[worker_id] = {'state': state, 'task': task, 'tasks_done': tasks_done, 'started': time.time()}
+
+# Function which sends heartbeats of an extraction process to extract_main until stop is set
+# It runs in a thread of the process, so heartbeats are sent while a statement of the session runs.
+# Heartbeat has the time and the connection number of the extraction session on IQ server.
+def lease_heartbeat(worker_status, stop):
+    worker_heartbeat, worker_id = worker_status[2], worker_status[1]
+    while True:
+        try:
+            worker_heartbeat[worker_id] = {'time': time.time(), 'connection': session_connection}
+        except Exception:
+            # extract_main has stopped the scheduler manager
+            return
+        if stop.wait(lease_heartbeat_interval):
+            return
+
+# Function which returns seconds a task can be extracted for before its lease expires
+# Table_Extract_Timeout_Min if given, else derived from size of the table or part (see lease_min_bytes_per_sec)
+def lease_deadline(task):
+    if common.table_extract_timeout != 0:
+        return common.table_extract_timeout
+    size = int(task[2])
+    if len(task) > 5:
+        size = size // task[6]
+    return max(lease_min_deadline, int(size / lease_min_bytes_per_sec))
+
+# Function which returns why the lease of the task of an extraction process expired, None if it has not expired
+# A lease expires when extraction of its table or part runs longer than its deadline (see lease_deadline),
+# or when the process sent no heartbeat for lease_heartbeat_timeout seconds
+def lease_expiry(state, heartbeat):
+    if state.get('state') != 'extracting':
+        return None
+    now = time.time()
+    deadline = lease_deadline(state['task'])
+    if now - state['started'] > deadline:
+        return "extraction did not complete in %s minutes"%(deadline // 60)
+    last_heartbeat = max(heartbeat.get('time', 0), state['started'])
+    if now - last_heartbeat > lease_heartbeat_timeout:
+        return "no heartbeat from the process for %d seconds"%(now - last_heartbeat)
+    return None
+
+# Function which cancels the running statement of an extraction session by dropping its connection on IQ server
+def cancel_extract_connection(connectstr, connection, worker_id):
+    if connection is None:
+        logging.warning("Connection of extraction process %s is not known, it can't be dropped on IQ server"%(worker_id))
+        return
+    try:
+        conn = pyodbc.connect(connectstr, timeout=60)
+        cursor = conn.cursor()
+        cursor.execute("drop connection %s"%(connection))
+        cursor.close()
+        conn.close()
+        logging.info("Connection %s of extraction process %s dropped on IQ server"%(connection,worker_id))
+    except Exception as exp:
+        logging.warning("Connection %s of extraction process %s could not be dropped on IQ server: %s"%(connection,worker_id,str(exp)))
+
+# Function which handles the task of an extraction process which died while extracting it, or whose lease expired
+# The task is put back in affinity queue of the node so that another process of the node extracts it.
+# A task which was already given back once is not retried, it is added in the failure file instead
+# (for a part task, the part is marked failed and the table is added in failure file if it was the last part)
+# reason is how the task was lost, as "died" or "was stopped as its lease expired"
+def handle_lost_task(task, worker_id, reason, lost_tasks, node_queue, thread_budget, qFail, range_status, range_lock):
+    tableid = task[3]
+    if len(task) > 5:
+        task_key = "%s/%s"%(tableid,task[7])
+    else:
+        task_key = tableid
+    release_parallel_degree(thread_budget, task_key)
+    lost_tasks[task_key] = lost_tasks.get(task_key, 0) + 1
+    if lost_tasks[task_key] == 1:
+        logging.warning("Extraction process %s %s while extracting %s [tableID: %s], it will be extracted again"%(worker_id,reason,task[0],task_key))
+        node_queue.put((-int(task[2]), -1, task))
+        return
+
+    logging.error("Extraction process %s %s while extracting %s [tableID: %s] again, it will not be extracted again"%(worker_id,reason,task[0],task_key))
+    fail_lost_task(task, Exception("Extraction process %s while extracting the table"%(reason)), qFail, range_status, range_lock)
+
+# Function which adds the table of a task which will not be extracted in failure file
+# For a part task, the part is marked failed and the table is added in failure file if it was the last part
+def fail_lost_task(task, exp, qFail, range_status, range_lock):
+    splits = task[0].split('.')
+    owner = splits[0]
+    tableName = splits[1]
+    tableid = task[3]
+    if len(task) > 5:
+        with range_lock:
+            status = range_status[str(tableid)]
+            status['failed'].append("%s: %s"%(task[7],str(exp)))
+            range_status[str(tableid)] = status
+        if len(status['done']) + len(status['failed']) != task[6]:
+            return
+        exp = Exception("Extraction of parts of table failed. %s"%("; ".join(status['failed'])))
+    qFail.put((owner,tableName,tableid,exp))
+
+# Function which returns True if a node has a live extraction process
+def node_has_workers(workers, worker_args, node_index):
+    for proc, worker_id in workers.values():
+        if worker_args[worker_id][0] == node_index:
+            return True
+    return False
+
+# Function which moves all tasks of scheduler queue source into scheduler queue target
+def move_queue_tasks(source, target):
+    moved = 0
+    while True:
+        try:
+            target.put(source.get_nowait())
+        except queue.Empty:
+            return moved
+        moved = moved + 1
+
+# Function which samples health of an MPX node on its connection conn
+# Returns (health, CPU sample) where health has temp space usage in percent ('temp_pct'), CPU usage of
+# IQ server in percent of its cores since previous CPU sample ('cpu_pct') and number of connections other than
+# extraction connections of the node ('user_conn'). A value which can't be computed is None.
+# extract_conns is the list of connection numbers of extraction sessions of the node
+def node_health(conn, cores, last_cpu, extract_conns):
+    cursor = conn.cursor()
+    cursor.execute("""select max("Usage") from sp_iqdbspace() where DBSpaceType like '%TEMP%'""")
+    row = cursor.fetchone()
+    temp_pct = float(row[0]) if row and row[0] is not None else None
+
+    exclude = " and ConnHandle not in (%s)"%(",".join([str(number) for number in extract_conns])) if extract_conns else ""
+    cursor.execute("select count(*) from sp_iqconnection() where ConnHandle != connection_property('Number')%s"%(exclude))
+    user_conn = int(cursor.fetchone()[0])
+
+    cursor.execute("select property('ProcessCPU')")
+    cpu_sample = (time.time(), float(cursor.fetchone()[0]))
+    cursor.close()
+    cpu_pct = None
+    if last_cpu is not None and cores and cpu_sample[0] > last_cpu[0]:
+        cpu_pct = (cpu_sample[1] - last_cpu[1]) * 100.0 / ((cpu_sample[0] - last_cpu[0]) * cores)
+    return {'temp_pct': temp_pct, 'cpu_pct': cpu_pct, 'user_conn': user_conn}, cpu_sample
+
+# Function which returns (number of active extraction slots of a node, reason of change or None) from its health
+# Slots are halved when a health value is above its Throttle_Max_* limit and grown by one when all values are
+# below throttle_resume_ratio of their limits, between Throttle_Min_Conn and the connections of the node
+def throttle_slots(slots, max_slots, health):
+    min_slots = min(common.throttle_min_conn, max_slots)
+    limits = [('temp space usage', health['temp_pct'], common.throttle_max_temp_pct, '%'),
+              ('CPU usage', health['cpu_pct'], common.throttle_max_cpu_pct, '%'),
+              ('other connections', health['user_conn'], common.throttle_max_user_conn or None, '')]
+    overloaded = []
+    below = True
+    for name, value, limit, unit in limits:
+        if value is None or limit is None:
+            continue
+        if value > limit:
+            overloaded.append("%s %d%s above %s%s"%(name,value,unit,limit,unit))
+        if value >= limit * throttle_resume_ratio:
+            below = False
+    if overloaded and slots > min_slots:
+        return max(min_slots, slots // 2), ", ".join(overloaded)
+    if below and slots < max_slots:
+        return slots + 1, "node is below its limits"
+    return slots, None
+
+# Function which runs in a thread of extract_main and sets number of active extraction slots of every node
+# in node_slots from health of the node sampled every Throttle_Interval_Sec, till stop is set
+# Extraction processes of a node with slot number not less than its active slots pause before their next table.
+# A node whose health can't be sampled keeps its slots.
+def extraction_throttle(node_slots, node_cores, node_workers, worker_heartbeat, stop):
+    conns = [None] * nodes_count
+    last_cpu = [None] * nodes_count
+    while not stop.wait(common.throttle_interval):
+        for i in range(nodes_count):
+            node = node_name(connection_list[i][0][1])
+            max_slots = len(connection_list[i])
+            try:
+                if conns[i] is None:
+                    conns[i] = pyodbc.connect(connection_list[i][0][0], timeout=60)
+                extract_conns = [worker_heartbeat.get(worker_id, {}).get('connection') for worker_id in node_workers[i]]
+                health, last_cpu[i] = node_health(conns[i], node_cores[i], last_cpu[i], [number for number in extract_conns if number is not None])
+            except Exception as exp:
+                logging.warning("Health of node %s could not be sampled, its extraction connections are not changed: %s"%(node,str(exp)))
+                if conns[i] is not None:
+                    try:
+                        conns[i].close()
+                    except Exception:
+                        pass
+                conns[i] = None
+                last_cpu[i] = None
+                continue
+            slots = node_slots[i]
+            new_slots, reason = throttle_slots(slots, max_slots, health)
+            if new_slots != slots:
+                node_slots[i] = new_slots
+                logging.info("Extraction connections of node %s changed from %s to %s: %s"%(node,slots,new_slots,reason))
+    for conn in conns:
+        if conn is not None:
+            conn.close()
+
+# Function which waits while slot of an extraction process is paused by extraction_throttle
+# Session of the process is closed while it waits, so that it does not hold a connection on IQ server.
+# Waiting ends when there is no table left in queues of the node, so that the process can finish.
+# Returns the session of the process, None if it is closed
+def wait_for_slot(thread_budget, slot, q, conn, worker_status, tasks_done):
+    node, node_slots = thread_budget[2], thread_budget[5]
+    if slot < node_slots.get(node, slot + 1):
+        return conn
+    logging.info("Extraction process %s paused by throttle"%(worker_status[1]))
+    report_worker_state(worker_status, 'throttled', None, tasks_done)
+    close_extract_session(conn)
+    while slot >= node_slots.get(node, slot + 1) and sum([sched_q.qsize() for sched_q in q]) != 0:
+        time.sleep(throttle_poll_interval)
+    logging.info("Extraction process %s resumed"%(worker_status[1]))
+    return None
+
 # Function which will do parallel extraction and extract data of tables
 # At the end it will also check if all tables are extracted or not
 def extract_main(batch):
@@ -2725,79 +3984,182 @@ def extract_main(batch):
 
     qSuccess = multiprocessing.Queue()
     qFail = multiprocessing.Queue()
-    file_write_lock = multiprocessing.Lock()
+    qMetrics = multiprocessing.Queue()
     connect_list(connectstr)
 
     extract_fun = extract_single
 
     if batch != 0:
-        global extractedFailures_err
+        global extractedFailures_err, extractedTables_out
         extractedFailures_err = "%s%sextractFailure_Batch_%s.err" % (migrationpath, path_sep, batch)
+        extractedTables_out = "%s%sExtractedTables_Batch_%s.out" % (migrationpath, path_sep, batch)
 
     if os.path.isfile(extractedFailures_err):
         os.remove(extractedFailures_err)
 
-    process_trackers = []
-    restart_counts = {}  # Track restarts for each conn_info
-    RESTART_LIMIT = 3    # Max restarts allowed per connection
-
+    failure_classes.clear()
+    restart_counts = {}  # Track restarts for each extraction process
+    RESTART_LIMIT = 3    # Max restarts allowed per extraction process
+
+    # Largest first share queues of tables (one shared by all nodes or one per node with node weights)
+    # and one queue per node for tables with node affinity
+    sched_manager = ExtractManager()
+    sched_manager.start()
+    range_status = sched_manager.dict()
+    range_lock = sched_manager.Lock()
+    # Cores of each node are shared among active extractions of that node
+    active_extractions = sched_manager.dict()
+    budget_lock = sched_manager.Lock()
+    node_cores = list(connection_cores)
+    # State and heartbeat of each extraction process, reported by the process itself
+    worker_state = sched_manager.dict()
+    worker_heartbeat = sched_manager.dict()
+    # Number of active extraction slots of each node, all connections of a node till throttle reduces them
+    node_slots = sched_manager.dict()
+    for i in range(nodes_count):
+        node_slots[i] = len(connection_list[i])
+    share_queues, node_queues = fill_scheduler_queues(sched_manager, [node_connect_list[0][1] for node_connect_list in connection_list], range_status, batch, qSuccess, qFail)
+
+    # Status of tables is written by threads of this process, extraction processes only post it
+    get_state_conn()
+    status_writers = start_status_writers(qSuccess, qFail, qMetrics, batch)
+    # Load utility in pipeline mode loads tables while extraction is running
+    state_store.set_run_state(state_conn, 'extraction', 'running')
+
+    # Arguments of each extraction process, a dead process is restarted with its own arguments
+    worker_args = {}
+    workers = {}
+    node_workers = []
     for i in range(nodes_count):
         node_connect_list = connection_list[i]
-        node_extract_list = extract_list[i]
-        nodesqueue = multiprocessing.Queue()
-        for item in node_extract_list:
-            nodesqueue.put(item)
-
-        node_processes = []
-
-        def start_worker(conn_info):
-            p = multiprocessing.Process(
-                target=extract_fun,
-                args=(nodesqueue, conn_info, total_table, batch, log_q, qSuccess, qFail, tables_count, fail_count, file_write_lock)
-            )
+        nodesqueue = tuple([node_queues[i]] + share_queues[i:] + share_queues[:i])
+        thread_budget = (active_extractions, budget_lock, i, node_cores[i], len(node_connect_list), node_slots)
+        node_workers.append([])
+        for j, conn_info in enumerate(node_connect_list):
+            worker_id = "%s#%s"%(node_name(conn_info[1]), j + 1)
+            worker_args[worker_id] = (i, (nodesqueue, conn_info, log_q, qSuccess, qFail, range_status, range_lock, thread_budget, (worker_state, worker_id, worker_heartbeat), qMetrics, j))
+            node_workers[i].append(worker_id)
+            p = multiprocessing.Process(target=extract_fun, args=worker_args[worker_id][1])
             p.start()
-            return p
-
-        for conn_info in node_connect_list:
-            p = start_worker(conn_info)
-            node_processes.append((p, conn_info))
-            restart_counts[conn_info] = 0  # Initialize restart count
-
-        process_trackers.append((nodesqueue, node_processes))
-
-    # Monitor and restart dead processes
-    while any(nodesqueue.qsize() > 0 for nodesqueue, _ in process_trackers):
-        for nodesqueue, node_processes in process_trackers:
-            for idx, (proc, conn_info) in enumerate(node_processes):
-                if not proc.is_alive():
-                    if nodesqueue.qsize() > 0:
-                        if restart_counts[conn_info] < RESTART_LIMIT:
-                            logging.warning(f"Restarting dead process for {conn_info} (attempt {restart_counts[conn_info] + 1})")
-                            new_proc = multiprocessing.Process(
-                                target=extract_fun,
-                                args=(nodesqueue, conn_info, total_table, batch, log_q, qSuccess, qFail, tables_count, fail_count, file_write_lock)
-                            )
-                            new_proc.start()
-                            node_processes[idx] = (new_proc, conn_info)
-                            restart_counts[conn_info] += 1
-                        else:
-                            logging.error(f"Restart limit exceeded for connection: {conn_info}. No further restart attempts.")
-        time.sleep(5)
-
-    # Ensure all processes have completed
-    for _, node_processes in process_trackers:
-        for proc, _ in node_processes:
+            workers[p.sentinel] = (p, worker_id)
+            restart_counts[worker_id] = 0
+
+    # Extraction connections of each node follow its health
+    throttle_stop = threading.Event()
+    if common.throttle_interval != 0:
+        throttle_thread = threading.Thread(target=extraction_throttle, args=(node_slots, node_cores, node_workers, worker_heartbeat, throttle_stop))
+        throttle_thread.daemon = True
+        throttle_thread.start()
+
+    # Wait for extraction processes to exit. A process exits with code 0 when no table is left for its node.
+    # A process which dies is restarted immediately and the task it was extracting is given back.
+    # Connection of a process whose lease expired is dropped on IQ server, so that its statement fails and
+    # the process retries or fails the task itself. A process which still holds the same lease after
+    # lease_stop_grace seconds is terminated, its task is given back in the same way and it is restarted
+    # without counting in its restart limit.
+    tasks_done = {}
+    lost_tasks = {}
+    expired_workers = {}
+    cancelled_leases = {}
+    while workers:
+        ready = wait(list(workers), timeout=lease_heartbeat_interval)
+        state_store.set_run_state(state_conn, 'extraction', 'running')
+        for sentinel in ready:
+            proc, worker_id = workers.pop(sentinel)
             proc.join()
+            cancelled_leases.pop(worker_id, None)
+            state = worker_state.get(worker_id, {})
+            tasks_done[worker_id] = tasks_done.get(worker_id, 0) + state.get('tasks_done', 0)
+            if proc.exitcode == 0:
+                logging.info("Extraction process %s finished, number of tables/parts extracted: %s"%(worker_id,tasks_done[worker_id]))
+                continue
+
+            expired = expired_workers.pop(worker_id, False)
+            if expired:
+                reason = "was stopped as its lease expired"
+            else:
+                reason = "died"
+                logging.error("Extraction process %s died with exit code %s"%(worker_id,proc.exitcode))
+            node_index, args = worker_args[worker_id]
+            # Lost task of a node which has no process left is given back in share queue, so that other nodes extract it
+            restart = expired or restart_counts[worker_id] < RESTART_LIMIT
+            lost_q = node_queues[node_index]
+            if not restart and not node_has_workers(workers, worker_args, node_index):
+                lost_q = share_queues[min(node_index, len(share_queues) - 1)]
+            if state.get('state') in ('extracting', 'retry_wait'):
+                handle_lost_task(state['task'], worker_id, reason, lost_tasks, lost_q, args[7], qFail, range_status, range_lock)
+            if expired:
+                logging.warning("Restarting extraction process %s"%(worker_id))
+                worker_state[worker_id] = {}
+                new_proc = multiprocessing.Process(target=extract_fun, args=args)
+                new_proc.start()
+                workers[new_proc.sentinel] = (new_proc, worker_id)
+            elif restart_counts[worker_id] < RESTART_LIMIT:
+                restart_counts[worker_id] += 1
+                logging.warning("Restarting dead extraction process %s (attempt %s)"%(worker_id,restart_counts[worker_id]))
+                worker_state[worker_id] = {}
+                new_proc = multiprocessing.Process(target=extract_fun, args=args)
+                new_proc.start()
+                workers[new_proc.sentinel] = (new_proc, worker_id)
+            else:
+                logging.error("Restart limit exceeded for extraction process %s. No further restart attempts."%(worker_id))
+                if not node_has_workers(workers, worker_args, node_index):
+                    moved = move_queue_tasks(node_queues[node_index], share_queues[min(node_index, len(share_queues) - 1)])
+                    if moved != 0:
+                        logging.warning("No extraction process is left on node %s, its %s tables/parts with node affinity will be extracted by other nodes"%(node_name(args[1][1]),moved))
+
+        # Statement of an expired lease is cancelled on IQ server. Process is terminated only if it does not
+        # leave the lease in lease_stop_grace seconds, as it may hold a lock of the scheduler manager.
+        for sentinel in list(workers):
+            proc, worker_id = workers[sentinel]
+            if worker_id in expired_workers:
+                continue
+            state = worker_state.get(worker_id, {})
+            if worker_id in cancelled_leases:
+                started, cancel_time = cancelled_leases[worker_id]
+                if state.get('state') != 'extracting' or state.get('started') != started:
+                    del cancelled_leases[worker_id]
+                elif time.time() - cancel_time > lease_stop_grace:
+                    logging.error("Extraction process %s did not stop extraction of %s [tableID: %s] in %s seconds after its connection was dropped, it is terminated"%(worker_id,state['task'][0],state['task'][3],lease_stop_grace))
+                    proc.terminate()
+                    expired_workers[worker_id] = True
+                    del cancelled_leases[worker_id]
+                continue
+            heartbeat = worker_heartbeat.get(worker_id, {})
+            reason = lease_expiry(state, heartbeat)
+            if reason is None:
+                continue
+            logging.error("Lease of %s [tableID: %s] held by extraction process %s expired: %s"%(state['task'][0],state['task'][3],worker_id,reason))
+            cancel_extract_connection(worker_args[worker_id][1][1][0], heartbeat.get('connection'), worker_id)
+            cancelled_leases[worker_id] = (state['started'], time.time())
+    throttle_stop.set()
+    if common.throttle_interval != 0:
+        throttle_thread.join()
+    # Tasks left in queues once all extraction processes have exited (for example given back after processes of
+    # other nodes finished) are added in failure file, so that no table is left out silently
+    for sched_q in node_queues + share_queues:
+        while True:
+            try:
+                task = sched_q.get_nowait()[2]
+            except queue.Empty:
+                break
+            logging.error("Table %s [tableID: %s] was not extracted as no extraction process was left to extract it"%(task[0],task[3]))
+            fail_lost_task(task, Exception("No extraction process was left to extract the table"), qFail, range_status, range_lock)
+    sched_manager.shutdown()
+    stop_status_writers(qSuccess, qFail, qMetrics, status_writers)
+    state_store.set_run_state(state_conn, 'extraction', 'finished')
+    # Batch with only rowid ranges of tables completed in later batches has no extracted table
+    if batch != 0 and not os.path.isfile(extractedTables_out):
+        codecs.open(extractedTables_out, "a", common.charset).close()
 
 
     total_elap_sec = common.elap_time(start)
     days, hours, minutes, seconds = common.calculate_time(total_elap_sec)
 
     logging.info("Data unload completed.")
-
-    if batch != 0:
-        global extractedTables_out
-        extractedTables_out="%s%sExtractedTables_Batch_%s.out"%(migrationpath,path_sep,batch)
+    if failure_classes:
+        str1 = "Extraction failures: %s permanent, %s transient which failed again after %s retries. Please check %s"%(failure_classes.get('permanent', 0),failure_classes.get('transient', 0),common.max_retries,extractedFailures_err)
+        common.print_and_log(str1)
 
     table_cnt = extracted_tables_count(extractedTables_out)
     str1 = "Total number of unloaded tables = %s"%table_cnt
@@ -2818,10 +4180,12 @@ def count_batches_generated():
     return count
 
 # Function to delete all the previous batch data files in datapath except the sql file
+# extractinfo files are kept, they are read to form load table statement of a table extracted in different batches
+# manifest files are kept, they are read by load utility to verify upload
 def delete_previous_extracted_batch_data():
     for dirpath, dirnames, filenames in os.walk(datapath):
         for f in filenames:
-            if not f.endswith('.sql'):
+            if not f.endswith('.sql') and not f.endswith('extractinfo') and not f.endswith('manifest'):
                 try:
                     os.remove(os.path.join(dirpath,f))
                 except Exception as e:
@@ -2897,6 +4261,9 @@ def extracted_batch_file_exist():
                                     "If you choose to do the latter, you will have to manually extract and load the tables that could not be automatically extracted.%s"%newline ,
                                     "Preferred way would to complete all table extraction before proceeding to the load phase.%s"%newline ,
                                     "Please refer to the user documentation for more details."))
+    if common.batch_mode == 'unattended':
+        unattended_batch_extraction(count)
+        return
     while batch  <= count:
         extractedTables_out_btch="%s%sExtractedTables_Batch_%s.out"%(migrationpath,path_sep,batch)
         if os.path.isfile(extractedTables_out_btch):
@@ -2985,6 +4352,189 @@ def extracted_batch_file_exist():
              current_batch_extraction(batch,count)
              break
 
+# Function which returns True if directory of an extracted table or part of table has data files
+# Load table statement (<table id>.sql), extractinfo and manifest are not data files
+def data_files_exist(directory):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for f in filenames:
+            if not f.endswith('.sql') and not f.endswith('extractinfo') and not f.endswith('manifest'):
+                return True
+    return False
+
+# Function which deletes data files of directory of an extracted table or part of table
+# Load table statement and manifest are kept, extractinfo is kept if keep_extractinfo is True
+def delete_data_files(directory, keep_extractinfo):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for f in filenames:
+            if not f.endswith('.sql') and not f.endswith('manifest') and not (keep_extractinfo and f.endswith('extractinfo')):
+                try:
+                    os.remove(os.path.join(dirpath,f))
+                except Exception as e:
+                    logging.info( e )
+
+# Function which returns directory of a rowid range of a table extracted in different batches
+# Name of the directory is same as given by table_rowid_ranges
+def batch_part_dir(tableid, part):
+    return table_part_dir(tableid, "range_%s"%(part))
+
+# Function which uploads a directory under Migration_Data to data lake Files by copy_data_to_hdlfs.sh
+# copy_data_to_hdlfs.sh verifies size of each copied file and exits with non-zero status if any file is not copied
+# Returns True if all files are copied
+def upload_extracted_dir(env_vars, directory):
+    env_vars["UPLOAD_DIR"] = directory
+    output = subprocess.run(['bash', 'copy_data_to_hdlfs.sh'], env=env_vars, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output.returncode == 0
+
+# Function which uploads data of extracted tables of a batch to data lake Files
+# It runs in a thread while next batch is extracted. Upload status of tables is recorded in state database.
+# Rowid ranges of tables extracted in different batches are uploaded part by part, as soon as they are extracted.
+def upload_batch_data(batch):
+    conn = state_store.open_state(state_db)
+    env_vars = os.environ.copy()
+    env_vars["ENDPOINT"] = common.hdlfs_files_endpoint
+    env_vars["EXTRACT_PATH"] = common.shared_path
+    env_vars["DEST_FOLDER"] = common.hdlfs_directory
+    env_vars["CERT_PATH"] = common.hdlfs_cert_path
+    env_vars["KEY_PATH"] = common.hdlfs_key_path
+    env_vars["UPLOAD_LOG"] = "%s%supload_log_Batch_%s.log"%(migrationpath,path_sep,batch)
+    strt = datetime.datetime.now()
+    logging.info("Upload of batch = %s to data lake Files started"%(batch))
+    uploaded = 0
+    failed = 0
+
+    part_tables = set()
+    for row in state_store.batch_parts(conn, batch):
+        part_tables.add(row[0])
+        tableid = row[3]
+        for part, nparts, part_batch, upload_status in state_store.table_batch_parts(conn, row[0]):
+            if upload_status == 'verified' or not data_files_exist(batch_part_dir(tableid, part)):
+                continue
+            try:
+                if upload_extracted_dir(env_vars, batch_part_dir(tableid, part)):
+                    state_store.record_part_upload(conn, row[0], part, 'verified')
+                else:
+                    state_store.record_part_upload(conn, row[0], part, 'failed')
+                    logging.error("Upload of part %s of table %s [tableID: %s] to data lake Files failed. Please check file %s"%(part,row[0],tableid,env_vars["UPLOAD_LOG"]))
+            except Exception as exp:
+                state_store.record_part_upload(conn, row[0], part, 'failed')
+                logging.error("Upload of part %s of table %s [tableID: %s] to data lake Files failed: %s"%(part,row[0],tableid,str(exp)))
+
+    for tableName, tableid, row_count, extract_status, upload_status in state_store.batch_tables(conn, batch):
+        if extract_status != 'extracted' or upload_status == 'verified' or row_count == 0:
+            continue
+        if tableName in part_tables:
+            # Data of parts is uploaded above, remaining files of the table are uploaded once all parts are uploaded
+            if [part for part in state_store.table_batch_parts(conn, tableName) if part[3] != 'verified']:
+                state_store.record_upload(conn, tableName, 'failed', "Upload of parts of table failed. Please check file %s"%(env_vars["UPLOAD_LOG"]))
+                failed += 1
+                continue
+        elif not data_files_exist("%s%s%s"%(datapath,path_sep,tableid)):
+            logging.info("No extracted data files of table %s [tableID: %s] found to upload"%(tableName,tableid))
+            continue
+        try:
+            if upload_extracted_dir(env_vars, "%s%s%s"%(datapath,path_sep,tableid)):
+                state_store.record_upload(conn, tableName, 'verified', None)
+                uploaded += 1
+            else:
+                state_store.record_upload(conn, tableName, 'failed', "Please check file %s"%(env_vars["UPLOAD_LOG"]))
+                logging.error("Upload of table %s [tableID: %s] to data lake Files failed. Please check file %s"%(tableName,tableid,env_vars["UPLOAD_LOG"]))
+                failed += 1
+        except Exception as exp:
+            state_store.record_upload(conn, tableName, 'failed', str(exp))
+            logging.error("Upload of table %s [tableID: %s] to data lake Files failed: %s"%(tableName,tableid,str(exp)))
+            failed += 1
+    conn.close()
+    elap_sec = common.elap_time(strt)
+    days, hours, minutes, seconds = common.calculate_time(elap_sec)
+    logging.info("Upload of batch = %s to data lake Files completed. Tables uploaded: %s, failed: %s"%(batch,uploaded,failed))
+    logging.info("Time taken to upload batch = %s is : %d days, %d hours, %d minutes and %d seconds" % (batch, days[0], hours[0], minutes[0], seconds[0]))
+    logging.info("%s"%(common.dividerline))
+
+# Function which waits for upload of a batch and deletes extracted data of its tables
+# Data of a table or part of table whose upload is not verified is kept
+# extractinfo of parts is kept till the table is extracted, it is read to form load table statement of the table
+def finish_batch_upload(upload_thread, batch):
+    upload_thread.join()
+    conn = get_state_conn()
+    kept = 0
+    part_tables = set()
+    for row in state_store.batch_parts(conn, batch):
+        part_tables.add(row[0])
+        for part, nparts, part_batch, upload_status in state_store.table_batch_parts(conn, row[0]):
+            if upload_status == 'verified':
+                delete_data_files(batch_part_dir(row[3], part), True)
+            elif data_files_exist(batch_part_dir(row[3], part)):
+                kept += 1
+    for tableName, tableid, row_count, extract_status, upload_status in state_store.batch_tables(conn, batch):
+        table_dir = "%s%s%s"%(datapath,path_sep,tableid)
+        if tableName in part_tables:
+            if extract_status == 'extracted' and upload_status == 'verified':
+                delete_data_files(table_dir, False)
+        elif extract_status == 'extracted' and upload_status != 'verified' and data_files_exist(table_dir):
+            kept += 1
+        else:
+            delete_data_files(table_dir, False)
+    str1 = "%sExtracted data of batch = %s deleted after upload to data lake Files"%(newline,batch)
+    common.print_and_log(str1)
+    if kept != 0:
+        str1 = "Data of %s tables or parts of tables of batch = %s is kept as their upload failed. Please run copy_hdlfs.py to copy it."%(kept,batch)
+        common.print_and_log(str1)
+
+# Function which extracts all batches without user input (Batch_Mode Unattended)
+# Batch N is uploaded to data lake Files while batch N+1 is extracted. Data of batch N is deleted once its upload
+# is verified, before batch N+2 is extracted, so extracted data of at most two batches is on disk.
+# Tables failed in a batch are kept in failure backup file and extracted once more in new batches at the end.
+def unattended_batch_extraction(count):
+    upload_thread = None
+    upload_batch = 0
+    rebatched = False
+    batch = 1
+    while batch <= count:
+        extractedTables_out_btch = "%s%sExtractedTables_Batch_%s.out"%(migrationpath,path_sep,batch)
+        extractedFailures_err_batch = "%s%sextractFailure_Batch_%s.err"%(migrationpath,path_sep,batch)
+        if not os.path.isfile(extractedTables_out_btch) or os.path.isfile(extractedFailures_err_batch):
+            str1 = "%sMigration utility will run for batch = %s and iq_tables_Batch_%s.list"%(newline,batch,batch)
+            common.print_and_log(str1)
+            tables_count.value = 0
+            fail_count.value = 0
+            total_table.value = 0
+            empty_table_count.value = 0
+            if os.path.isfile(extractedTables_out_btch):
+                resume_formlist_tobeunloaded(batch)
+            else:
+                formlist_tobeunloaded(batch)
+            extract_main(batch)
+            if os.path.isfile(extractedFailures_err_batch):
+                extractedFailures_err_bk = "%s%sextractFailure_Batch_%s.err.bk"%(migrationpath,path_sep,batch)
+                shutil.copyfile(extractedFailures_err_batch,extractedFailures_err_bk)
+                os.remove(extractedFailures_err_batch)
+
+        if upload_thread is not None:
+            finish_batch_upload(upload_thread, upload_batch)
+        upload_thread = threading.Thread(target=upload_batch_data, args=(batch,))
+        upload_thread.start()
+        upload_batch = batch
+        batch = batch + 1
+
+        if batch > count and not rebatched and (os.path.isfile(no_extraction_file) or count_failure_backup_files() != 0):
+            rebatched = True
+            failure_and_noextraction_file_batches()
+            count = count_batches_generated()
+            if count >= batch:
+                str1 = "%sTotal new batches generated from failed and no_extraction tables = %s"%(newline,count - batch + 1)
+                common.print_and_log(str1)
+
+    if upload_thread is not None:
+        finish_batch_upload(upload_thread, upload_batch)
+
+    print_batch_extraction_summary()
+    combine_extracted_output(count)
+    if not os.path.isfile(no_extraction_file) and count_failure_backup_files() == 0:
+        str1 = "%sExtraction and upload of tables from all batches have been completed successfully. Please proceed to load."%newline
+    else:
+        str1 = "%sSome tables could not be extracted. Please check failure backup files and %s, then rerun Migration Utility in resume mode."%(newline,no_extraction_file)
+    common.print_and_log(str1)
+
 # Function which deletes previous batch data and run extraction for next batch
 def current_batch_extraction(batch,count):
     # We should not ask for this input when migration utility is running for restart mode, since it is first time, hence this condition
@@ -3028,69 +4578,31 @@ def current_batch_extraction(batch,count):
                 common.print_and_log(str1)
 
 # Function which will combine all batches extractedout into single file
+# The file is exported from state database which has extracted tables of all batches
 def combine_extracted_output(count):
-    batchnum = 1
-    batches_extracted_list = list()
     combine_extractedTables_out = "%s%sExtractedTables.out"%(migrationpath,path_sep)
-    while batchnum  <= count:
-        extractedTables_out_btch="%s%sExtractedTables_Batch_%s.out"%(migrationpath,path_sep,batchnum)
-        if os.path.isfile(extractedTables_out_btch):
-            with codecs.open("%s"%(extractedTables_out_btch), "r", common.charset) as f:
-                for line in f.readlines():
-                    batches_extracted_list.append(line)
-
-        batchnum = batchnum + 1
-
     with codecs.open("%s"%(combine_extractedTables_out), "w", common.charset) as f:
-        for line in batches_extracted_list:
-            f.write(line)
+        for row in state_store.extracted_tables(get_state_conn()):
+            f.write("%s,%s,%s,%s"%(row[0],row[1],row[2],row[3] or "BASE") + newline)
 
 # Function which will make batches from failure files and no_extraction.list file
 # It will also read the batch_size again, so if change, it will make batches according to that.
 def failure_and_noextraction_file_batches():
-    # Get all the table names already unloaded into a list
-    table_already_unloaded = []
-
-    # Get all the table names into a list
-    original_iq_tablelist = []
-
-    extract_file = codecs.open(extractedTables_out,'r', common.charset)
-    lines = extract_file.readlines()
-    for line in lines:
-        line = line.rstrip(newline)
-        splits = line.split(',')
-        table_already_unloaded.append(splits[0])
-    extract_file.close()
-
-    iqtable_file = codecs.open(iqtables_list,'r', common.charset)
-    lines = iqtable_file.readlines()
-    for line in lines:
-        line = line.rstrip(newline)
-        splits = line.split(',')
-        original_iq_tablelist.append(splits[0])
-    iqtable_file.close()
-
-    table_already_extracted_count = len(table_already_unloaded)
-    original_iq_tablelist_count = len(original_iq_tablelist)
+    conn = get_state_conn()
+    original_iq_tablelist_count, table_already_extracted_count = state_store.extract_counts(conn, 0)
 
     print("%s"%(common.dividerline))
     print("%s tables out of %s tables already successfully extracted by previous Batch run of migration utility."%(table_already_extracted_count,original_iq_tablelist_count))
 
-    delta = [item for item in original_iq_tablelist  if item not in table_already_unloaded]
+    delta = state_store.tables_to_extract(conn, 0)
 
     if not delta:
         logging.info("All IQ tables are already processed for data extraction")
     else:
-        for i in delta:
+        for row in delta:
             total_table.value = total_table.value + 1
-            for line in lines:
-                stripped_line = line.rstrip(newline)
-                splits = stripped_line.split(',')
-                if i == splits[0].strip() and (splits[1] != '0'):
-                   if(splits[4]):
-                      extract_list.append((splits[0], splits[1], splits[2], splits[3], splits[4]))
-                   else:
-                      extract_list.append((splits[0], splits[1], splits[2], splits[3] ,"BASE"))
+            if row[1] != 0:
+                extract_list.append((row[0], str(row[1]), str(row[2]), row[3], row[4] or "BASE"))
 
     # remove the no_extraction.list if it exist
     if os.path.isfile(no_extraction_file):
@@ -3130,6 +4642,8 @@ if __name__ == '__main__':
             sys.exit("Error: Please unload schema first before running data-only mode.")
 
         get_inputs(config_file)
+        # Active MPX nodes are counted so that data is extracted by all of them
+        mpx_verify(connectstr)
         check_create_dataextractdir()
 
         #global batch
@@ -3137,6 +4651,7 @@ if __name__ == '__main__':
         if common.batch_size != 0:
             batch = 1
         check_and_create_iq_tables_file(connectstr)
+        load_table_metadata_cache(connectstr)
 
         if batch != 0:
             extracted_batch_file_exist()
@@ -3162,6 +4677,7 @@ if __name__ == '__main__':
         if common.batch_size != 0:
             batch = 1
         check_and_create_iq_tables_file(connectstr)
+        load_table_metadata_cache(connectstr)
 
         if batch != 0:
             extracted_batch_file_exist()